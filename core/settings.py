@@ -239,10 +239,19 @@ CSRF_TRUSTED_ORIGINS = [
 
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 
+# main/caching.py and main/reference_data.py are invalidated by signals, which
+# only reach other processes (e.g the other gunicorn workers) through a cache
+# shared between them. LocMemCache is per process: deployments running
+# several processes should set CACHE_BACKEND and CACHE_LOCATION to a shared
+# backend (e.g django.core.cache.backends.redis.RedisCache with a redis://
+# url, which needs the redis package). Otherwise other processes can serve
+# cached data for up to the timeouts in main/caching.py and
+# ReferenceData.MAX_AGE in main/reference_data.py.
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-        "LOCATION": "speedy",
+        "BACKEND": os.environ.get(
+            'CACHE_BACKEND', "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get('CACHE_LOCATION', "speedy"),
     }
 }
 
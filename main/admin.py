@@ -4,7 +4,8 @@ FileGroup, Image, ReactionType, Reaction, ViewLog, Comment, Review, Genre,
 ArticleCategory, Article, Seller, ProductCategory, License,
 ProductRating, Product, ProductXImage, ProductItem, ProductItemXLicense,
 ProductXLicense, Contest, ContestEntry, ProductLibrary, 
-ProductLibraryXXProductXLicense, ArtworkVariant)
+ProductLibraryXXProductXLicense, ArtworkVariant, RelatedProduct,
+FollowSuggestion, ReactionCount)
 
 # filepond
 from django_drf_filepond.models import TemporaryUpload
@@ -57,6 +58,9 @@ admin.site.register(ContestEntry)
 admin.site.register(ProductLibrary)
 admin.site.register(ProductLibraryXXProductXLicense)
 admin.site.register(ArtworkVariant)
+admin.site.register(RelatedProduct)
+admin.site.register(FollowSuggestion)
+admin.site.register(ReactionCount)
 
 
 # wagtail
@@ -0,0 +1,171 @@
+import hashlib
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db.models import Q, Count
+
+# models
+from main.models import ProductCategory, Seller
+
+
+class ProductFacets:
+    '''computes facet counts (e.g number of products per category subtree,
+    license, maturity rating, seller and price band) for the CURRENT filter
+    set of a product queryset, so that they can be returned alongside the
+    paginated results of ProductList.
+
+    The license, maturity and price facets are conditional counts computed
+    together in one aggregate query; the category and seller facets are
+    grouped aggregate queries. The counts are cached briefly per filter set
+    so that paging through the same results doesn't recompute them.'''
+
+    FACETS = ['category', 'license', 'is_mature', 'seller', 'price']
+
+    # facets made of conditional counts, computed together in one query
+    AGGREGATED_FACETS = ['license', 'is_mature', 'price']
+
+    # (band label, minimum price, maximum price). None means unbounded.
+    PRICE_BANDS = [
+        ('free', 0, 0),
+        ('1-999', 1, 999),
+        ('1000-4999', 1000, 4999),
+        ('5000-19999', 5000, 19999),
+        ('20000+', 20000, None),
+    ]
+
+    # only the sellers with the most products are listed in the seller facet
+    SELLER_LIMIT = 20
+
+    CACHE_TIMEOUT = 60 # seconds
+
+    def __init__(self, products_query, facets=None):
+        '''
+        - products_query: the filtered Product queryset (ordering is ignored)
+        - facets: names of the facets to compute. All facets if not given.
+        Unknown names are ignored.
+        '''
+        # clear the ordering so it doesn't leak into the GROUP BY clauses
+        self.products_query = products_query.order_by()
+        self.facets = [facet for facet in (facets or self.FACETS)
+                       if facet in self.FACETS]
+
+    def cache_key(self):
+        try:
+            sql, params = self.products_query.query.sql_with_params()
+        except EmptyResultSet:
+            # e.g Product.objects.none()
+            sql, params = 'empty', ()
+        digest = hashlib.md5(
+            f"{sql}|{params}|{self.facets}".encode()).hexdigest()
+        return f"product_facets_{digest}"
+
+    def counts(self):
+        '''returns a dictionary of {facet name: counts}'''
+        key = self.cache_key()
+        counts = cache.get(key)
+        if counts is None:
+            counts = self.aggregate_facets(
+                [facet for facet in self.facets
+                 if facet in self.AGGREGATED_FACETS])
+            for facet in self.facets:
+                if facet not in counts:
+                    counts[facet] = getattr(self, f"count_{facet}")()
+            counts = {facet: counts[facet] for facet in self.facets}
+            cache.set(key, counts, self.CACHE_TIMEOUT)
+        return counts
+
+    def aggregate_facets(self, facets):
+        '''computes the given AGGREGATED_FACETS with ONE aggregate query
+        (a single scan of the products), combining the conditional counts
+        of each facet'''
+        if not facets:
+            return {}
+        aggregates = {}
+        for facet in facets:
+            aggregates.update(getattr(self, f"{facet}_aggregates")())
+        row = self.products_query.aggregate(**aggregates)
+        return {facet: getattr(self, f"{facet}_counts")(row)
+                for facet in facets}
+
+    def count_category(self):
+        '''number of products within each category SUBTREE (a product in
+        /tutorials/books is counted under both /tutorials/books and
+        /tutorials)'''
+        direct_counts = self.products_query.values('category_id').annotate(
+            count=Count('id'))
+
+        categories = {
+            id: (parent_id, path) for id, parent_id, path in
+            ProductCategory.objects.values_list('id', 'parent_id', 'path')}
+
+        subtree_counts = {}
+        for row in direct_counts:
+            category_id = row['category_id']
+            visited_ids = set()
+            # add the count to the category and each of its ancestors
+            while category_id in categories and category_id not in visited_ids:
+                visited_ids.add(category_id)
+                subtree_counts[category_id] = \
+                    subtree_counts.get(category_id, 0) + row['count']
+                category_id = categories[category_id][0]
+
+        return sorted([
+            {'id': id, 'path': categories[id][1], 'count': count}
+            for id, count in subtree_counts.items()],
+            key=lambda facet: facet['path'])
+
+    def license_aggregates(self):
+        # from the denormalized flags, rather than a subquery per product
+        return {
+            'license_free': Count('id', filter=Q(has_free_license=True)),
+            'license_paid': Count('id', filter=Q(has_paid_license=True))}
+
+    def license_counts(self, row):
+        return {'free': row['license_free'], 'paid': row['license_paid']}
+
+    def count_license(self):
+        '''number of products offering a free license and number of products
+        offering a paid license (a product can be in both)'''
+        return self.aggregate_facets(['license'])['license']
+
+    def is_mature_aggregates(self):
+        return {'is_mature_true': Count('id', filter=Q(is_mature=True)),
+                'is_mature_false': Count('id', filter=Q(is_mature=False))}
+
+    def is_mature_counts(self, row):
+        return {'true': row['is_mature_true'],
+                'false': row['is_mature_false']}
+
+    def count_is_mature(self):
+        return self.aggregate_facets(['is_mature'])['is_mature']
+
+    def count_seller(self):
+        # grouped on the seller_id column alone; the aliases of the sellers
+        # are then loaded with one query instead of joined to every product
+        seller_counts = dict(self.products_query.values('seller_id').annotate(
+            count=Count('id')).values_list('seller_id', 'count'))
+        aliases = dict(Seller.objects.filter(
+            id__in=seller_counts).values_list('id', 'alias'))
+        rows = sorted(
+            ({'alias': aliases[seller_id], 'count': count}
+             for seller_id, count in seller_counts.items()),
+            key=lambda row: (-row['count'], row['alias']))
+        return rows[:self.SELLER_LIMIT]
+
+    def price_aggregates(self):
+        # banded by the price of the cheapest license (Product.min_price)
+        aggregates = {}
+        for i, (label, minimum, maximum) in enumerate(self.PRICE_BANDS):
+            condition = Q(min_price__gte=minimum)
+            if maximum is not None:
+                condition &= Q(min_price__lte=maximum)
+            aggregates[f"price_band_{i}"] = Count('id', filter=condition)
+        return aggregates
+
+    def price_counts(self, row):
+        return [{'band': label, 'count': row[f"price_band_{i}"]}
+                for i, (label, minimum, maximum)
+                in enumerate(self.PRICE_BANDS)]
+
+    def count_price(self):
+        return self.aggregate_facets(['price'])['price']
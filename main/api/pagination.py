@@ -1,4 +1,4 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 
 class ArtworkPaginationConfig(PageNumberPagination):
     page_size = 50
@@ -30,6 +30,13 @@ class CommentPaginationConfig(PageNumberPagination):
     max_page_size = 500
 
 
+class CommentThreadPaginationConfig(PageNumberPagination):
+    '''paginates top-level comments (each with its replies)'''
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
 class ReviewPaginationConfig(PageNumberPagination):
     page_size = 50
     page_size_query_param = 'page_size'
@@ -58,4 +65,13 @@ class ContestPaginationConfig(PageNumberPagination):
     page_size = 50
     page_size_query_param = 'page_size'
     max_page_size = 500
-    
\ No newline at end of file
+    
+
+
+class ProductLibraryPaginationConfig(CursorPagination):
+    '''cursor-based, so that items added to the library while paging don't
+    shift pages. Most recently added first.'''
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = '-id'
@@ -9,6 +9,7 @@ ProductCategory, ProductRating, ProductItem, License, ProductXLicense,
 Contest, ArtworkVariant)
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count
 
 # imported serializers
 from user.api.serializers import UserReadOnlySerializer
@@ -31,20 +32,13 @@ class ArtistSerializer(serializers.ModelSerializer):
     # user = serializers.StringRelatedField(many=False)
     #-------------------------------------------------------------
 
-    # custom serializer fields
-    followers = serializers.SerializerMethodField()
-    following = serializers.SerializerMethodField()
-
-    # methods to get the custom fields (syntax: get_<custom serializer field>)
-    def get_followers(self, object):
-        return object.followers.count()
-
-    def get_following(self, object):
-        return object.following.count()
+    # custom serializer fields (from the denormalized count columns)
+    followers = serializers.IntegerField(source='followers_count', read_only=True)
+    following = serializers.IntegerField(source='following_count', read_only=True)
 
     class Meta:
         model = Artist
-        fields = '__all__'
+        exclude = ['followers_count', 'following_count']
         extra_kwargs = {
             
         }
@@ -234,11 +228,53 @@ class CommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
         fields = '__all__'
+        read_only_fields = ['path', 'depth', 'root']
         extra_kwargs = {
             'user': {'read_only': True}
         }
 
 
+def prefetch_review_media(reviews):
+    '''resolve the caption and body media (Image or File) of many reviews at
+    once: the media ids are grouped by content type and loaded with one query
+    per type (File with its file_type joined), then cached on the reviews'
+    GenericForeignKeys so that serializing them doesn't query again.'''
+    media_ids = {}
+    for review in reviews:
+        for type_id, media_id in [
+                (review.caption_media_type_id, review.caption_media_id),
+                (review.body_media_type_id, review.body_media_id)]:
+            if type_id and media_id is not None:
+                media_ids.setdefault(type_id, set()).add(media_id)
+
+    media = {}
+    for type_id, ids in media_ids.items():
+        model = ContentType.objects.get_for_id(type_id).model_class()
+        media_query = model.objects.filter(id__in=ids)
+        if any(field.name == 'file_type' for field in model._meta.fields):
+            media_query = media_query.select_related('file_type')
+        for media_object in media_query:
+            media[(type_id, media_object.id)] = media_object
+
+    caption_media_field = Review._meta.get_field('caption_media_object')
+    body_media_field = Review._meta.get_field('body_media_object')
+    for review in reviews:
+        caption_media_field.set_cached_value(review, media.get(
+            (review.caption_media_type_id, review.caption_media_id)))
+        body_media_field.set_cached_value(review, media.get(
+            (review.body_media_type_id, review.body_media_id)))
+
+
+class ReviewListSerializer(serializers.ListSerializer):
+    '''resolves the media of all the reviews (e.g of a page) before
+    serializing them'''
+
+    def to_representation(self, data):
+        reviews = list(data.all() if hasattr(data, 'all') else data)
+        prefetch_review_media(reviews)
+        return super().to_representation(reviews)
+
+
 class ReviewSerializer(serializers.ModelSerializer):
 
     user = UserReadOnlySerializer(many=False, read_only=True)
@@ -341,6 +377,7 @@ class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = '__all__'
+        list_serializer_class = ReviewListSerializer
 
         # media_types and IDs are set False because at POST (creation of
         # Review instance, there isn't yet a file resource to provide the 
@@ -379,6 +416,9 @@ class ArticleSerializer(serializers.ModelSerializer):
             object.pk # object has id.
         except:
             return None
+
+        if not object.thumbnail_image:
+            return None # article without images
         
         return object.thumbnail_image.resource.url
     
@@ -387,6 +427,9 @@ class ArticleSerializer(serializers.ModelSerializer):
             object.pk # object has id.
         except:
             return None
+
+        if not object.thumbnail_image:
+            return None # article without images
         
         return object.thumbnail_image.thumbnail.url
     
@@ -401,6 +444,11 @@ class ArticleSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'html_file': {'required': False},
             'html': {'required': True},
+            'html_etag': {'read_only': True},
+            'excerpt': {'read_only': True},
+            'word_count': {'read_only': True},
+            'reading_time': {'read_only': True},
+            'image_count': {'read_only': True},
         }
 
 
@@ -489,6 +537,19 @@ class ProductItemSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+def prefetch_reviews_counts(products):
+    '''count the reviews (top-level comments) of many products at once, with
+    one grouped query, and store them as product.reviews_count for
+    ProductSerializer.get_stats to read instead of counting per product.'''
+    reviews_counts = dict(Comment.objects.filter(
+        post_type=ContentType.objects.get_for_model(Product),
+        post_id__in=[product.id for product in products],
+        parent_comment=None).values('post_id').annotate(
+            count=Count('id')).values_list('post_id', 'count'))
+    for product in products:
+        product.reviews_count = reviews_counts.get(product.id, 0)
+
+
 class ProductSerializer(serializers.ModelSerializer):
 
     thumbnail_images = serializers.SerializerMethodField()
@@ -500,8 +561,8 @@ class ProductSerializer(serializers.ModelSerializer):
     items = ProductItemSerializer(many=True)
     license_data = serializers.SerializerMethodField()
 
-    # (model @property): the price of the CHEAPEST license for this product
-    price = serializers.SerializerMethodField()
+    # the price of the CHEAPEST license for this product (denormalized column)
+    price = serializers.IntegerField(source='min_price', read_only=True)
 
     def get_thumbnail_images(self, product):
         try:
@@ -542,7 +603,11 @@ class ProductSerializer(serializers.ModelSerializer):
         ratings_sum = sum(list(map(lambda p:p.stars, product.ratings.all())))
         rating_average = round(ratings_sum/ratings_count,1) \
             if ratings_count else None
-        reviews_count = product.comments.filter(parent_comment=None).count()
+        # counted in batch by prefetch_reviews_counts, if it was called
+        reviews_count = getattr(product, 'reviews_count', None)
+        if reviews_count is None:
+            reviews_count = product.comments.filter(
+                parent_comment=None).count()
         
         return {
             'ratings_count': ratings_count,
@@ -557,24 +622,44 @@ class ProductSerializer(serializers.ModelSerializer):
         except:
             return None
         
-        # get related Product X License through table instances
-        productXlicenses = ProductXLicense.objects.filter(product__id=product.id)
+        # get related Product X License through table instances (uses the
+        # prefetched instances if 'productxlicense_set' was prefetched)
+        productXlicenses = product.productxlicense_set.all()
         serialized_productXlicenses = ProductXLicenseSerializer(
             productXlicenses, many=True)
         
         return serialized_productXlicenses.data
     
-    def get_price(self, product):
+    class Meta:
+        model = Product
+        fields = '__all__'
+
+
+class ProductCardSerializer(serializers.ModelSerializer):
+    '''compact representation of a product, for product cards (e.g in the
+    product library), without the items, ratings and license data'''
+
+    seller = serializers.CharField(source='seller.alias', read_only=True)
+    category = serializers.CharField(source='category.path', read_only=True)
+    thumbnail_images = serializers.SerializerMethodField()
+
+    # the price of the CHEAPEST license for this product (denormalized column)
+    price = serializers.IntegerField(source='min_price', read_only=True)
+
+    def get_thumbnail_images(self, product):
         try:
             product.pk # object has id.
         except:
             return None
         
-        return product.price
-    
+        image_urls = list(map(
+            lambda image:image.thumbnail.url, product.thumbnail_images.all()))
+        return image_urls
+
     class Meta:
         model = Product
-        fields = '__all__'
+        fields = ['id', 'title', 'seller', 'category', 'is_mature', 'price',
+                  'thumbnail_images', 'listed']
 
 
 class ContestSerializer(serializers.ModelSerializer):
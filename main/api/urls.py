@@ -15,23 +15,29 @@ urlpatterns = [
     path('art-categories/', views.ArtCategoryList.as_view(), name='art_category_list'),
 
     path('followings/', views.FollowingList.as_view(), name='following_list'),
+    path('followings/suggestions/', views.FollowSuggestionList.as_view(), name='follow_suggestion_list'),
     path('following/follow/<str:other_user>/', views.FollowingList.as_view(), name='follow'),
     path('following/unfollow/<str:other_user>/', views.Unfollow.as_view(), name='unfollow'),
     path('following/status/<str:other_user>/', views.FollowingStatus.as_view(), name='following_status'),
+    path('following/status/', views.FollowingStatusBatch.as_view(), name='following_status_batch'),
 
     path('react/add/<str:reaction_type_name>/<str:model>/<int:instance_id>/', views.React.as_view(), name='react'),
     path('react/remove/<str:reaction_type_name>/<str:model>/<int:instance_id>/', views.UnReact.as_view(), name='unreact'),
     path('react/list/<str:model>/<int:instance_id>/', views.ReactList.as_view(), name='react_list'),
+    path('react/summary/<str:model>/', views.ReactSummaryList.as_view(), name='react_summary_list'),
 
     path('comments/<str:model>/<int:pk>/', views.CommentList.as_view(), name='comment_list'),
+    path('comments/<str:model>/<int:pk>/threads/', views.CommentThreadList.as_view(), name='comment_thread_list'),
     path('comment/<int:pk>/', views.CommentDetail.as_view(), name='comment_detail'),
 
     path('reviews/', views.ReviewList.as_view(), name='review_list'),
     path('review/<int:pk>/', views.ReviewDetail.as_view(), name='review_detail'),
     path('reviews/pending/', views.PendingReviews.as_view(), name='pending_reviews'),
+    path('moderation/counts/', views.ModerationCounts.as_view(), name='moderation_counts'),
 
     path('magazine/articles/', views.ArticleList.as_view(), name='article_list'),
     path('magazine/article/<int:pk>/', views.ArticleDetail.as_view(), name='article_detail'),
+    path('magazine/article/<int:pk>/html/', views.ArticleHTML.as_view(), name='article_html'),
 
     path('resources/categories/', views.ProductCategoryList.as_view(), name='product_category_list'),
     path('resources/products/', views.ProductList.as_view(), name='product_list'),
@@ -41,11 +47,13 @@ urlpatterns = [
     path('resources/seller/<str:alias>/', views.SellerDetail.as_view(), name='seller_detail'),
     path('resources/seller/', views.SellerDetail.as_view(), name='seller_detail'),
     path('resources/product/<int:pk>/', views.ProductDetail.as_view(), name='product_detail'),
+    path('resources/product/<int:pk>/related/', views.ProductRelatedList.as_view(), name='product_related_list'),
     path('resources/licenses/', views.LicenseList.as_view(), name='license_list'),
     path('resources/product/list/', views.ListProduct.as_view(), name='list_product'),
     path('resources/product/unlist/', views.UnlistProduct.as_view(), name='unlist_product'),
     path('resources/product/library/add/', views.ProductLibraryAdd.as_view(), name='product_library_add'),
     path('resources/product/library/list/', views.ProductLibraryList.as_view(), name='product_library_list'),
+    path('resources/product/library/ownership/', views.ProductLibraryOwnership.as_view(), name='product_library_ownership'),
     path('download/product/<int:product_id>/license/<int:license_id>/file/<int:file_id>/', views.ProductDownload.as_view(), name='product_download'),
 
     path('contests/', views.ContestList.as_view(), name='contest_list'),
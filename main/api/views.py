@@ -4,7 +4,9 @@ import time
 from django.conf import settings
 import random
 import os
+import shutil
 from typing import Type, Any
+from contextlib import contextmanager
 
 # models
 from main.models import (
@@ -12,10 +14,12 @@ from main.models import (
     ReactionType, Reaction, ViewLog, Comment, SiteConfigurations, Review,
     Article, ArticleCategory, ProductCategory, Product, Seller, License,
     ProductXImage, ProductItem, ProductXLicense, ProductItemXLicense, Contest,
-    ProductLibrary, ProductLibraryXXProductXLicense, ArtworkVariant)
+    ProductLibrary, ProductLibraryXXProductXLicense, ArtworkVariant,
+    RelatedProduct, FollowSuggestion, ReactionCount)
 from user.models import User
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q
+from django.db.models import Q, Count, prefetch_related_objects
+from django.db import transaction
 
 # serializers
 from .serializers import (
@@ -23,13 +27,14 @@ from .serializers import (
     FollowingSerializer, ReactionSerializer, CommentSerializer,
     ReviewSerializer, ArticleSerializer, ProductSerializer, SellerSerializer,
     ProductItemSerializer, LicenseSerializer, ContestSerializer,
-    UserReadOnlySerializer)
+    UserReadOnlySerializer, ProductCardSerializer, prefetch_reviews_counts)
 
 # response / status
 from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import get_object_or_404
-from django.http import FileResponse
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils.cache import parse_etags, quote_etag
 
 # class-based API views
 from rest_framework.views import APIView
@@ -44,7 +49,8 @@ from rest_framework_simplejwt.authentication import JWTAuthentication
 from user.api.views import get_jwt_access_tokens_for_user
 
 # permissions
-from .permissions import (IsAuthenticated, IsAuthenticatedElseReadOnly,
+from .permissions import (IsAdmin, IsAuthenticated,
+IsAuthenticatedElseReadOnly,
 IsArtworkAuthorElseReadOnly,IsArtistUserElseReadOnly,
 IsCommentAuthorElseReadOnly,
 IsReviewersGroupMemberAndReviewAuthorOrApprovedReadonly,
@@ -54,51 +60,303 @@ IsArticleCreatorsGroupMemberOrReadonly, IsProductSellerElseReadOnly,
 IsContestCreatorsGroupMemberOrReadonly)
 
 # File handling
-import io
 from django.core.files import File as DjangoFile
 from django_drf_filepond.models import TemporaryUpload
 
 # web/html parsing
-from bs4 import BeautifulSoup
+from main.article_html import (ArticleImageError, ingest_article_html,
+                               delete_images, spooled_html_file,
+                               write_sidecars, html_etag,
+                               preferred_sidecar, sidecar_name)
 from urllib.parse import urlparse
 
 # pagination
 from .pagination import (ArtworkPaginationConfig, ArtistPaginationConfig,
 FollowPaginationConfig, ReactionPaginationConfig, CommentPaginationConfig,
 ReviewPaginationConfig, ArticlePaginationConfig, ProductPaginationConfig,
-SellerPaginationConfig, ContestPaginationConfig)
+SellerPaginationConfig, ContestPaginationConfig,
+ProductLibraryPaginationConfig, CommentThreadPaginationConfig)
 
 # caching
 from django.core.cache import cache
+from main.caching import (product_detail_cache_key, PRODUCT_DETAIL_TIMEOUT,
+get_entitlements, owns_license, get_following_ids, get_moderation_counts,
+get_contest_ids, invalidate_contest_ids)
 
+# faceted search
+from .facets import ProductFacets
 
-def store_filepond_upload(upload_id,model_class:Type[Any],file_group:str,file_type=None) -> object:
+# reference data (small lookup tables)
+from main.reference_data import reference_data
+
+
+def store_filepond_upload(upload_id,model_class:Type[Any],file_group,file_type=None,temp_upload=None) -> object:
             # MOVING (not copying) TEMPORARY FILE TO PERMANT FILE
-            # first create fake permanent file from wrapped empty in-memory file (to get the permanent file path)
-            # DELETE the fake permanent file
-            # move temporary uploaded file to path of deleted fake permant file via os rename
-            temp_upload = TemporaryUpload.objects.get(upload_id=upload_id)
-
-            # create Image instance with empty resource to get path for moving temporary upload
-            empty_file = io.StringIO('')
-            empty_file.name = temp_upload.upload_name
-            empty_resource = DjangoFile(empty_file)
-            model_instance = model_class(file_group=FileGroup.objects.get(name='products'))
+            # first get the permanent file name (from the upload_to of the
+            # resource field, without writing anything) and save the instance
+            # with it
+            # then move temporary uploaded file to that path via os rename,
+            # once the transaction (if any) is committed: a rolled back
+            # submission leaves the temporary upload untouched and no
+            # orphaned file behind
+            # (file_group can be a FileGroup name or an already fetched
+            # FileGroup instance, and temp_upload an already fetched
+            # TemporaryUpload, to save queries when storing many uploads)
+            if temp_upload is None:
+                temp_upload = TemporaryUpload.objects.get(upload_id=upload_id)
+            if isinstance(file_group, str):
+                file_group = reference_data.get('file_groups', file_group)
+
+            model_instance = model_class(file_group=file_group)
             if file_type:
                 model_instance.file_type = file_type
-            model_instance.resource = empty_resource
+            resource = model_instance.resource
+            resource.name = resource.storage.get_available_name(
+                resource.field.generate_filename(
+                    model_instance, temp_upload.upload_name),
+                max_length=resource.field.max_length)
             model_instance.save()
-            save_path = model_instance.resource.path
+            save_path = resource.path
+            temp_path = temp_upload.get_file_path()
+
+            def move_temp_upload():
+                os.makedirs(os.path.dirname(save_path), exist_ok=True)
+                os.rename(temp_path, save_path)
+                # delete the temporary upload object
+                temp_upload.delete()
 
-            # delete empty file from permanent save path and replace with temp file
-            os.remove(save_path)
-            os.rename(temp_upload.get_file_path(), save_path)
-            # delete the temporary upload object
-            temp_upload.delete()
+            transaction.on_commit(move_temp_upload)
 
             return model_instance
 
 
+class ProductSubmissionError(Exception):
+    pass
+
+
+class ProductSubmission:
+    '''validates the json data of a product submission (see ProductList.post)
+    and creates the product with all its images, licenses and items as one
+    atomic batch.
+
+    Reference data (category, licenses, file types, file group, temporary
+    uploads) is resolved once up front, duplicates are checked with set logic
+    instead of a query per row, and the through tables are bulk created.
+    The duration of each phase is recorded in self.timings (milliseconds).'''
+
+    # the Product fields a submission may set
+    PRODUCT_FIELDS = ['title', 'description', 'category', 'is_mature', 'tags']
+
+    def __init__(self, data, seller):
+        self.data = data
+        self.seller = seller
+        self.timings = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        yield
+        self.timings[name] = (time.perf_counter() - start) * 1000
+
+    def server_timing(self):
+        '''the phase timings as a Server-Timing header value'''
+        return ', '.join(
+            f"{name};dur={duration:.1f}" for name, duration in self.timings.items())
+
+    @staticmethod
+    def get_file_type_name(product_file_data):
+        try:
+            # if no errors but blank file type
+            file_type_name = product_file_data['file']['fileType'].split('/')[0]
+            if file_type_name.strip() == "":
+                file_type_name = 'other'
+        except:
+            # if any errors
+            file_type_name = 'other'
+        return file_type_name
+
+    @staticmethod
+    def parse_price(price):
+        '''returns the license price as a non-negative int (0 if missing).
+        Raises ProductSubmissionError if it isn't one (e.g "abc", "1.5", -3)'''
+        if price is None or price == '':
+            return 0
+        if isinstance(price, bool):
+            raise ProductSubmissionError("invalid license price")
+        if isinstance(price, float):
+            if not price.is_integer():
+                raise ProductSubmissionError("invalid license price")
+            price = int(price)
+        try:
+            price = int(price)
+        except (TypeError, ValueError):
+            raise ProductSubmissionError("invalid license price")
+        if price < 0:
+            raise ProductSubmissionError("negative license price")
+        return price
+
+    def validate(self):
+        '''raises ProductSubmissionError if the submission is invalid'''
+        with self.phase('validate'):
+            data = self.data
+
+            # get just the submitted Product fields from the dictionary (the
+            # seller, prices, listing and relations are never taken from it)
+            self.product_data = {key:value for key, value in data.items()
+                                 if key in self.PRODUCT_FIELDS}
+            for field in ['title', 'category']:
+                if not self.product_data.get(field):
+                    raise ProductSubmissionError(f"missing product {field}")
+
+            try:
+                category_id = int(self.product_data['category'])
+            except (TypeError, ValueError):
+                raise ProductSubmissionError("invalid product category")
+            self.category = ProductCategory.objects.filter(
+                id=category_id).first()
+            if not self.category:
+                raise ProductSubmissionError("invalid product category")
+
+            try:
+                self.product_licenses = data['product_licenses']
+                self.sample_images = data['sample_images']
+                self.product_files = data['product_files']
+                product_license_ids = [
+                    license['id'] for license in self.product_licenses]
+                file_license_ids = [
+                    [license['id'] for license in product_file_data['licenses']]
+                    for product_file_data in self.product_files]
+                sample_image_upload_ids = [
+                    file_data['file']['serverId']
+                    for file_data in self.sample_images]
+                product_file_upload_ids = [
+                    product_file_data['file']['serverId']
+                    for product_file_data in self.product_files]
+            except (KeyError, TypeError):
+                raise ProductSubmissionError(
+                    "incomplete product licenses, images or files")
+
+            if not product_license_ids:
+                raise ProductSubmissionError("product must have a license")
+
+            self.license_prices = [
+                self.parse_price(license.get('price'))
+                for license in self.product_licenses]
+
+            # duplicate checks (set logic instead of a query per row)
+            if len(set(product_license_ids)) != len(product_license_ids):
+                raise ProductSubmissionError("duplicate product license")
+
+            upload_ids = sample_image_upload_ids + product_file_upload_ids
+            if len(set(upload_ids)) != len(upload_ids):
+                raise ProductSubmissionError("duplicate uploaded file")
+
+            # resolve the reference data once
+            license_ids = set(product_license_ids)
+            for ids in file_license_ids:
+                license_ids.update(ids)
+            try:
+                self.licenses = {
+                    license_id: reference_data.get('licenses', license_id)
+                    for license_id in license_ids}
+            except License.DoesNotExist:
+                raise ProductSubmissionError("invalid license")
+
+            self.temp_uploads = TemporaryUpload.objects.in_bulk(upload_ids)
+            if len(self.temp_uploads) != len(upload_ids):
+                raise ProductSubmissionError("invalid (or expired) upload")
+
+            self.file_group = reference_data.get('file_groups', 'products')
+
+            self.file_type_names = [
+                self.get_file_type_name(product_file_data)
+                for product_file_data in self.product_files]
+            file_types = reference_data.all('file_types')
+            self.file_types = {
+                name: file_types[name] for name in set(self.file_type_names)
+                if name in file_types}
+
+            self.sample_image_upload_ids = sample_image_upload_ids
+            self.product_file_upload_ids = product_file_upload_ids
+            self.product_license_ids = product_license_ids
+            # each file's licenses (in submitted order, without duplicates)
+            self.file_license_ids = [list(dict.fromkeys(ids))
+                                     for ids in file_license_ids]
+
+    def save(self):
+        '''creates the product and returns it. validate() must be called
+        first'''
+        license_prices = self.license_prices
+
+        with transaction.atomic():
+            with self.phase('product'):
+                product_data = dict(self.product_data)
+                product_data['category'] = self.category
+                product_data['seller'] = self.seller
+                product = Product(**product_data)
+                # the price range signals don't fire for bulk_create
+                product.min_price = min(license_prices)
+                product.max_price = max(license_prices)
+                license_free = [self.licenses[license_id].free
+                                for license_id in self.product_license_ids]
+                product.has_free_license = any(license_free)
+                product.has_paid_license = not all(license_free)
+                product.save()
+
+            with self.phase('images'):
+                sample_images = [
+                    store_filepond_upload(
+                        upload_id=upload_id, model_class=Image,
+                        file_group=self.file_group,
+                        temp_upload=self.temp_uploads[upload_id])
+                    for upload_id in self.sample_image_upload_ids]
+                ProductXImage.objects.bulk_create([
+                    ProductXImage(product=product, image=sample_image)
+                    for sample_image in sample_images])
+
+            with self.phase('licenses'):
+                ProductXLicense.objects.bulk_create([
+                    ProductXLicense(
+                        product=product,
+                        license=self.licenses[license_id],
+                        price=price)
+                    for license_id, price in zip(
+                        self.product_license_ids, license_prices)])
+
+            with self.phase('files'):
+                missing_file_types = set(self.file_type_names) - \
+                    set(self.file_types)
+                for file_type in FileType.objects.bulk_create([
+                        FileType(name=name) for name in missing_file_types]):
+                    self.file_types[file_type.name] = file_type
+                if missing_file_types:
+                    # bulk_create doesn't send the signals
+                    reference_data.invalidate()
+
+                product_files = [
+                    store_filepond_upload(
+                        upload_id=upload_id, model_class=File,
+                        file_group=self.file_group,
+                        file_type=self.file_types[file_type_name],
+                        temp_upload=self.temp_uploads[upload_id])
+                    for upload_id, file_type_name in zip(
+                        self.product_file_upload_ids, self.file_type_names)]
+
+            with self.phase('items'):
+                product_items = ProductItem.objects.bulk_create([
+                    ProductItem(product=product, file=product_file)
+                    for product_file in product_files])
+                ProductItemXLicense.objects.bulk_create([
+                    ProductItemXLicense(
+                        product_item=product_item,
+                        license=self.licenses[license_id])
+                    for product_item, license_ids in zip(
+                        product_items, self.file_license_ids)
+                    for license_id in license_ids])
+
+        return product
+
+
 class ArtworkList(mixins.ListModelMixin, mixins.CreateModelMixin,
                                                 generics.GenericAPIView):
 
@@ -131,13 +389,14 @@ class ArtworkList(mixins.ListModelMixin, mixins.CreateModelMixin,
 
         if serializer.is_valid():
             try: 
-                data['category'] = ArtCategory.objects.get(id=data['category'])            
+                data['category'] = reference_data.get(
+                    'art_categories', int(data['category']))
                 
                 # the uploaded file must be wrapped into a file object
                 wrapped_request_file = DjangoFile(request.FILES['file'])
 
-                file_type = FileType.objects.get(name=data['file_type'])
-                file_group = FileGroup.objects.get(name='artworks')
+                file_type = reference_data.get('file_types', data['file_type'])
+                file_group = reference_data.get('file_groups', 'artworks')
             except Exception as e:
                 return Response({'error': 'make sure to select a file!'},
                  status=status.HTTP_400_BAD_REQUEST)
@@ -374,24 +633,25 @@ class FollowingList(mixins.ListModelMixin, mixins.CreateModelMixin,
         return self.list(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
+        '''follow other_user. Idempotent: following an already followed user
+        succeeds without changes. Returns the resulting state.'''
 
         user = self.request.user
-        other_user = User.objects.get(username=kwargs.get('other_user'))
+        other_artist = Artist.objects.filter(
+            user__username=kwargs.get('other_user')).first()
 
-        if user and other_user:
-            if Following.objects.filter(
-                follower=user.artist, following=other_user.artist).first():
-                return Response(
-                    {"status": "already followed"},
+        if not other_artist:
+            return Response(
+                    {"error": "invalid other_user"},
                     status=status.HTTP_400_BAD_REQUEST)
 
-            following_instance = Following.objects.create(
-                follower=user.artist, following=other_user.artist)
-
-            serializer = FollowingSerializer(following_instance)        
-
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        created = Following.follow(user.artist, other_artist)
+        return Response({
+            "status": "followed" if created else "already followed",
+            "user_follows_other": True,
+            "followers": Artist.objects.values_list(
+                'followers_count', flat=True).get(id=other_artist.id)
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
 
     def get_queryset(self):
@@ -425,6 +685,29 @@ class FollowingList(mixins.ListModelMixin, mixins.CreateModelMixin,
             return Following.objects.order_by(self.__class__.ordering).all()
 
 
+class FollowSuggestionList(APIView):
+    '''"who to follow" suggestions for the user, precomputed by the
+    compute_follow_suggestions management command. Artists followed since the
+    suggestions were computed are left out.'''
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        artist = request.user.artist
+        followed_ids = get_following_ids(artist.id)
+
+        follow_suggestions = FollowSuggestion.objects.filter(
+            artist=artist).order_by('rank').select_related(
+                'suggested_artist__user')
+        suggestions = [{
+            'artist': ArtistSerializer(suggestion.suggested_artist).data,
+            'mutual_count': suggestion.mutual_count
+        } for suggestion in follow_suggestions
+          if suggestion.suggested_artist_id not in followed_ids]
+
+        return Response(suggestions, status=status.HTTP_200_OK)
+
+
 class FollowingStatus(APIView):
 
     # permission_classes = [set following permission here]
@@ -449,35 +732,74 @@ class FollowingStatus(APIView):
                 
 
 
+class FollowingStatusBatch(APIView):
+    '''the FollowingStatus of the user with many other users at once (e.g
+    for artist grids and comment threads).
+
+    ?usernames=a,b,c returns {username: {"user_follows_other": bool,
+    "other_follows_user": bool}} for each of the (at most MAX_USERNAMES)
+    usernames which belong to an artist.'''
+
+    permission_classes = [IsAuthenticated]
+
+    MAX_USERNAMES = 300
+
+    def get(self, request, *args, **kwargs):
+        usernames = {username.strip() for username in 
+                     request.GET.get('usernames', '').split(',')
+                     if username.strip()}
+        if len(usernames) > self.MAX_USERNAMES:
+            return Response(
+                {'error': f"at most {self.MAX_USERNAMES} usernames allowed"},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        artist = request.user.artist
+        artist_ids = dict(Artist.objects.filter(
+            user__username__in=usernames).values_list('user__username', 'id'))
+        followed_ids = get_following_ids(artist.id)
+        follower_ids = set(Following.objects.filter(
+            following=artist, follower_id__in=artist_ids.values()
+            ).values_list('follower_id', flat=True))
+
+        return Response({
+            username: {
+                "user_follows_other": other_artist_id in followed_ids,
+                "other_follows_user": other_artist_id in follower_ids
+            } for username, other_artist_id in artist_ids.items()
+        }, status=status.HTTP_200_OK)
+
+
 class Unfollow(APIView):
 
     # permission_classes = [set following permission here]
 
     def post(self, request, *args, **kwargs):
+        '''unfollow other_user. Idempotent: unfollowing a user who isn't
+        followed succeeds without changes. Returns the resulting state.'''
         user = self.request.user
-        other_user = User.objects.get(username=kwargs.get('other_user'))
-
-        if user and other_user:
-            following_instance = Following.objects.filter(
-                follower=user.artist, following=other_user.artist).first()
-            if following_instance:
-                following_instance.delete()
-                return Response(
-                    {"status": "unfollowed"},
-                    status=status.HTTP_200_OK)
+        other_artist = Artist.objects.filter(
+            user__username=kwargs.get('other_user')).first()
 
-            else:
-                return Response(
-                    {"status": "not following"},
-                    status=status.HTTP_400_BAD_REQUEST)
-        
-        return Response(
+        if not other_artist:
+            return Response(
                     {"error": "invalid other_user"},
                     status=status.HTTP_400_BAD_REQUEST)
+
+        deleted = Following.unfollow(user.artist, other_artist)
+        return Response({
+            "status": "unfollowed" if deleted else "not following",
+            "user_follows_other": False,
+            "followers": Artist.objects.values_list(
+                'followers_count', flat=True).get(id=other_artist.id)
+        }, status=status.HTTP_200_OK)
                     
 
 class ReactList(mixins.ListModelMixin, generics.GenericAPIView):
-    #lists reactions on an instance of a model (artwork, post, etc)
+    '''lists reactions on an instance of a model (artwork, post, etc), for
+    the "who reacted" dialog.
+
+    ?summary=true instead returns the number of reactions of each type and
+    the current user's own reactions, without listing the reactions.'''
 
     # no permissions required for this view
     permission_classes = []
@@ -487,24 +809,27 @@ class ReactList(mixins.ListModelMixin, generics.GenericAPIView):
     ordering = '-id'
 
     def get(self, request, model:str, instance_id:int, *args, **kwargs):        
-        response = self.list(request, *args, **kwargs)
-        response.data['model'] = model
-        response.data['instance_id'] = instance_id
-        response.data['user_reactions'] = []
+        content_type = self.get_content_type()
 
-        content_type = ContentType.objects.get(model=model.lower())
+        if request.GET.get('summary') == 'true':
+            counts, user_reaction_names = self.get_summary(
+                content_type, instance_id)
+            return Response({
+                "model": model,
+                "instance_id": instance_id,
+                "counts": counts,
+                "total": sum(counts.values()),
+                "user_reactions": user_reaction_names
+            }, status=status.HTTP_200_OK)
+
+        response = self.list(request, *args, **kwargs)
 
         user_reaction_names = []
         if self.request.user.is_authenticated:
-            reactions_by_user = Reaction.objects.filter(content_type=content_type, 
-                            object_id=instance_id, user=request.user).order_by(
-                                self.__class__.ordering).all()
-            user_reactions_serialized = ReactionSerializer(reactions_by_user, many=True)
-
-            user_reaction_names = [
-                reaction['reaction_type'] for reaction in user_reactions_serialized.data]
-            # response.data['user_reactions'] = user_reaction_names
-
+            user_reaction_names = list(Reaction.objects.filter(
+                content_type=content_type, object_id=instance_id,
+                user=request.user).order_by(self.__class__.ordering
+                    ).values_list('reaction_type__name', flat=True))
         
         # format the response data in a cute, intuitive order
         cute_data = {
@@ -516,101 +841,156 @@ class ReactList(mixins.ListModelMixin, generics.GenericAPIView):
         }
         response.data = cute_data
 
-        # (OUTDATED!!) order the display of results in the json output (not too necessary)        
-        # response.data.move_to_end('user_reactions', last=False)
-        # response.data.move_to_end('instance_id', last=False)
-        # response.data.move_to_end('model', last=False)
-        # response.data.move_to_end('previous', last=False)
-        # response.data.move_to_end('next', last=False)
-        # response.data.move_to_end('count', last=False)
-
         return response
 
+    def get_content_type(self):
+        # looked up once per request
+        if not hasattr(self, 'content_type'):
+            self.content_type = reference_data.get(
+                'content_types', self.kwargs['model'].lower())
+        return self.content_type
+
+    def get_summary(self, content_type, instance_id):
+        '''returns ({reaction type name: count}, [names of the current user's
+        reaction types]), from the denormalized ReactionCount counters when
+        the object has any'''
+        user = self.request.user
+        reactions = Reaction.objects.filter(
+            content_type=content_type, object_id=instance_id)
+
+        counts = dict(ReactionCount.objects.filter(
+            content_type=content_type, object_id=instance_id,
+            count__gt=0).values_list('reaction_type__name', 'count'))
+        if counts:
+            user_reaction_names = list(reactions.filter(user=user).values_list(
+                'reaction_type__name', flat=True)) \
+                    if user.is_authenticated else []
+            return counts, user_reaction_names
+
+        # no counters: count the reactions instead, flagging the user's own
+        # reactions in the same GROUP BY query
+        rows = reactions.values('reaction_type__name').annotate(
+            count=Count('id'),
+            user_count=Count('id', filter=Q(user_id=user.id))).order_by()
+        counts = {row['reaction_type__name']: row['count'] for row in rows}
+        user_reaction_names = [row['reaction_type__name'] for row in rows
+                               if row['user_count']]
+        return counts, user_reaction_names
 
     def get_queryset(self):
-
-        model = self.kwargs['model']
         instance_id = self.kwargs['instance_id']
 
-        content_type = ContentType.objects.get(model=model.lower())
-        # object_reacted_on = content_type.get_object_for_this_type(id=instance_id)
-
-        reactions = Reaction.objects.filter(content_type=content_type, 
-                        object_id=instance_id)
-        # if self.request.user.is_authenticated:
-        #     reactions = reactions.exclude(user=self.request.user)
+        reactions = Reaction.objects.filter(
+            content_type=self.get_content_type(), object_id=instance_id
+            ).select_related('user', 'reaction_type')
         reactions = reactions.order_by(self.__class__.ordering).all()
 
         return reactions
 
 
+class ReactSummaryList(APIView):
+    '''the reaction summaries of many instances of a model at once (e.g a
+    gallery page of artworks).
+
+    ?ids=1,2,3 returns {instance id: {"counts": {reaction type name: count},
+    "user_reactions": [names of the current user's reaction types]}} for
+    each of the (at most MAX_IDS) ids, from one grouped query and one query
+    for the current user's reactions.'''
+
+    # no permissions required for this view
+    permission_classes = []
+
+    MAX_IDS = 500
+
+    def get(self, request, model:str, *args, **kwargs):
+        try:
+            instance_ids = [int(instance_id) for instance_id in
+                            request.GET.get('ids', '').split(',')
+                            if instance_id.strip()]
+        except ValueError:
+            return Response({'error': 'ids must be comma-separated ids'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(instance_ids) > self.MAX_IDS:
+            return Response({'error': f"at most {self.MAX_IDS} ids allowed"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            content_type = reference_data.get('content_types', model.lower())
+        except ContentType.DoesNotExist:
+            return Response({'error': f"invalid model '{model}'"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        summaries = {instance_id: {"counts": {}, "user_reactions": []}
+                     for instance_id in instance_ids}
+        reactions = Reaction.objects.filter(
+            content_type=content_type, object_id__in=instance_ids)
+
+        for object_id, reaction_type_name, count in reactions.values_list(
+                'object_id', 'reaction_type__name').annotate(
+                    count=Count('id')).order_by():
+            summaries[object_id]["counts"][reaction_type_name] = count
+
+        if request.user.is_authenticated:
+            for object_id, reaction_type_name in reactions.filter(
+                    user=request.user).values_list(
+                        'object_id', 'reaction_type__name'):
+                summaries[object_id]["user_reactions"].append(
+                    reaction_type_name)
+
+        return Response({
+            "model": model,
+            "reactions": summaries
+        }, status=status.HTTP_200_OK)
+
+
 class React(APIView):
 
     permission_classes = [IsAuthenticated]
 
     def post(self, request, reaction_type_name:str, model:str, instance_id:int):
 
-        content_type = ContentType.objects.get(model=model.lower())
+        content_type = reference_data.get('content_types', model.lower())
         object_reacted_on = content_type.get_object_for_this_type(id=instance_id)
 
         user = self.request.user
-        reaction_type = ReactionType.objects.get(name=reaction_type_name)
-        is_duplicate_reaction = Reaction.objects.filter(
-            content_type=content_type, object_id=instance_id, 
-            user=user, reaction_type=reaction_type).first()
-        if is_duplicate_reaction:
-            return Response(
-                {reaction_type_name: f"already reacted by current user on this {model}"},
-                             status=status.HTTP_417_EXPECTATION_FAILED)
-
-        # Create a new Reaction object for a specific object (artwork, post etc)
-        reaction = Reaction(
-        content_type=content_type,
-        object_id=object_reacted_on.id,
-        content_object=object_reacted_on,
-        user=user,
-        reaction_type=reaction_type
-        )
-        reaction.save()
+        reaction_type = reference_data.get('reaction_types', reaction_type_name)
 
+        # idempotent: reacting again succeeds without adding a duplicate
+        created = Reaction.react(user, reaction_type, content_type,
+                                 object_reacted_on.id)
 
         response_data = {
             "reaction": reaction_type_name,
             "model": model,
             "instance_id": instance_id,
-            "user": self.request.user.username
+            "user": self.request.user.username,
+            "reacted": True,
+            "created": created
         }
         return Response(response_data, status=status.HTTP_200_OK)
 
 
 class UnReact(APIView):
 
-    # permission_classes: permission is tied to the logic for this view. Only 
-    # user who reacted on an object can remove the reaction.
+    # only the user who reacted on an object can remove the reaction (the
+    # reaction removed is always the current user's)
+    permission_classes = [IsAuthenticated]
 
     def post(self, request, reaction_type_name:str, model:str, instance_id:int):
 
-        content_type = ContentType.objects.get(model=model.lower())        
+        content_type = reference_data.get('content_types', model.lower())
         object_reacted_on = content_type.get_object_for_this_type(id=instance_id)
 
-        reaction_type = ReactionType.objects.get(name=reaction_type_name)
+        reaction_type = reference_data.get('reaction_types', reaction_type_name)
 
-        try:
-            reaction = Reaction.objects.get(content_type=content_type,
-                                            object_id=object_reacted_on.pk,
-                                            user=self.request.user,
-                                            reaction_type=reaction_type)
-
-        except Reaction.DoesNotExist:
-            return Response(
-                {"error": f"no '{reaction_type_name}' reaction from current user on this {model}"},
-                                status=status.HTTP_404_NOT_FOUND)
-
-        else:
-            reaction.delete()        
+        # idempotent: removing a missing reaction succeeds without changes
+        removed = Reaction.unreact(self.request.user, reaction_type,
+                                   content_type, object_reacted_on.pk)
 
         response_data = {
-            "removed reaction": reaction_type_name
+            "removed reaction": reaction_type_name,
+            "reacted": False,
+            "removed": removed
         }
         return Response(response_data, status=status.HTTP_200_OK)
 
@@ -624,33 +1004,51 @@ class CommentList(mixins.ListModelMixin, mixins.CreateModelMixin,
     ordering = '-id'
 
     def get(self, request, *args, **kwargs):
+        try:
+            self.post_type = reference_data.get(
+                'content_types', self.kwargs['model'])
+        except ContentType.DoesNotExist:
+            return Response({"error": f"invalid model '{self.kwargs['model']}'"},
+                                            status=status.HTTP_400_BAD_REQUEST)
         return self.list(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
-
-        class CommentNotForPost(Exception):
-            pass
-
+        post_id = self.kwargs['pk']
         try:
-            post_id = self.kwargs['pk']
-            post_type = ContentType.objects.get(model=self.kwargs['model'])
-            post = post_type.model_class().objects.get(id=post_id)
-
-            parent_comment_id = self.request.GET.get('parent_comment')
-            if parent_comment_id:
-                parent_comment = Comment.objects.get(id=parent_comment_id)
-                if parent_comment.post_object.pk != post.pk:
-                    raise CommentNotForPost
-            else:
-                parent_comment = None
-            content = self.request.GET.get('content')
-        except Comment.DoesNotExist:
-            return Response({"error": "invalid parent_comment id"}, 
+            post_type = reference_data.get('content_types', self.kwargs['model'])
+        except ContentType.DoesNotExist:
+            return Response({"error": f"invalid model '{self.kwargs['model']}'"},
+                                            status=status.HTTP_400_BAD_REQUEST)
+
+        parent_comment_id = self.request.GET.get('parent_comment')
+        if parent_comment_id:
+            try:
+                parent_comment_id = int(parent_comment_id)
+            except ValueError:
+                return Response({"error": "parent_comment must be a number"},
+                                            status=status.HTTP_400_BAD_REQUEST)
+            # (only the columns needed for the check and the thread path)
+            parent_comment = Comment.objects.filter(
+                id=parent_comment_id).only(
+                    'post_type', 'post_id', 'path', 'depth', 'root').first()
+            if not parent_comment:
+                return Response({"error": "invalid parent_comment id"}, 
                                             status=status.HTTP_404_NOT_FOUND)
-        except CommentNotForPost:
-            return Response(
-                {"error": f"post (id={post_id}) and parent_comment (post_id={parent_comment.post_object.pk}) do not match!"},
+            if parent_comment.post_type_id != post_type.id or \
+                    parent_comment.post_id != post_id:
+                return Response(
+                    {"error": f"post (id={post_id}) and parent_comment (post_id={parent_comment.post_id}) do not match!"},
+                                            status=status.HTTP_400_BAD_REQUEST)
+            if parent_comment.depth >= Comment.MAX_DEPTH:
+                return Response({"error": "replies are nested too deeply"},
                                             status=status.HTTP_400_BAD_REQUEST)
+        else:
+            parent_comment = None
+            # (a reply's post is known to exist from its parent comment)
+            if not post_type.model_class().objects.filter(id=post_id).exists():
+                return Response({"error": "invalid post id"},
+                                            status=status.HTTP_404_NOT_FOUND)
+        content = self.request.GET.get('content')
         
         user = self.request.user
         
@@ -658,7 +1056,6 @@ class CommentList(mixins.ListModelMixin, mixins.CreateModelMixin,
             user=user,
             post_type=post_type,
             post_id=post_id,
-            post_object=post,            
             content=content,
             parent_comment=parent_comment
         )            
@@ -668,13 +1065,79 @@ class CommentList(mixins.ListModelMixin, mixins.CreateModelMixin,
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def get_queryset(self):
-        post_id = self.kwargs['pk']
-        post_type = ContentType.objects.get(model=self.kwargs['model'])
-        post = post_type.model_class().objects.get(id=post_id)
-        comments = post.comments.order_by(self.__class__.ordering).all()
-        return comments
+        # filter on the (post_type, post_id) index, without loading the post
+        # (post_type is validated by get())
+        comments = Comment.objects.filter(
+            post_type=self.post_type, post_id=self.kwargs['pk']).select_related(
+                'user').prefetch_related('user__groups', 'user__user_permissions')
+        return comments.order_by(self.__class__.ordering)
 
         
+class CommentThreadList(generics.GenericAPIView):
+    '''comment threads on a post, paginated by top-level comment. Each
+    top-level comment comes with its replies (up to ?depth= levels below it)
+    as a flat list in thread order: every reply right after its parent, with
+    its depth for indentation.'''
+
+    # no permissions required for this view
+    permission_classes = []
+    pagination_class = CommentThreadPaginationConfig
+
+    serializer_class = CommentSerializer
+    ordering = '-id'
+
+    DEFAULT_DEPTH = 5
+    MAX_DEPTH = 20
+
+    def get(self, request, *args, **kwargs):
+        try:
+            depth = min(int(request.GET.get('depth', self.DEFAULT_DEPTH)),
+                        self.MAX_DEPTH)
+        except ValueError:
+            return Response({'error': 'depth must be a number'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            self.post_type = reference_data.get(
+                'content_types', self.kwargs['model'])
+        except ContentType.DoesNotExist:
+            return Response({"error": f"invalid model '{self.kwargs['model']}'"},
+                                            status=status.HTTP_400_BAD_REQUEST)
+
+        root_comments = self.paginate_queryset(self.get_queryset())
+
+        # the replies of every thread on the page, from one query on the
+        # (root, path) index
+        replies = list(Comment.objects.filter(
+            root__in=[comment.id for comment in root_comments],
+            depth__lte=depth).select_related('user').order_by('root', 'path'))
+
+        # the authors' groups and permissions, for all the comments at once
+        prefetch_related_objects(
+            [comment.user for comment in root_comments + replies],
+            'groups', 'user_permissions')
+
+        thread_replies = {comment.id: [] for comment in root_comments}
+        for reply, reply_data in zip(
+                replies, CommentSerializer(replies, many=True).data):
+            thread_replies[reply.root_id].append(reply_data)
+
+        threads = []
+        for comment, comment_data in zip(
+                root_comments,
+                CommentSerializer(root_comments, many=True).data):
+            comment_data['replies'] = thread_replies[comment.id]
+            threads.append(comment_data)
+
+        return self.get_paginated_response(threads)
+
+    def get_queryset(self):
+        # (post_type is validated by get())
+        return Comment.objects.filter(
+            post_type=self.post_type, post_id=self.kwargs['pk'],
+            parent_comment__isnull=True).select_related('user').order_by(
+                self.__class__.ordering)
+
+
 class CommentDetail(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
  mixins.UpdateModelMixin, mixins.DestroyModelMixin, generics.GenericAPIView):
 
@@ -724,7 +1187,9 @@ class ReviewList(mixins.ListModelMixin, mixins.CreateModelMixin,
         return self.list(request, *args, **kwargs)
 
     def get_queryset(self):
-        return Review.objects.order_by(self.__class__.ordering).filter(approved=True).all()
+        return Review.objects.order_by(self.__class__.ordering).filter(
+            approved=True).select_related('user', 'category').prefetch_related(
+                'user__groups', 'user__user_permissions')
 
     def post(self, request, *args, **kwargs):        
         # get dictionary equivalent of POST data and add additional data
@@ -749,7 +1214,8 @@ class ReviewList(mixins.ListModelMixin, mixins.CreateModelMixin,
 
             # caption file processing
             try: 
-                data['category'] = ArtCategory.objects.get(id=data['category'])            
+                data['category'] = reference_data.get(
+                    'art_categories', int(data['category']))
                 
                 # the uploaded file must be wrapped into a file object
                 wrapped_request_file = DjangoFile(request.FILES['caption_file'])
@@ -757,8 +1223,9 @@ class ReviewList(mixins.ListModelMixin, mixins.CreateModelMixin,
                 # read and immediately discard of the 'caption_file_type' entry
                 # as it shouldn't be present when the data list is used to
                 # create a Review object via Review(**data)
-                caption_file_type = FileType.objects.get(name=data.pop('caption_file_type'))
-                file_group = FileGroup.objects.get(name='reviews')
+                caption_file_type = reference_data.get(
+                    'file_types', data.pop('caption_file_type'))
+                file_group = reference_data.get('file_groups', 'reviews')
             except Exception as e:
                 print(e.args)
                 return Response({'error': 'Failed to process caption file!'},
@@ -791,7 +1258,8 @@ class ReviewList(mixins.ListModelMixin, mixins.CreateModelMixin,
                     # read and immediately discard of the 'body_file_type' entry
                     # as it shouldn't be present when the data list is used to
                     # create a Review object via Review(**data)
-                    body_file_type = FileType.objects.get(name=data.pop('body_file_type'))
+                    body_file_type = reference_data.get(
+                        'file_types', data.pop('body_file_type'))
                 except Exception as e:
                     print(e.args)
                     return Response({'error': 'Failed to process body file!'},
@@ -851,11 +1319,22 @@ class PendingReviews(APIView):
     permission_classes = []
 
     def get(self, request):
-        pending_reviews_count = Review.objects.filter(approved=False).count()
+        pending_reviews_count = get_moderation_counts(
+            'pending_reviews')['pending_reviews']
         
         return Response({
             'pending_reviews': pending_reviews_count},
             status=status.HTTP_200_OK)
+
+
+class ModerationCounts(APIView):
+    '''return the number of items awaiting moderation for every moderated
+    model at once (pending reviews, unapproved articles, unlisted products).
+    Staff only: these are the moderation queues'''
+    permission_classes = [IsAdmin]
+
+    def get(self, request):
+        return Response(get_moderation_counts(), status=status.HTTP_200_OK)
     
 
 class ArticleList(mixins.ListModelMixin, mixins.CreateModelMixin,
@@ -894,10 +1373,6 @@ class ArticleList(mixins.ListModelMixin, mixins.CreateModelMixin,
             # ---FILE PROCESSING---           
             html = data.pop('html')
 
-            # process the html images
-            html_soup = BeautifulSoup(html, 'html.parser')            
-            src_id_mapping = {}
-
             # goals:
             # - for each blob img element,
                 # - create image file
@@ -906,63 +1381,51 @@ class ArticleList(mixins.ListModelMixin, mixins.CreateModelMixin,
                 # - set it as thumbnail_image if it's the first blob img
             # NOTE: keep the URLs (in html file and src_id mapping) RELATIVE, 
             # for ease of management in case project media_url changes
-            for img in html_soup.find_all('img'):
-                src = img.get('src')
-
-                # skip non-blob img elements
-                if not src.startswith('blob:'):
-                    continue             
-
-                try:           
-                    # wrap request file into a file object
-                    request_file = request.FILES[src]
-                    wrapped_request_file = DjangoFile(request_file)
-
-                    file_group = FileGroup.objects.get(name='articles')
-                except Exception as e:
-                    print(e.args)
-                    return Response({'error': 'Failed to process article image!'},
-                    status=status.HTTP_400_BAD_REQUEST)
-
-                # create Image instance
-                article_image_file = Image(
-                        file_group=file_group,resource=wrapped_request_file)
-
-                article_image_file.save()
-
-                # update src and get src_id mapping
-                img['src'] = article_image_file.resource.url
-                src_id_mapping[img['src']] = article_image_file.id
-
-                # set it as thumbnail_image if it's the first blob img
-                if not data.get('thumbnail_image'):
-                    data['thumbnail_image'] = article_image_file
-            
-            # update html with processed src urls
-            html = str(html_soup)
-
-
-            # process the html file
-            # html content will be used to create an in-memory file, which
-            # is then wrapped into a file object
+            # (see main/article_html.py: the html is rewritten in one
+            # streaming pass and the images are saved on a thread pool)
             try:
-                in_memory_file = io.StringIO(html)
-                in_memory_file.name = \
-                    f"article{time.time()}.html" # file must have a name
-                wrapped_in_memory_file = DjangoFile(in_memory_file)                
-
-                file_type = FileType.objects.get(name='web')
-                file_group = FileGroup.objects.get(name='articles')
+                file_type = reference_data.get('file_types', 'web')
+                file_group = reference_data.get('file_groups', 'articles')
             except Exception as e:
                 print(e.args)
                 return Response({'error': 'Error in upload. Check the fields.'},
                  status=status.HTTP_400_BAD_REQUEST)
 
-            # create FieldFile instance using the file object            
-            html_file = File(
-                    file_type=file_type, file_group=file_group,
-                    resource=wrapped_in_memory_file)
-            html_file.save()            
+            with spooled_html_file() as html_stream:
+                try:
+                    rewriter, images = ingest_article_html(
+                        html, request.FILES, file_group, html_stream)
+                except ArticleImageError as e:
+                    print(e.args)
+                    return Response({'error': 'Failed to process article image!'},
+                    status=status.HTTP_400_BAD_REQUEST)
+
+                src_id_mapping = {src: image.id for src, image in images.items()}
+
+                # set the first blob img as thumbnail_image
+                for src in rewriter.image_srcs:
+                    if src in images:
+                        data['thumbnail_image'] = images[src]
+                        break
+
+                # process the html file
+                # the rewritten html is wrapped into a file object and
+                # copied into storage as is
+                html_stream.seek(0)
+                wrapped_html_stream = DjangoFile(
+                    html_stream,
+                    name=f"article{time.time()}.html") # file must have a name
+
+                # create FieldFile instance using the file object            
+                html_file = File(
+                        file_type=file_type, file_group=file_group,
+                        resource=wrapped_html_stream)
+                html_file.save()            
+
+                # precompressed copies for ArticleHTML
+                data["html_etag"] = write_sidecars(
+                    html_file.resource, html_stream)
+                data.update(rewriter.metadata())
 
             #----------------------------------------
 
@@ -991,93 +1454,114 @@ class ArticleDetail(mixins.RetrieveModelMixin, mixins.UpdateModelMixin,
         return self.retrieve(request, *args, **kwargs)
 
     def put(self, request, *args, **kwargs):
-        # DIAGNOSIS ONLY
-        # print(f"\nrequest: {request}")
-        # print(f"\nargs: {args}")
-        # print(f"\nkwargs: {kwargs}")
-        # return Response({'test': 'ok'})
-
         # get the request items in the form of a normal dictionaey
         data = request.POST.dict()
 
-        article = Article.objects.get(id=kwargs['pk'])
-        html = data['html']
+        article = self.get_object()
+        serializer = self.get_serializer(article, data=request.data)
+        serializer.is_valid(raise_exception=True)
 
-        # process the html images
-        html_soup = BeautifulSoup(html, 'html.parser')            
+        html = data['html']
         src_id_mapping = article.html_images
 
         # goals:
-        # - for each src in src_id mapping,
-            # if there is no img element in
-                    # new html having matching src, delete the image instance
-                    # and remove it from the src_id mapping
-            # NOTE: keep the URLs (in html file and src_id mapping) RELATIVE, 
-            # for ease of management in case project media_url changes
         # - for each blob img element,
             # - create image file
             # - update its src with the file URL
-            # - store src_id mapping in database
-        # - get first img in html SOUP, get the Image instance having matching
-            # src, and set it as thumbnail_image
-
-
-        # delete any existing image instance no longer referenced in the HTML
-        for src, id in src_id_mapping.items():
-            if not html_soup.find(name='img', src=src):
-                Image.objects.get(id=id).delete()
-                del src_id_mapping[src]            
-
-
-        for img in html_soup.find_all('img'):
-            src = img.get('src')
-
-            # skip non-blob img elements
-            if not src.startswith('blob:'):
-                continue             
-
-            try:           
-                # wrap request file into a file object
-                request_file = request.FILES[src]
-                wrapped_request_file = DjangoFile(request_file)
+        # - collect the srcs of all img elements (in the same single pass)
+        # - diff them with the src_id mapping: images whose src is no longer
+            # in the html are deleted (one query; their files are removed in
+            # the background) and the new images are added to the mapping
+            # NOTE: keep the URLs (in html file and src_id mapping) RELATIVE, 
+            # for ease of management in case project media_url changes
+        # - set the Image of the first mapped img as thumbnail_image
+        # - save the article once
+        # (see main/article_html.py: the html is rewritten in one streaming
+        # pass and the images are saved on a thread pool)
+        file_group = reference_data.get('file_groups', 'articles')
 
-                file_group = FileGroup.objects.get(name='articles')
-            except Exception as e:
+        with spooled_html_file() as html_stream:
+            try:
+                rewriter, images = ingest_article_html(
+                    html, request.FILES, file_group, html_stream)
+            except ArticleImageError as e:
                 print(e.args)
                 return Response({'error': 'Failed to process article image!'},
                 status=status.HTTP_400_BAD_REQUEST)
 
-            # create Image instance
-            article_image_file = Image(
-                    file_group=file_group,resource=wrapped_request_file)
-
-            article_image_file.save()
-
-            # update src and get src_id mapping
-            img['src'] = article_image_file.resource.url
-            src_id_mapping[img['src']] = article_image_file.id
-            article.html_images = src_id_mapping
-
-            # set first img as thumbnail_image (using updated src_id mapping)
-            first_soup_img = html_soup.find('img')
-            first_soup_img_id = src_id_mapping[first_soup_img.get('src')]
-            first_soup_img_instance = Image.objects.get(id=first_soup_img_id)
-            article.thumbnail_image = first_soup_img_instance
+            # write the updated html content to the html file
+            html_stream.seek(0)
+            file_stream = article.html_file.resource
+            file_stream.open('w')
+            shutil.copyfileobj(html_stream, file_stream)
+            file_stream.close()
+
+            # precompressed copies for ArticleHTML
+            html_etag = write_sidecars(file_stream, html_stream)
+
+        image_srcs = set(rewriter.image_srcs)
+        removed_ids = [id for src, id in src_id_mapping.items()
+                       if src not in image_srcs]
+        src_id_mapping = {src: id for src, id in src_id_mapping.items()
+                          if src in image_srcs}
+        src_id_mapping.update((src, image.id) for src, image in images.items())
+
+        delete_images(removed_ids)
+
+        first_img_src = next((src for src in rewriter.image_srcs
+                              if src in src_id_mapping), None)
+        thumbnail_image = None
+        if first_img_src is not None:
+            thumbnail_image = images.get(first_img_src) or \
+                Image.objects.get(id=src_id_mapping[first_img_src])
+
+        serializer.save(html_images=src_id_mapping,
+                        thumbnail_image=thumbnail_image, html_etag=html_etag,
+                        **rewriter.metadata())
+        return Response(serializer.data)
 
-            article.save()
+    def delete(self, request, *args, **kwargs):
+        return self.destroy(request, *args, **kwargs)
+    
 
-        # -----------------------------------------------------
+class ArticleHTML(APIView):
+    '''serves the html of an article, precompressed (see main/article_html.py)
+    when the Accept-Encoding of the request allows it. The sha256 of the html
+    is the (weak) ETag, so readers revalidate with If-None-Match and get a
+    304 if the article hasn't changed.'''
 
-        # write the updated html content to the html file
-        file_stream = article.html_file.resource
-        file_stream.open('w')
-        file_stream.write(str(html_soup))
-        file_stream.close()
+    permission_classes = []
 
-        return self.update(request, *args, **kwargs)
+    def get(self, request, *args, **kwargs):
+        article = get_object_or_404(
+            Article.objects.select_related('html_file'), id=kwargs['pk'])
+        resource = article.html_file.resource
+        # articles saved before the sidecars existed have neither an ETag
+        # nor sidecars until backfill_article_html runs: nothing is written
+        # here, the ETag is computed and the html served uncompressed
+        etag = article.html_etag or html_etag(resource)
+
+        headers = {
+            'ETag': f'W/{quote_etag(etag)}',
+            'Cache-Control': 'no-cache',
+            'Vary': 'Accept-Encoding',
+        }
 
-    def delete(self, request, *args, **kwargs):
-        return self.destroy(request, *args, **kwargs)
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if '*' in if_none_match or headers['ETag'].removeprefix('W/') in \
+                {etag.removeprefix('W/') for etag in if_none_match}:
+            return HttpResponseNotModified(headers=headers)
+
+        storage, name = resource.storage, resource.name
+        sidecar = article.html_etag and preferred_sidecar(
+            request.headers.get('Accept-Encoding', ''))
+        if sidecar and storage.exists(sidecar_name(name, sidecar[1])):
+            name = sidecar_name(name, sidecar[1])
+            headers['Content-Encoding'] = sidecar[0]
+
+        return FileResponse(storage.open(name, 'rb'),
+                            content_type='text/html; charset=utf-8',
+                            headers=headers)
     
 
 class ProductCategoryList(APIView):
@@ -1105,7 +1589,16 @@ class ProductList(mixins.ListModelMixin, mixins.CreateModelMixin,
     serializer_class = ProductSerializer
 
     def get(self, request, *args, **kwargs):
-        return self.list(request, *args, **kwargs)    
+        response = self.list(request, *args, **kwargs)
+
+        # comma-separated facet names e.g ?facets=category,license,price
+        # ('all' computes every facet in ProductFacets.FACETS)
+        facets = request.GET.get('facets')
+        if facets:
+            facets = None if facets == 'all' else facets.split(',')
+            response.data['facets'] = ProductFacets(
+                self.get_queryset(), facets).counts()
+        return response
 
     def get_queryset(self):
         seller = self.request.GET.get('seller') # the seller alias
@@ -1132,6 +1625,30 @@ class ProductList(mixins.ListModelMixin, mixins.CreateModelMixin,
         # exclude certain product(s)
         products_query = products_query.exclude(id=exclude_id)
 
+        # filter by price range (price of the cheapest license). Invalid
+        # values are ignored
+        try:
+            price_min = int(self.request.GET.get('price_min'))
+        except (TypeError, ValueError):
+            pass
+        else:
+            products_query = products_query.filter(min_price__gte=price_min)
+
+        try:
+            price_max = int(self.request.GET.get('price_max'))
+        except (TypeError, ValueError):
+            pass
+        else:
+            products_query = products_query.filter(min_price__lte=price_max)
+
+        # sort by price (cheapest first) with ?ordering=price, or by price
+        # (most expensive first) with ?ordering=-price
+        ordering = [self.__class__.ordering]
+        if self.request.GET.get('ordering') == 'price':
+            ordering = ['min_price', '-id']
+        elif self.request.GET.get('ordering') == '-price':
+            ordering = ['-min_price', '-id']
+
         # filter by category tree
         subcategory_path = self.kwargs.get('subcategory_path')
         if subcategory_path:
@@ -1154,19 +1671,12 @@ class ProductList(mixins.ListModelMixin, mixins.CreateModelMixin,
                 Q(category__path__istartswith=f"/{subcategory_path}/")
                  |
                 Q(category__path=f"/{subcategory_path}")).order_by(
-                    self.__class__.ordering).all()
-        return products_query.order_by(self.__class__.ordering).all()
+                    *ordering).all()
+        return products_query.order_by(*ordering).all()
     
     def post(self, request, *args, **kwargs):
         data = json.loads(request.body)
 
-        # title = data['title']
-        # category = data['category']
-        # description = data['description']
-        # product_file_datas = data['product_files']
-        # sample_image_datas = data['sample_images']
-        # product_licenses = data['product_licenses']
-
         '''models instances to be created
         ---primary models---
         - Product (from product data)
@@ -1176,63 +1686,20 @@ class ProductList(mixins.ListModelMixin, mixins.CreateModelMixin,
         - ProductXLicense (from product_licenses)
         - ProductItemXLicense (from product_file_datas)
         '''
+        submission = ProductSubmission(data, seller=request.user.seller)
+        try:
+            submission.validate()
+        except ProductSubmissionError as e:
+            return Response({'error': str(e)},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        # CREATE PRODUCT INSTANCE
-        # get just the data for creating a Product instance from dictionary
-        product_fields = [field.name for field in Product._meta.get_fields()]
-        product_data = {key:value for key, value in data.items() if key in product_fields} # TODO: add serializer validation here
-        product_data['category'] = ProductCategory.objects.get(id=product_data['category'])
-        product_data['seller'] = request.user.seller
-        product = Product(**product_data)
-        product.save()
-
-        # CREATE PRODUCT IMAGES
-        sample_image_ids = [file_data['file']['serverId'] for file_data in data['sample_images']]
-        for id in sample_image_ids:
-            sample_image = store_filepond_upload(
-                upload_id=id, model_class=Image, file_group='products')
-            product_image = ProductXImage(product=product, image=sample_image)
-            product_image.save()
-        
-
-        # CREATE PRODUCT LICENSES
-        for license in data['product_licenses']:
-            product_license = ProductXLicense(
-                product=product,
-                license = License.objects.get(id=license['id']),
-                price = license['price'] if license.get('price') else 0
-            )
-            product_license.save()
-
-        # CREATE PRODUCT ITEMS (files) AND PRODUCT LICENSES
-        for product_file_data in data['product_files']:
-            try:
-                # if no errors but blank file type
-                file_type_name=product_file_data['file']['fileType'].split('/')[0]
-                if file_type_name.strip() == "":
-                    file_type_name = 'other'
-            except:
-                # if any errors
-                file_type_name = 'other'
-            finally:
-                file_type, newly_created = FileType.objects.get_or_create(
-                    name=file_type_name)
-            
-            product_file = store_filepond_upload(
-                upload_id=product_file_data['file']['serverId'], model_class=File,
-                file_group='products', file_type=file_type)
-            product_item = ProductItem(product=product, file=product_file)
-            product_item.save()
-
-            file_licenses = product_file_data['licenses']
-            for license in file_licenses:
-                product_item_license = ProductItemXLicense(
-                    product_item=product_item, license=License.objects.get(id=license['id']))
-                product_item_license.save()
-
-        print("ran all product calls successfully")         
+        product = submission.save()
 
-        return Response(status=status.HTTP_200_OK)
+        response = Response({'product_id': product.id},
+                            status=status.HTTP_200_OK)
+        # per-phase timings of the submission
+        response['Server-Timing'] = submission.server_timing()
+        return response
 
 
 class ProductDetail(mixins.RetrieveModelMixin, mixins.UpdateModelMixin,
@@ -1244,9 +1711,39 @@ class ProductDetail(mixins.RetrieveModelMixin, mixins.UpdateModelMixin,
     serializer_class = ProductSerializer
 
     def get(self, request, *args, **kwargs):
-        return self.retrieve(request, *args, **kwargs)
+        # serve the cached response for the current version of the product
+        # (the version is bumped by signals whenever anything it depends on
+        # changes, so a cache hit runs no database query)
+        cache_key = product_detail_cache_key(kwargs['pk'])
+        data = cache.get(cache_key)
+        if data is not None:
+            return Response(data, status=status.HTTP_200_OK)
+
+        response = self.retrieve(request, *args, **kwargs)
+        cache.set(cache_key, response.data, PRODUCT_DETAIL_TIMEOUT)
+        return response
     
 
+class ProductRelatedList(APIView):
+    '''"customers also got" recommendations for a product, precomputed by the
+    compute_related_products management command, as product cards (see
+    ProductCardSerializer): two queries however many products there are'''
+
+    permission_classes = []
+
+    def get(self, request, *args, **kwargs):
+        related_products = RelatedProduct.objects.filter(
+            product_id=kwargs['pk'], related_product__listed=True).order_by(
+                'rank').select_related(
+                    'related_product__seller',
+                    'related_product__category').prefetch_related(
+                        'related_product__thumbnail_images')
+        products = [related.related_product for related in related_products]
+
+        return Response(ProductCardSerializer(products, many=True).data,
+                        status=status.HTTP_200_OK)
+
+
 class UnlistProduct(APIView):
 
     permission_classes = [IsProductSellerElseReadOnly]
@@ -1416,23 +1913,54 @@ class ContestDetail(mixins.RetrieveModelMixin, mixins.UpdateModelMixin,
     
 
 class RandomContest(APIView):
-    '''simply get a random contest for display in contest page ad banner'''
+    '''simply get a random contest for display in contest page ad banner.
+
+    The contest is picked from the cached contest ids (see caching.py), so
+    only the picked contest is loaded. Live (ongoing or upcoming) contests
+    are preferred: one is picked with probability live_weight whenever
+    there are both live and finished contests.'''
 
     permission_classes = []
 
-    def get(self, request, *args, **kwargs):
+    live_weight = 0.8
+
+    def pick_id(self, ids, exclude_id):
+        '''random id of ids other than exclude_id (None if there is none)'''
+        if not ids or (len(ids) == 1 and ids[0] == exclude_id):
+            return None
+        while True:
+            # at most one id is excluded, so this rarely takes more than two
+            # tries
+            contest_id = ids[random.randrange(len(ids))]
+            if contest_id != exclude_id:
+                return contest_id
+
+    def pick_contest(self, exclude_id):
+        live_ids, finished_ids = get_contest_ids()
+        live_id = self.pick_id(live_ids, exclude_id)
+        finished_id = self.pick_id(finished_ids, exclude_id)
+
+        if live_id is not None and finished_id is not None:
+            contest_id = live_id if random.random() < self.live_weight \
+                else finished_id
+        else:
+            contest_id = live_id if live_id is not None else finished_id
 
-        # get contests with id different from exclude_id
+        if contest_id is None:
+            return None
+        return Contest.objects.select_related('thumbnail_image').filter(
+            id=contest_id).first()
 
-        other_contests = Contest.objects.exclude(id=kwargs['exclude_id'])
-        if other_contests.count() == 0:
+    def get(self, request, *args, **kwargs):
+        # get a contest with id different from exclude_id
+        random_contest = self.pick_contest(kwargs['exclude_id'])
+        if random_contest is None:
+            # the cached ids may be stale: retry once with fresh ones
+            invalidate_contest_ids()
+            random_contest = self.pick_contest(kwargs['exclude_id'])
+        if random_contest is None:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
-        # limit to the last 100 for speed of execution in further operations
-        other_contests_list = list(other_contests)[-100:] 
-        random.shuffle(other_contests_list) # shuffle in-place
-        random_contest = random.choice(other_contests_list)
-
         data = ContestSerializer(random_contest).data
         return Response(data, status=status.HTTP_200_OK)
 
@@ -1447,7 +1975,7 @@ class ProductLibraryAdd(APIView):
 
         try:
             product = Product.objects.get(id=data['product_id'])
-            license = License.objects.get(id=data['license_id'])
+            license = reference_data.get('licenses', int(data['license_id']))
             productxlicense = ProductXLicense.objects.get(product=product, license=license)
         except:
             return Response({'error':'no product with this license'},
@@ -1465,48 +1993,102 @@ class ProductLibraryAdd(APIView):
         return Response({'message': 'already added'}, status=status.HTTP_200_OK)
     
 
-class ProductLibraryList(APIView):
+class ProductLibraryList(generics.GenericAPIView):
     '''list all the product licenses in this user's product library, or for a 
-    specific product if the product_id is specified as a query parameter'''
+    specific product if the product_id is specified as a query parameter.
+
+    The full library is paginated (cursor-based). Use ?view=card for the
+    compact ProductCardSerializer representation of the products.'''
 
     permission_classes = [IsAuthenticated]
+    pagination_class = ProductLibraryPaginationConfig
+
+    def get_queryset(self):
+        library_entries = ProductLibraryXXProductXLicense.objects.filter(
+            product_library__user=self.request.user).select_related(
+                'productxlicense__license',
+                'productxlicense__product__seller__user',
+                'productxlicense__product__category__root').prefetch_related(
+                    'productxlicense__product__thumbnail_images')
+
+        # the full product representation also needs these (per page)
+        if self.request.GET.get('view') != 'card':
+            library_entries = library_entries.prefetch_related(
+                'productxlicense__product__items__file',
+                'productxlicense__product__items__licenses',
+                'productxlicense__product__ratings__user__groups',
+                'productxlicense__product__ratings__user__user_permissions',
+                'productxlicense__product__productxlicense_set',
+                'productxlicense__product__licenses',
+                'productxlicense__product__seller__user__groups',
+                'productxlicense__product__seller__user__user_permissions')
+        return library_entries
 
     def get(self, request, *args, **kwargs):
         product_id = request.GET.get('product_id')
 
-        user_product_library = ProductLibrary.objects.filter(
-            user=request.user).first()
-        
-        if not user_product_library:
-            # data returned should depend on if fetching for a specific product
-            # or not, to decide whether to use a list or not
-            empty_data = None if product_id else []
-            return Response(empty_data,
+        # if fetching for a specific product
+        if product_id:
+            try:
+                product_id = int(product_id)
+            except ValueError:
+                return Response({'error': 'invalid product_id'},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            license_ids = get_entitlements(request.user.id).get(product_id)
+            if not license_ids:
+                return Response([], status=status.HTTP_200_OK)
+
+            licenses = [reference_data.get('licenses', license_id)
+                        for license_id in sorted(license_ids)]
+            return Response(LicenseSerializer(licenses,many=True).data,
                             status=status.HTTP_200_OK)
         
-        else:
+        # fetching for all products which user has added to library (one
+        # page at a time)
+        product_serializer_class = ProductCardSerializer \
+            if request.GET.get('view') == 'card' else ProductSerializer
+        library_entries = self.paginate_queryset(self.get_queryset())
+        if product_serializer_class is ProductSerializer:
+            prefetch_reviews_counts([entry.productxlicense.product
+                                     for entry in library_entries])
+        products_and_licenses = [{
+            'product': product_serializer_class(
+                entry.productxlicense.product).data,
+            'owned_license': LicenseSerializer(
+                entry.productxlicense.license).data
+        } for entry in library_entries]
+        return self.get_paginated_response(products_and_licenses)
+
+
+class ProductLibraryOwnership(APIView):
+    '''answers which licenses the user owns for many products at once.
+
+    ?product_ids=1,2,3 returns {product id: [owned license ids]} for each of
+    the (at most MAX_PRODUCT_IDS) products, from the user's cached
+    entitlements.'''
 
-            # if fetching for a specific product
-            if product_id:
-                productxlicenses = user_product_library.productxlicenses.filter(
-                    product_id=product_id
-                )
-                productxlicenses_to_licenses = lambda x:x.license                
-                licenses = list(map(productxlicenses_to_licenses,productxlicenses))
-                return Response(LicenseSerializer(licenses,many=True).data,
-                                status=status.HTTP_200_OK)
-            
-            # fetching for all products which user has added to library
-            else:
-                productxlicenses = user_product_library.productxlicenses.all()
-                productxlicenses_to_products_and_licenses = lambda x:{
-                    'product': ProductSerializer(x.product, many=False).data,
-                    'owned_license': LicenseSerializer(x.license, many=False).data
-                }
-                products_and_licenses = list(map(
-                    productxlicenses_to_products_and_licenses,productxlicenses))
-                return Response(products_and_licenses,
-                                status=status.HTTP_200_OK)
+    permission_classes = [IsAuthenticated]
+
+    MAX_PRODUCT_IDS = 500
+
+    def get(self, request, *args, **kwargs):
+        try:
+            product_ids = [int(product_id) for product_id in 
+                           request.GET.get('product_ids', '').split(',')
+                           if product_id.strip()]
+        except ValueError:
+            return Response({'error': 'product_ids must be comma-separated ids'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(product_ids) > self.MAX_PRODUCT_IDS:
+            return Response(
+                {'error': f"at most {self.MAX_PRODUCT_IDS} product_ids allowed"},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        entitlements = get_entitlements(request.user.id)
+        ownership = {product_id: sorted(entitlements.get(product_id, ()))
+                     for product_id in product_ids}
+        return Response(ownership, status=status.HTTP_200_OK)
 
 
 class ProductDownload(APIView):
@@ -1538,26 +2120,17 @@ class ProductDownload(APIView):
         # check if the license is free, so as to skip further authentication
         # checks if required and thus make it possible for anonymous users
         # (not signed in) to download free resources without needing to login
-        license = License.objects.get(id=license_id)
+        license = reference_data.get('licenses', license_id)
         if not license.name.lower() == 'free':
             if not request.user.is_authenticated:
                 error_msg = 'you must be logged in to download this resource!'
                 return render(request, 'main/download_restricted.html',
                           {'error_msg':error_msg})
 
-            try:
-                # if this returns None, it means user has no rights to this
-                # license for this particular product, and thus no rights to 
-                # any file under this license for this particular product.
-                # Even if user might have a product library already.
-                productxlicense = request.user.product_library.productxlicenses.filter(
-                    product__id=product_id, license__id=license_id).first()
-            except:
-                # user has no product library hence no rights to 
-                # any file under this license for this product
-                productxlicense = None
-            
-            if not productxlicense:
+            # if the user doesn't own this license for this particular
+            # product (or has no product library at all), they have no rights
+            # to any file under this license for this particular product.
+            if not owns_license(request.user.id, product_id, license_id):
                 error_msg = 'user has no ownership of this license for this product'
                 return render(request, 'main/download_restricted.html',
                           {'error_msg':error_msg})
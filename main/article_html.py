@@ -0,0 +1,434 @@
+'''Streaming ingestion of article HTML (see ArticleList.post and
+ArticleDetail.put).
+
+The submitted HTML is tokenized once by the stdlib's SAX-style HTMLParser and
+written back out token by token, without building a document tree or a
+second copy of the document: text, comments and the markup of every tag are
+passed through unchanged, only the `blob:` src of img tags is replaced by the
+URL of the Image the uploaded file was saved as.
+
+The uploaded images are written to storage on a thread pool before the pass
+(the blob srcs are the keys of the uploaded files), so that their URLs are
+known by the time their img tags are reached. The same pass extracts the
+metadata shown on article cards (excerpt, word count, reading time, image
+count), so that list pages never need the html files.
+
+Once stored, the html gets precompressed sidecar files (gzip, and brotli if
+the brotli package is installed) that ArticleHTML serves by Accept-Encoding,
+with the sha256 of the html as ETag.'''
+
+import codecs
+import gzip
+import hashlib
+import math
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from html import escape, unescape
+from html.parser import HTMLParser
+
+from django.core.files import File as DjangoFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from .models import Image
+
+
+BLOB_PREFIX = 'blob:'
+FEED_CHUNK_SIZE = 64 * 1024 # characters
+IMAGE_WORKERS = 4
+SPOOL_MAX_SIZE = 1024 * 1024 # bytes
+EXCERPT_LENGTH = 300 # characters
+WORDS_PER_MINUTE = 200 # reading speed
+
+# (encoding, sidecar file suffix), preferred first
+SIDECAR_ENCODINGS = [('gzip', '.gz')]
+if brotli is not None:
+    SIDECAR_ENCODINGS.insert(0, ('br', '.br'))
+
+# tags whose content isn't text
+NON_TEXT_TAGS = {'script', 'style', 'template', 'noscript'}
+# tags that separate words
+BLOCK_TAGS = {'p', 'div', 'br', 'hr', 'li', 'ul', 'ol', 'h1', 'h2', 'h3',
+              'h4', 'h5', 'h6', 'blockquote', 'pre', 'figure', 'figcaption',
+              'table', 'tr', 'td', 'th', 'section', 'article', 'img'}
+
+
+class ArticleImageError(Exception):
+    pass
+
+
+class ArticleHTMLRewriter(HTMLParser):
+    '''writes the HTML fed to it to out, with the src of each img tag
+    replaced by src_map[src] (if present).
+
+    Once closed:
+    - image_srcs: the src of every img tag, in document order (as written)
+    - missing_srcs: the `blob:` srcs that had no replacement
+    - excerpt: the first EXCERPT_LENGTH characters of the text
+    - word_count: the number of words of the text
+    (see metadata())'''
+
+    def __init__(self, out, src_map):
+        # keep character references as they were written
+        super().__init__(convert_charrefs=False)
+        self.out = out
+        self.src_map = src_map
+        self.image_srcs = []
+        self.missing_srcs = []
+        self.non_text_depth = 0
+        self.excerpt_words = []
+        self.excerpt_length = 0
+        self.excerpt_truncated = False
+        self.word_count = 0
+        self.word_open = False # the last text didn't end with a space
+        self.endtag_start = None # set while parse_endtag() runs
+
+    def rewrite(self, html):
+        '''feeds the whole html string, a chunk at a time, and closes'''
+        for start in range(0, len(html), FEED_CHUNK_SIZE):
+            self.feed(html[start:start + FEED_CHUNK_SIZE])
+        self.close()
+        return self
+
+    @property
+    def excerpt(self):
+        excerpt = ' '.join(self.excerpt_words)
+        return excerpt + '…' if self.excerpt_truncated else excerpt
+
+    def metadata(self):
+        '''the Article columns extracted from the html'''
+        return {
+            'excerpt': self.excerpt,
+            'word_count': self.word_count,
+            'reading_time': math.ceil(self.word_count / WORDS_PER_MINUTE),
+            'image_count': len(self.image_srcs),
+        }
+
+    def handle_text(self, text):
+        '''text content (unescaped), in document order'''
+        if not text:
+            return
+
+        words = text.split()
+        # continuation of the last word (e.g after an inline tag)?
+        continued = bool(words) and self.word_open and not text[0].isspace()
+        self.word_count += len(words) - continued
+        self.word_open = bool(words) and not text[-1].isspace()
+
+        if self.excerpt_truncated:
+            return
+        if continued:
+            self.excerpt_length -= len(self.excerpt_words[-1]) + 1
+            words[0] = self.excerpt_words.pop() + words[0]
+
+        for word in words:
+            if self.excerpt_length + len(word) > EXCERPT_LENGTH:
+                self.excerpt_truncated = True
+                return
+            self.excerpt_words.append(word)
+            self.excerpt_length += len(word) + 1
+
+    def break_text(self, tag):
+        if tag in NON_TEXT_TAGS:
+            return True
+        if tag in BLOCK_TAGS:
+            self.word_open = False
+        return False
+
+    def write_img(self, attrs, self_closing):
+        attrs = dict(attrs)
+        src = attrs.get('src')
+        if src is None:
+            self.out.write(self.get_starttag_text())
+            return
+
+        new_src = self.src_map.get(src)
+        if new_src is None:
+            if src.startswith(BLOB_PREFIX):
+                self.missing_srcs.append(src)
+            self.image_srcs.append(src)
+            self.out.write(self.get_starttag_text())
+            return
+
+        self.image_srcs.append(new_src)
+        attrs['src'] = new_src
+        self.out.write('<img')
+        for name, value in attrs.items():
+            if value is None:
+                self.out.write(f' {name}')
+            else:
+                self.out.write(f' {name}="{escape(value)}"')
+        self.out.write('/>' if self_closing else '>')
+
+    def handle_starttag(self, tag, attrs):
+        if self.break_text(tag):
+            self.non_text_depth += 1
+        if tag == 'img':
+            self.write_img(attrs, self_closing=False)
+        else:
+            self.out.write(self.get_starttag_text())
+
+    def handle_startendtag(self, tag, attrs):
+        self.break_text(tag)
+        if tag == 'img':
+            self.write_img(attrs, self_closing=True)
+        else:
+            self.out.write(self.get_starttag_text())
+
+    def parse_endtag(self, i):
+        # handle_endtag() only gets the lowercased tag name: remember where
+        # the end tag starts so it can be written back as it was written
+        self.endtag_start = i
+        try:
+            return super().parse_endtag(i)
+        finally:
+            self.endtag_start = None
+
+    def get_endtag_text(self, tag):
+        '''the end tag being handled, as written (like get_starttag_text())'''
+        if self.endtag_start is None:
+            return f'</{tag}>'
+        end = self.rawdata.index('>', self.endtag_start + 1) + 1
+        return self.rawdata[self.endtag_start:end]
+
+    def handle_endtag(self, tag):
+        if self.break_text(tag) and self.non_text_depth:
+            self.non_text_depth -= 1
+        self.out.write(self.get_endtag_text(tag))
+
+    def handle_data(self, data):
+        if not self.non_text_depth:
+            self.handle_text(data)
+        self.out.write(data)
+
+    def handle_entityref(self, name):
+        reference = f'&{name};'
+        if not self.non_text_depth:
+            self.handle_text(unescape(reference))
+        self.out.write(reference)
+
+    def handle_charref(self, name):
+        reference = f'&#{name};'
+        if not self.non_text_depth:
+            self.handle_text(unescape(reference))
+        self.out.write(reference)
+
+    def handle_comment(self, data):
+        self.out.write(f'<!--{data}-->')
+
+    def handle_decl(self, decl):
+        self.out.write(f'<!{decl}>')
+
+    def handle_pi(self, data):
+        self.out.write(f'<?{data}>')
+
+    def unknown_decl(self, data):
+        self.out.write(f'<![{data}]>')
+
+
+def persist_images(uploaded_files, file_group, max_workers=IMAGE_WORKERS):
+    '''saves the uploaded files ({key: uploaded file}) as Images of
+    file_group and returns {key: Image}.
+
+    The files are written to storage in parallel (no database access happens
+    in the worker threads), then the Image rows are created with one bulk
+    insert. If any file fails, the ones already written are removed again.'''
+    if not uploaded_files:
+        return {}
+
+    def store(uploaded_file):
+        image = Image(file_group=file_group)
+        image.resource.save(
+            uploaded_file.name, DjangoFile(uploaded_file), save=False)
+        return image
+
+    with ThreadPoolExecutor(
+            max_workers=min(max_workers, len(uploaded_files))) as executor:
+        futures = {key: executor.submit(store, uploaded_file)
+                   for key, uploaded_file in uploaded_files.items()}
+
+    images = {}
+    error = None
+    for key, future in futures.items():
+        try:
+            images[key] = future.result()
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        for image in images.values():
+            image.resource.delete(save=False)
+        raise ArticleImageError('failed to save article image') from error
+
+    Image.objects.bulk_create(images.values())
+    return images
+
+
+def ingest_article_html(html, uploaded_files, file_group, out):
+    '''saves the uploaded `blob:` images of an article and writes html to
+    out, with the blob srcs of its img tags replaced by the (relative) URLs
+    of the saved images.
+
+    Returns (rewriter, images): the closed ArticleHTMLRewriter and
+    {url: Image} of the new images referenced by the html. Uploaded images
+    that no img tag references are deleted again.
+
+    Raises ArticleImageError if an image can't be saved or an img tag
+    references a blob that wasn't uploaded (nothing is kept in that case,
+    but out may have been partly written).'''
+    blob_files = {src: uploaded_file
+                  for src, uploaded_file in uploaded_files.items()
+                  if src.startswith(BLOB_PREFIX)}
+    saved_images = persist_images(blob_files, file_group)
+    src_map = {src: image.resource.url for src, image in saved_images.items()}
+
+    rewriter = ArticleHTMLRewriter(out, src_map)
+    try:
+        rewriter.rewrite(html)
+        if rewriter.missing_srcs:
+            raise ArticleImageError(
+                f'missing article image(s): {rewriter.missing_srcs}')
+    except Exception:
+        delete_images(image.id for image in saved_images.values())
+        raise
+
+    referenced_srcs = set(rewriter.image_srcs)
+    images = {}
+    unreferenced_ids = []
+    for src, image in saved_images.items():
+        if src_map[src] in referenced_srcs:
+            images[src_map[src]] = image
+        else:
+            unreferenced_ids.append(image.id)
+    delete_images(unreferenced_ids)
+
+    return rewriter, images
+
+
+def delete_images(image_ids):
+    '''deletes the Images with one query (the pre_delete signal of Image
+    removes their files in the background)'''
+    image_ids = list(image_ids)
+    if image_ids:
+        Image.objects.filter(id__in=image_ids).delete()
+
+
+def spooled_html_file():
+    '''temporary text file for the rewritten html: kept in memory up to
+    SPOOL_MAX_SIZE, then on disk'''
+    return tempfile.SpooledTemporaryFile(
+        max_size=SPOOL_MAX_SIZE, mode='w+', encoding='utf-8')
+
+
+def sidecar_name(name, suffix):
+    return f'{name}{suffix}'
+
+
+def write_sidecars(resource, html_stream):
+    '''writes the precompressed copies of the html next to the stored html
+    file resource (a FieldFile), replacing any previous ones, and returns
+    the sha256 (hex) of the html.
+
+    html_stream: text stream with the same content as the stored file (e.g
+    the spooled_html_file it was written from)'''
+    html_stream.seek(0)
+    digest = hashlib.sha256()
+    buffers = {encoding: tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+               for encoding, suffix in SIDECAR_ENCODINGS}
+    try:
+        # mtime=0 so that the same html always compresses to the same bytes
+        gzip_file = gzip.GzipFile(
+            fileobj=buffers['gzip'], mode='wb', compresslevel=9, mtime=0)
+        brotli_compressor = brotli.Compressor() if 'br' in buffers else None
+
+        while True:
+            chunk = html_stream.read(FEED_CHUNK_SIZE)
+            if not chunk:
+                break
+            data = chunk.encode('utf-8')
+            digest.update(data)
+            gzip_file.write(data)
+            if brotli_compressor is not None:
+                buffers['br'].write(brotli_compressor.process(data))
+
+        gzip_file.close()
+        if brotli_compressor is not None:
+            buffers['br'].write(brotli_compressor.finish())
+
+        for encoding, suffix in SIDECAR_ENCODINGS:
+            name = sidecar_name(resource.name, suffix)
+            resource.storage.delete(name)
+            buffers[encoding].seek(0)
+            resource.storage.save(name, DjangoFile(buffers[encoding]))
+    finally:
+        for buffer in buffers.values():
+            buffer.close()
+
+    return digest.hexdigest()
+
+
+def html_etag(resource):
+    '''returns the sha256 (hex) of the stored html file resource, as
+    write_sidecars() does, without writing anything'''
+    digest = hashlib.sha256()
+    with resource.open('rb') as html_file:
+        for data in iter(lambda: html_file.read(FEED_CHUNK_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def preferred_sidecar(accept_encoding):
+    '''returns the (encoding, suffix) of the preferred sidecar accepted by
+    the Accept-Encoding header value, or None (uncompressed html)'''
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        coding, _, params = coding.partition(';')
+        quality = 1.0
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    for encoding, suffix in SIDECAR_ENCODINGS:
+        if qualities.get(encoding, qualities.get('*', 0.0)) > 0:
+            return encoding, suffix
+    return None
+
+
+def delete_sidecars(resource):
+    '''deletes the precompressed copies of the stored html file resource'''
+    for encoding, suffix in SIDECAR_ENCODINGS:
+        resource.storage.delete(sidecar_name(resource.name, suffix))
+
+
+def refresh_article_html(article):
+    '''re-extracts the metadata of an article from its stored html file and
+    rewrites the precompressed sidecars (e.g for articles saved before they
+    existed). Saves the article.'''
+    resource = article.html_file.resource
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    with spooled_html_file() as html_stream, \
+            open(os.devnull, 'w') as null:
+        rewriter = ArticleHTMLRewriter(null, {})
+        with resource.open('rb') as html_file:
+            while True:
+                data = html_file.read(FEED_CHUNK_SIZE)
+                chunk = decoder.decode(data, final=not data)
+                html_stream.write(chunk)
+                rewriter.feed(chunk)
+                if not data:
+                    break
+        rewriter.close()
+
+        article.html_etag = write_sidecars(resource, html_stream)
+
+    metadata = rewriter.metadata()
+    for field, value in metadata.items():
+        setattr(article, field, value)
+    article.save(update_fields=['html_etag', *metadata])
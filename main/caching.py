@@ -0,0 +1,228 @@
+'''Cached data which is kept up to date through signals (see signals.py).
+
+Versioned keys are mostly used instead of deleting cache entries: each cached
+response is stored under a key containing the current version(s) of
+everything it depends on, and a change only needs to replace the version for
+the old entries to stop being read (they expire on their own).
+
+Every entry here is kept for a few minutes at most, as other processes may
+not see the invalidations (see the comment on CACHES in settings.py), and
+checks that would deny a user something (owns_license) confirm a cached "no"
+against the database.'''
+
+import math
+import time
+from array import array
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import (ProductLibraryXXProductXLicense, Following, Review,
+Article, Product, Contest)
+
+
+def get_versions(*version_keys):
+    '''returns the current versions stored at version_keys (in one cache
+    round trip), creating any missing one. A new version is always a fresh
+    timestamp (not a counter starting from 0) so that an evicted version key
+    can never make stale entries valid again.'''
+    versions = cache.get_many(version_keys)
+    for version_key in version_keys:
+        if version_key not in versions:
+            # add() doesn't overwrite a version set concurrently
+            cache.add(version_key, time.time_ns(), None)
+            versions[version_key] = cache.get(version_key)
+    return [versions[version_key] for version_key in version_keys]
+
+
+def bump_version(version_key):
+    cache.set(version_key, time.time_ns(), None)
+
+
+# -------ProductDetail-------
+PRODUCT_DETAIL_TIMEOUT = 5 * 60 # seconds
+
+# bumped for changes that affect many products at once (licenses, categories)
+PRODUCT_DETAIL_GLOBAL_VERSION_KEY = 'product_detail_version'
+
+
+def product_detail_version_key(product_id):
+    return f"product_detail_version_{product_id}"
+
+
+def product_detail_cache_key(product_id):
+    '''key of the cached ProductDetail response for the current versions of
+    the product and of the shared reference data'''
+    global_version, product_version = get_versions(
+        PRODUCT_DETAIL_GLOBAL_VERSION_KEY, product_detail_version_key(product_id))
+    return f"product_detail_{product_id}_{global_version}_{product_version}"
+
+
+def invalidate_product_detail(*product_ids):
+    for product_id in product_ids:
+        bump_version(product_detail_version_key(product_id))
+
+
+def invalidate_all_product_details():
+    bump_version(PRODUCT_DETAIL_GLOBAL_VERSION_KEY)
+
+
+# -------Entitlements-------
+# the (product, license) pairs owned by each user, i.e the licenses in their
+# product library. Deleted (not versioned) when the library changes, since
+# there is only one entry per user.
+ENTITLEMENTS_TIMEOUT = 5 * 60 # seconds
+
+
+def entitlements_cache_key(user_id):
+    return f"entitlements_{user_id}"
+
+
+def get_entitlements(user_id):
+    '''returns {product id: frozenset of owned license ids} for the user,
+    loaded (in one query) on the first call after an invalidation'''
+    key = entitlements_cache_key(user_id)
+    entitlements = cache.get(key)
+    if entitlements is None:
+        owned_licenses = {}
+        for product_id, license_id in \
+                ProductLibraryXXProductXLicense.objects.filter(
+                    product_library__user_id=user_id).values_list(
+                        'productxlicense__product_id',
+                        'productxlicense__license_id'):
+            owned_licenses.setdefault(product_id, set()).add(license_id)
+
+        entitlements = {product_id: frozenset(license_ids) for
+                        product_id, license_ids in owned_licenses.items()}
+        cache.set(key, entitlements, ENTITLEMENTS_TIMEOUT)
+    return entitlements
+
+
+def owns_license(user_id, product_id, license_id):
+    '''whether the user owns the license for the product. A cached "no" is
+    confirmed with a query (the purchase may have been handled by another
+    process, whose invalidation this one may not see), so that a buyer is
+    never denied because of a stale entry.'''
+    if license_id in get_entitlements(user_id).get(product_id, ()):
+        return True
+
+    owned = ProductLibraryXXProductXLicense.objects.filter(
+        product_library__user_id=user_id,
+        productxlicense__product_id=product_id,
+        productxlicense__license_id=license_id).exists()
+    if owned:
+        invalidate_entitlements(user_id)
+    return owned
+
+
+def invalidate_entitlements(*user_ids):
+    cache.delete_many([entitlements_cache_key(user_id) for user_id in user_ids])
+
+
+# -------Followings-------
+FOLLOWING_IDS_TIMEOUT = 5 * 60 # seconds
+
+
+def following_ids_cache_key(artist_id):
+    return f"following_ids_{artist_id}"
+
+
+def get_following_ids(artist_id):
+    '''returns the frozenset of ids of the artists followed by the artist,
+    loaded (in one query) on the first call after an invalidation'''
+    key = following_ids_cache_key(artist_id)
+    following_ids = cache.get(key)
+    if following_ids is None:
+        following_ids = frozenset(Following.objects.filter(
+            follower_id=artist_id).values_list('following_id', flat=True))
+        cache.set(key, following_ids, FOLLOWING_IDS_TIMEOUT)
+    return following_ids
+
+
+def invalidate_following_ids(*artist_ids):
+    cache.delete_many([following_ids_cache_key(artist_id) for artist_id in artist_ids])
+
+
+# -------Moderation counters-------
+# number of items awaiting moderation, per counter name. Each count is
+# deleted by the signals of its model (see signals.py) and recounted on the
+# next read.
+MODERATION_COUNTS_TIMEOUT = 5 * 60 # seconds
+
+MODERATION_COUNTERS = {
+    'pending_reviews': (Review, {'approved': False}),
+    'unapproved_articles': (Article, {'approved': False}),
+    'unlisted_products': (Product, {'listed': False}),
+}
+
+
+def moderation_count_cache_key(counter_name):
+    return f"moderation_count_{counter_name}"
+
+
+def get_moderation_counts(*counter_names):
+    '''returns {counter name: count} for the given counters (all counters
+    if none given), counting only the ones missing from the cache'''
+    counter_names = counter_names or tuple(MODERATION_COUNTERS)
+    keys = {counter_name: moderation_count_cache_key(counter_name)
+            for counter_name in counter_names}
+    cached_counts = cache.get_many(keys.values())
+
+    counts = {}
+    for counter_name, key in keys.items():
+        count = cached_counts.get(key)
+        if count is None:
+            model, pending_filter = MODERATION_COUNTERS[counter_name]
+            count = model.objects.filter(**pending_filter).count()
+            cache.set(key, count, MODERATION_COUNTS_TIMEOUT)
+        counts[counter_name] = count
+    return counts
+
+
+def invalidate_moderation_counts(model):
+    cache.delete_many([
+        moderation_count_cache_key(counter_name) for counter_name,
+        (counter_model, pending_filter) in MODERATION_COUNTERS.items()
+        if counter_model is model])
+
+
+# -------Contest ids-------
+# ids of the contests which haven't ended yet (ongoing or upcoming) and of the
+# finished ones, so that a random contest can be picked without loading the
+# contests table. Deleted by the Contest signals (see signals.py), and
+# expires when the next live contest ends (which makes it a finished one).
+CONTEST_IDS_TIMEOUT = 5 * 60 # seconds
+CONTEST_IDS_CACHE_KEY = 'contest_ids'
+
+
+def get_contest_ids():
+    '''returns (live ids, finished ids): int arrays of the ids of the
+    contests which haven't ended yet and of the finished ones, loaded (in one
+    query of the id and end date columns) on the first call after an
+    invalidation'''
+    contest_ids = cache.get(CONTEST_IDS_CACHE_KEY)
+    if contest_ids is None:
+        now = timezone.now()
+        live_ids = array('q')
+        finished_ids = array('q')
+        next_end_date = None
+        for contest_id, end_date in Contest.objects.values_list(
+                'id', 'end_date').iterator(chunk_size=10000):
+            if end_date > now:
+                live_ids.append(contest_id)
+                if next_end_date is None or end_date < next_end_date:
+                    next_end_date = end_date
+            else:
+                finished_ids.append(contest_id)
+
+        timeout = CONTEST_IDS_TIMEOUT
+        if next_end_date is not None:
+            timeout = min(timeout, math.ceil(
+                (next_end_date - now).total_seconds()))
+        contest_ids = (live_ids, finished_ids)
+        cache.set(CONTEST_IDS_CACHE_KEY, contest_ids, max(timeout, 1))
+    return contest_ids
+
+
+def invalidate_contest_ids():
+    cache.delete(CONTEST_IDS_CACHE_KEY)
@@ -0,0 +1,110 @@
+'''The Following graph in compressed sparse row (CSR) form, used by the
+compute_follow_suggestions management command to find "who to follow"
+suggestions (friends of friends) for every artist in one pass.'''
+
+import heapq
+from array import array
+from collections import Counter
+
+
+class FollowGraph:
+    '''artist ids are mapped to dense indices (0 to n - 1, by ascending id).
+    The indices of the artists followed by the artist at index i are
+    targets[offsets[i]:offsets[i + 1]], sorted and without duplicates.
+
+    Both offsets and targets are flat int arrays, so a graph of a million
+    follows takes a few MB.'''
+
+    def __init__(self, artist_ids, edges):
+        '''
+        - artist_ids: ids of all the artists
+        - edges: (follower id, following id) pairs. Pairs involving unknown
+        artists and self-follows are ignored.
+        '''
+        self.artist_ids = array('q', sorted(set(artist_ids)))
+        index = {artist_id: i for i, artist_id in enumerate(self.artist_ids)}
+        n = len(self.artist_ids)
+
+        sources = array('q')
+        unsorted_targets = array('q')
+        for follower_id, following_id in edges:
+            source = index.get(follower_id)
+            target = index.get(following_id)
+            if source is None or target is None or source == target:
+                continue
+            sources.append(source)
+            unsorted_targets.append(target)
+
+        # counting sort of the edges by source
+        offsets = array('q', bytes(8 * (n + 1)))
+        for source in sources:
+            offsets[source + 1] += 1
+        for i in range(n):
+            offsets[i + 1] += offsets[i]
+
+        targets = array('q', bytes(8 * len(sources)))
+        positions = offsets[:-1]
+        for source, target in zip(sources, unsorted_targets):
+            targets[positions[source]] = target
+            positions[source] += 1
+
+        # sort each row and drop duplicate follows
+        self.offsets = array('q', [0])
+        self.targets = array('q')
+        for i in range(n):
+            self.targets.extend(sorted(set(targets[offsets[i]:offsets[i + 1]])))
+            self.offsets.append(len(self.targets))
+
+    def __len__(self):
+        return len(self.artist_ids)
+
+    @property
+    def edge_count(self):
+        return len(self.targets)
+
+    def following(self, i):
+        '''indices of the artists followed by the artist at index i'''
+        return self.targets[self.offsets[i]:self.offsets[i + 1]]
+
+    def follower_counts(self):
+        '''number of followers of each artist, by index'''
+        counts = array('q', bytes(8 * len(self)))
+        for target in self.targets:
+            counts[target] += 1
+        return counts
+
+    def suggestions(self, i, top, activity=None, activity_weight=1.0,
+                    max_fanout=None):
+        '''returns the top (index, mutual count, score) friends of friends of
+        the artist at index i, best first. Artists already followed are
+        excluded.
+
+        - activity: activity bonus of each artist, by index (e.g from recent
+        artworks). Added to the mutual count, multiplied by activity_weight.
+        - max_fanout: only the first max_fanout follows of each followed
+        artist are counted, to bound the work of artists following many
+        others
+        '''
+        following = self.following(i)
+        excluded = set(following)
+        excluded.add(i)
+
+        mutual_counts = Counter()
+        for friend in following:
+            start = self.offsets[friend]
+            end = self.offsets[friend + 1]
+            if max_fanout is not None:
+                end = min(end, start + max_fanout)
+            mutual_counts.update(self.targets[start:end])
+
+        candidates = []
+        for candidate, mutual_count in mutual_counts.items():
+            if candidate in excluded:
+                continue
+            score = mutual_count
+            if activity is not None:
+                score += activity_weight * activity[candidate]
+            candidates.append((score, mutual_count, candidate))
+
+        return [(candidate, mutual_count, score) for score, mutual_count,
+                candidate in heapq.nlargest(top, candidates)]
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from main.article_html import refresh_article_html
+from main.models import Article
+
+
+class Command(BaseCommand):
+    help = ('Extract the metadata (excerpt, word count, reading time, image '
+            'count) and ETag of articles from their stored html files and '
+            'write the precompressed copies served by ArticleHTML (for '
+            'articles saved before these existed).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='refresh every article, not only the ones '
+                                 'without an ETag or word count')
+
+    def handle(self, *args, **options):
+        articles = Article.objects.select_related('html_file').order_by('id')
+        if not options['all']:
+            articles = articles.filter(Q(html_etag='') | Q(word_count=0))
+
+        refreshed = 0
+        for article in articles.iterator(chunk_size=500):
+            try:
+                refresh_article_html(article)
+            except (OSError, UnicodeDecodeError) as e:
+                self.stderr.write(f"{article}: {e}")
+                continue
+            refreshed += 1
+        self.stdout.write(f"refreshed the html of {refreshed} articles")
@@ -0,0 +1,133 @@
+import random
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from bs4 import BeautifulSoup
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+
+from main.article_html import (ArticleHTMLRewriter, BLOB_PREFIX,
+                               IMAGE_WORKERS, spooled_html_file)
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the streaming article html rewriter '
+            '(main/article_html.py) against the former BeautifulSoup '
+            'parse and re-serialize, on a generated article, and the '
+            'parallel saving of article images against saving them one by '
+            'one (to a temporary directory; nothing is written to the '
+            'database or the media root).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paragraphs', type=int, default=2000)
+        parser.add_argument('--images', type=int, default=40)
+        parser.add_argument('--image-kb', type=int, default=500)
+        parser.add_argument('--latency-ms', type=float, default=20,
+                            help=('simulated latency of each image write, '
+                                  'as with a remote storage'))
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def generate_article(self, paragraph_count, image_count, seed):
+        '''returns (html, src_map) of an article with image_count blob
+        images spread among paragraph_count paragraphs'''
+        rng = random.Random(seed)
+        words = ['art', 'colour', 'brush', 'canvas', 'light', 'shadow',
+                 'line', 'form', 'texture', 'studio', 'sketch', 'paint']
+        image_positions = set(rng.sample(
+            range(paragraph_count), min(image_count, paragraph_count)))
+
+        parts = ['<h1>Generated &amp; benchmarked</h1>']
+        src_map = {}
+        for i in range(paragraph_count):
+            sentence = ' '.join(rng.choice(words) for _ in range(60))
+            parts.append(f'<p class="body">{sentence} <strong>{i}</strong>'
+                         f' &nbsp;<a href="/artworks/{i}">more</a></p>')
+            if i in image_positions:
+                src = f'{BLOB_PREFIX}http://localhost:3000/{i:08d}'
+                src_map[src] = f'media/articles/image/{i}.png'
+                parts.append(f'<figure><img src="{src}" alt="figure {i}">'
+                             f'</figure>')
+        return '\n'.join(parts), src_map
+
+    def beautifulsoup_path(self, html, src_map, out):
+        '''the former processing of ArticleList.post'''
+        html_soup = BeautifulSoup(html, 'html.parser')
+        for img in html_soup.find_all('img'):
+            src = img.get('src')
+            if not src.startswith(BLOB_PREFIX):
+                continue
+            img['src'] = src_map[src]
+        out.write(str(html_soup))
+        return [img.get('src') for img in html_soup.find_all('img')]
+
+    def streaming_path(self, html, src_map, out):
+        return ArticleHTMLRewriter(out, src_map).rewrite(html).image_srcs
+
+    def measure(self, path, html, src_map, repeat):
+        '''returns (best time in s, peak traced memory in bytes, img srcs)'''
+        times = []
+        for _ in range(repeat):
+            with spooled_html_file() as out:
+                start = time.perf_counter()
+                image_srcs = path(html, src_map, out)
+                times.append(time.perf_counter() - start)
+
+        with spooled_html_file() as out:
+            tracemalloc.start()
+            path(html, src_map, out)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return min(times), peak, image_srcs
+
+    def measure_image_saving(self, image_count, image_kb, latency, workers):
+        '''returns the time in s to save image_count files of image_kb KB
+        to a temporary directory with the given number of threads'''
+        content = random.Random(0).randbytes(image_kb * 1024)
+        with tempfile.TemporaryDirectory() as location:
+            storage = FileSystemStorage(location=location)
+
+            def store(i):
+                time.sleep(latency)
+                return storage.save(f'image/{i}.png', ContentFile(content))
+
+            start = time.perf_counter()
+            if workers == 1:
+                for i in range(image_count):
+                    store(i)
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    list(executor.map(store, range(image_count)))
+            return time.perf_counter() - start
+
+    def handle(self, *args, **options):
+        html, src_map = self.generate_article(
+            options['paragraphs'], options['images'], options['seed'])
+        self.stdout.write(
+            f"article: {len(html) / 2**20:.1f} MB of html, "
+            f"{len(src_map)} blob images")
+
+        results = {}
+        for name, path in (('beautifulsoup', self.beautifulsoup_path),
+                           ('streaming', self.streaming_path)):
+            best, peak, image_srcs = self.measure(
+                path, html, src_map, options['repeat'])
+            results[name] = image_srcs
+            self.stdout.write(
+                f"{name}: {best * 1000:.0f} ms, "
+                f"peak memory {peak / 2**20:.1f} MB")
+
+        if results['beautifulsoup'] != results['streaming']:
+            self.stderr.write('the two paths rewrote the img srcs differently!')
+
+        for workers in (1, IMAGE_WORKERS):
+            duration = self.measure_image_saving(
+                len(src_map), options['image_kb'],
+                options['latency_ms'] / 1000, workers)
+            self.stdout.write(
+                f"saving {len(src_map)} images of {options['image_kb']} KB "
+                f"({options['latency_ms']:g} ms latency each) with {workers} "
+                f"thread(s): {duration * 1000:.0f} ms")
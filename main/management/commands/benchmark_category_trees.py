@@ -0,0 +1,101 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+
+from main.models import ProductCategory, slugify
+
+
+def legacy_trees():
+    '''the former per-node implementation of ProductCategory.trees(), kept
+    here only as a baseline for comparison'''
+
+    def to_dict(category):
+        return {
+            "id": category.id,
+            "name": category.name,
+            "path": category.parent_tree(url=True),
+            "children": [
+                to_dict(child) for child in ProductCategory.objects.filter(
+                    parent=category).all()]
+        }
+
+    return [to_dict(root) for root in
+            ProductCategory.objects.filter(parent=None).all()]
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the product category tree builder against the legacy '
+            'per-node implementation. All categories created for the '
+            'benchmark are rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--roots', type=int, default=10)
+        parser.add_argument('--branching', type=int, default=8)
+        parser.add_argument('--depth', type=int, default=3)
+        parser.add_argument('--skip-legacy', action='store_true',
+                            help='only time the in-memory tree builder')
+
+    def create_categories(self, roots, branching, depth):
+        '''bulk create the category forest level by level (bypassing save()
+        and the signals, which would rebuild the cached trees every time)'''
+        level = ProductCategory.objects.bulk_create([
+            ProductCategory(name=f"b{i}", path=f"/b{i}")
+            for i in range(roots)])
+        ProductCategory.objects.filter(
+            id__in=[category.id for category in level]).update(root=F('id'))
+        root_ids = {category.id: category.id for category in level}
+
+        total = len(level)
+        for _ in range(depth):
+            children = []
+            for parent in level:
+                for i in range(branching):
+                    name = f"{parent.name}{i}"
+                    children.append(ProductCategory(
+                        name=name, parent=parent,
+                        root_id=root_ids[parent.id],
+                        path=f"{parent.path}/{slugify(name)}"))
+            level = ProductCategory.objects.bulk_create(children)
+            for category in level:
+                root_ids[category.id] = category.root_id
+            total += len(level)
+        return total
+
+    def timed(self, function):
+        query_count = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal query_count
+            query_count += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_queries):
+            start = time.perf_counter()
+            result = function()
+            duration = time.perf_counter() - start
+        return result, duration, query_count
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            total = self.create_categories(
+                options['roots'], options['branching'], options['depth'])
+            self.stdout.write(
+                f"benchmarking with {ProductCategory.objects.count()} "
+                f"categories ({total} generated)")
+
+            trees, duration, query_count = self.timed(ProductCategory.trees)
+            self.stdout.write(
+                f"tree builder: {duration*1000:.1f} ms, {query_count} queries")
+
+            if not options['skip_legacy']:
+                legacy, duration, query_count = self.timed(legacy_trees)
+                self.stdout.write(
+                    f"legacy trees: {duration*1000:.1f} ms, "
+                    f"{query_count} queries")
+                if legacy != trees:
+                    self.stdout.write(self.style.WARNING(
+                        "outputs differ (are some stored paths stale?)"))
+
+            transaction.set_rollback(True)
@@ -0,0 +1,60 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.follow_graph import FollowGraph
+from main.management.commands.compute_follow_suggestions import \
+    Command as ComputeFollowSuggestions
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the "who to follow" computation of the '
+            'compute_follow_suggestions command on a generated Following '
+            'graph held in memory (nothing is written to the database).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--edges', type=int, default=1_000_000)
+        parser.add_argument('--artists', type=int, default=None,
+                            help='defaults to edges / 20')
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument('--max-fanout', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def generate_edges(self, artist_count, edge_count, seed):
+        '''follows from uniformly random artists to skewed targets, so that a
+        few artists have most of the followers (like real follow graphs)'''
+        rng = random.Random(seed)
+        for _ in range(edge_count):
+            yield (rng.randrange(artist_count) + 1,
+                   int(artist_count * rng.random() ** 3) + 1)
+
+    def handle(self, *args, **options):
+        edge_count = options['edges']
+        artist_count = options['artists'] or max(edge_count // 20, 2)
+
+        start = time.perf_counter()
+        graph = FollowGraph(
+            range(1, artist_count + 1),
+            self.generate_edges(artist_count, edge_count, options['seed']))
+        build_time = time.perf_counter() - start
+
+        graph_bytes = graph.offsets.itemsize * len(graph.offsets) + \
+            graph.targets.itemsize * len(graph.targets)
+        self.stdout.write(
+            f"graph: {len(graph)} artists, {graph.edge_count} follows "
+            f"(after deduplication), {graph_bytes / 2**20:.1f} MB of CSR "
+            f"arrays, built in {build_time:.1f} s")
+
+        rng = random.Random(options['seed'])
+        activity = [rng.random() for _ in range(len(graph))]
+
+        start = time.perf_counter()
+        follow_suggestions = ComputeFollowSuggestions().compute_suggestions(
+            graph, activity, options['top'], options['max_fanout'], 1.0)
+        compute_time = time.perf_counter() - start
+
+        self.stdout.write(
+            f"suggestions: {len(follow_suggestions)} for {len(graph)} artists "
+            f"in {compute_time:.1f} s "
+            f"({compute_time / len(graph) * 1000:.2f} ms per artist)")
@@ -0,0 +1,123 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from main.api.facets import ProductFacets
+from main.models import (User, Seller, ProductCategory, License, Product,
+ProductXLicense)
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the ProductList facet counts on a generated catalog. '
+            'All rows created for the benchmark are rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--sellers', type=int, default=500)
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--target-ms', type=float, default=500,
+                            help='latency target for computing every facet')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def create_catalog(self, product_count, seller_count, category_count):
+        users = User.objects.bulk_create([
+            User(email=f"facet_bench_{i}@example.com",
+                 username=f"facet_bench_{i}")
+            for i in range(seller_count)])
+        sellers = Seller.objects.bulk_create([
+            Seller(user=user, alias=f"facet_bench_{i}",
+                   brand_name=f"facet_bench_{i}")
+            for i, user in enumerate(users)])
+
+        # one root category with a level of children underneath it
+        root = ProductCategory.objects.bulk_create([
+            ProductCategory(name='facet bench', path='/facet-bench')])[0]
+        categories = ProductCategory.objects.bulk_create([
+            ProductCategory(name=f"c{i}", path=f"/facet-bench/c{i}",
+                            parent=root, root=root)
+            for i in range(category_count)])
+
+        free_license, paid_license = License.objects.bulk_create([
+            License(name='facet bench free', free=True),
+            License(name='facet bench paid', free=False)])
+
+        # (is free, paid price) per product. Some products only have a free
+        # license, some only a paid one and some have both
+        product_licenses = [
+            (i % 2 == 0, (i * 37) % 30000 if (i % 2 or i % 3) else None)
+            for i in range(product_count)]
+
+        products = []
+        for i, (free, paid_price) in enumerate(product_licenses):
+            prices = ([0] if free else []) + \
+                ([paid_price] if paid_price is not None else [])
+            products.append(Product(
+                seller=sellers[i % seller_count],
+                category=categories[i % category_count],
+                title=f"product {i}", description='',
+                is_mature=(i % 7 == 0),
+                min_price=min(prices), max_price=max(prices),
+                has_free_license=free,
+                has_paid_license=paid_price is not None))
+        products = Product.objects.bulk_create(products, batch_size=5000)
+
+        productxlicenses = []
+        for product, (free, paid_price) in zip(products, product_licenses):
+            if free:
+                productxlicenses.append(ProductXLicense(
+                    product=product, license=free_license, price=0))
+            if paid_price is not None:
+                productxlicenses.append(ProductXLicense(
+                    product=product, license=paid_license, price=paid_price))
+        ProductXLicense.objects.bulk_create(productxlicenses, batch_size=5000)
+
+        return Product.objects.filter(category__root=root)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            start = time.perf_counter()
+            products_query = self.create_catalog(
+                options['products'], options['sellers'],
+                options['categories'])
+            self.stdout.write(
+                f"generated {options['products']} products in "
+                f"{time.perf_counter() - start:.1f} s")
+
+            # same shape of queryset as ProductList.get_queryset()
+            products_query = products_query.filter(listed=True).order_by('-id')
+
+            # only the benchmark's own facet counts are evicted, never the
+            # rest of the (possibly shared) cache
+            facets_key = ProductFacets(products_query).cache_key()
+
+            durations = []
+            for _ in range(options['repeat']):
+                cache.delete(facets_key)
+                start = time.perf_counter()
+                ProductFacets(products_query).counts()
+                durations.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            ProductFacets(products_query).counts()
+            cached_duration = (time.perf_counter() - start) * 1000
+
+            best = min(durations)
+            self.stdout.write(
+                f"all facets ({connection.vendor}): best {best:.1f} ms, "
+                f"worst {max(durations):.1f} ms, cached {cached_duration:.2f} ms")
+            for facet in ProductFacets.FACETS:
+                start = time.perf_counter()
+                getattr(ProductFacets(products_query), f"count_{facet}")()
+                self.stdout.write(
+                    f"  {facet}: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+            if best <= options['target_ms']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"within the {options['target_ms']:.0f} ms target"))
+            else:
+                self.stdout.write(self.style.WARNING(
+                    f"over the {options['target_ms']:.0f} ms target"))
+
+            transaction.set_rollback(True)
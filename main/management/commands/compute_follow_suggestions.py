@@ -0,0 +1,108 @@
+import math
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from main.follow_graph import FollowGraph
+from main.models import Artist, Artwork, Following, FollowSuggestion
+
+
+class Command(BaseCommand):
+    help = ('Recompute the "who to follow" suggestions of every artist from '
+            'the friends of friends in the Following graph, scored by '
+            'mutual-follow count plus recent activity. Artists with too few '
+            'suggestions are filled up with the most followed active artists.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20,
+                            help='number of suggestions kept per artist')
+        parser.add_argument('--max-fanout', type=int, default=500,
+                            help=('only this many follows of each followed '
+                                  'artist are counted'))
+        parser.add_argument('--activity-days', type=int, default=90,
+                            help='artworks published within this many days '
+                                 'count as activity')
+        parser.add_argument('--activity-weight', type=float, default=1.0,
+                            help='weight of the activity bonus in the score')
+
+    def load_graph(self):
+        '''returns the FollowGraph of all artists, in two queries'''
+        artist_ids = Artist.objects.values_list('id', flat=True).iterator(
+            chunk_size=10000)
+        edges = Following.objects.values_list(
+            'follower_id', 'following_id').iterator(chunk_size=10000)
+        return FollowGraph(artist_ids, edges)
+
+    def load_activity(self, graph, activity_days):
+        '''returns the activity bonus of each artist (by graph index):
+        log(1 + number of artworks published within activity_days)'''
+        index = {artist_id: i for i, artist_id in enumerate(graph.artist_ids)}
+        activity = [0.0] * len(graph)
+        recent_artworks = Artwork.objects.filter(
+            date_published__gte=timezone.now() - timedelta(days=activity_days)
+            ).values('artist_id').annotate(count=Count('id')).order_by()
+        for row in recent_artworks:
+            if row['artist_id'] in index:
+                activity[index[row['artist_id']]] = math.log1p(row['count'])
+        return activity
+
+    def compute_suggestions(self, graph, activity, top, max_fanout,
+                            activity_weight):
+        '''returns the FollowSuggestion instances (unsaved) of every artist'''
+        follower_counts = graph.follower_counts()
+
+        # fallback candidates for artists with few friends of friends: the
+        # most followed (then most active) artists
+        popular = sorted(
+            range(len(graph)), key=lambda i: (-follower_counts[i],
+                                              -activity[i]))[:top * 5]
+
+        follow_suggestions = []
+        for i in range(len(graph)):
+            ranked = graph.suggestions(
+                i, top, activity=activity, activity_weight=activity_weight,
+                max_fanout=max_fanout)
+
+            if len(ranked) < top:
+                excluded = set(graph.following(i))
+                excluded.add(i)
+                excluded.update(candidate for candidate, *_ in ranked)
+                for candidate in popular:
+                    if len(ranked) >= top:
+                        break
+                    if candidate not in excluded:
+                        ranked.append((candidate, 0,
+                                       activity_weight * activity[candidate]))
+
+            artist_id = graph.artist_ids[i]
+            follow_suggestions.extend(
+                FollowSuggestion(
+                    artist_id=artist_id,
+                    suggested_artist_id=graph.artist_ids[candidate],
+                    rank=rank, mutual_count=mutual_count, score=score)
+                for rank, (candidate, mutual_count, score) in
+                enumerate(ranked, 1))
+        return follow_suggestions
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+
+        graph = self.load_graph()
+        activity = self.load_activity(graph, options['activity_days'])
+        follow_suggestions = self.compute_suggestions(
+            graph, activity, options['top'], options['max_fanout'],
+            options['activity_weight'])
+
+        with transaction.atomic():
+            FollowSuggestion.objects.all().delete()
+            FollowSuggestion.objects.bulk_create(
+                follow_suggestions, batch_size=5000)
+
+        self.stdout.write(
+            f"stored {len(follow_suggestions)} follow suggestions for "
+            f"{len(graph)} artists ({graph.edge_count} follows) in "
+            f"{time.perf_counter() - start:.1f} s")
@@ -0,0 +1,114 @@
+import heapq
+import math
+import time
+from collections import Counter, defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.models import (Product, ProductLibraryXXProductXLicense,
+RelatedProduct)
+
+
+class Command(BaseCommand):
+    help = ('Recompute the "customers also got" recommendations of every '
+            'product from product library co-ownership, falling back to '
+            'products of the same category for products with few owners.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=12,
+                            help='number of related products kept per product')
+        parser.add_argument('--max-library-size', type=int, default=500,
+                            help=('only the most recently added products of '
+                                  'larger libraries are counted, to bound '
+                                  'the pairwise work of heavy buyers'))
+
+    def load_libraries(self, max_library_size):
+        '''returns {product library id: [product ids]}, one query'''
+        libraries = defaultdict(dict)
+        ownerships = ProductLibraryXXProductXLicense.objects.order_by(
+            '-id').values_list('product_library_id',
+                               'productxlicense__product_id')
+        for library_id, product_id in ownerships.iterator(chunk_size=5000):
+            library = libraries[library_id]
+            # owning several licenses of a product counts once
+            if len(library) < max_library_size:
+                library[product_id] = True
+        return {library_id: list(library) for library_id, library in
+                libraries.items()}
+
+    def co_ownership_scores(self, libraries):
+        '''returns the sparse co-occurrence matrix as {product id: Counter of
+        {other product id: similarity}}, where the similarity of two products
+        is the number of libraries owning both, normalized by the number of
+        owners of each (cosine similarity)'''
+        owner_counts = Counter()
+        co_occurrences = defaultdict(Counter)
+        for product_ids in libraries.values():
+            owner_counts.update(product_ids)
+            for index, product_id in enumerate(product_ids):
+                for other_product_id in product_ids[index + 1:]:
+                    co_occurrences[product_id][other_product_id] += 1
+                    co_occurrences[other_product_id][product_id] += 1
+
+        for product_id, counts in co_occurrences.items():
+            for other_product_id, count in counts.items():
+                counts[other_product_id] = count / math.sqrt(
+                    owner_counts[product_id] * owner_counts[other_product_id])
+        return co_occurrences, owner_counts
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        top = options['top']
+
+        libraries = self.load_libraries(options['max_library_size'])
+        scores, owner_counts = self.co_ownership_scores(libraries)
+
+        products = list(Product.objects.values_list(
+            'id', 'category_id', 'category__root_id', 'listed'))
+        listed_ids = {id for id, category_id, root_id, listed in products
+                      if listed}
+
+        # category fallback candidates, most owned (then newest) first
+        by_category = defaultdict(list)
+        by_root_category = defaultdict(list)
+        for id, category_id, root_id, listed in sorted(
+                products, key=lambda p: (-owner_counts[p[0]], -p[0])):
+            if listed:
+                by_category[category_id].append(id)
+                by_root_category[root_id].append(id)
+
+        related_products = []
+        for id, category_id, root_id, listed in products:
+            candidates = [
+                (score, other_id) for other_id, score in
+                scores.get(id, {}).items() if other_id in listed_ids]
+            ranked = [(other_id, score, RelatedProduct.CO_OWNERSHIP)
+                      for score, other_id in heapq.nlargest(top, candidates)]
+
+            # cold items: fill the remaining slots from the same category,
+            # then from the same root category
+            chosen_ids = {id} | {other_id for other_id, *_ in ranked}
+            for fallback_ids in (by_category[category_id],
+                                 by_root_category[root_id]):
+                for other_id in fallback_ids:
+                    if len(ranked) >= top:
+                        break
+                    if other_id not in chosen_ids:
+                        chosen_ids.add(other_id)
+                        ranked.append((other_id, 0, RelatedProduct.CATEGORY))
+
+            related_products.extend(
+                RelatedProduct(product_id=id, related_product_id=other_id,
+                               rank=rank, score=score, source=source)
+                for rank, (other_id, score, source) in enumerate(ranked, 1))
+
+        with transaction.atomic():
+            RelatedProduct.objects.all().delete()
+            RelatedProduct.objects.bulk_create(
+                related_products, batch_size=5000)
+
+        self.stdout.write(
+            f"stored {len(related_products)} related products for "
+            f"{len(products)} products from {len(libraries)} libraries in "
+            f"{time.perf_counter() - start:.1f} s")
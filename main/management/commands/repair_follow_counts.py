@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from main.models import Artist
+
+
+class Command(BaseCommand):
+    help = ('Recompute the denormalized followers_count and following_count '
+            'of every artist from the Following rows (e.g after bulk imports '
+            'or raw SQL changes which bypassed the Following signals).')
+
+    def handle(self, *args, **options):
+        updated = Artist.update_follow_counts()
+        self.stdout.write(f"recomputed the follow counts of {updated} artists")
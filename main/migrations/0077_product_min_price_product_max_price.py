@@ -0,0 +1,40 @@
+# Generated by Django 5.1.4 on 2026-10-19 15:30
+
+from django.db import migrations, models
+from django.db.models import Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_price_range(apps, schema_editor):
+    Product = apps.get_model('main', 'Product')
+    ProductXLicense = apps.get_model('main', 'ProductXLicense')
+
+    def price_range(aggregate):
+        return Coalesce(Subquery(
+            ProductXLicense.objects.filter(product=OuterRef('pk'))
+            .values('product').annotate(price=aggregate('price'))
+            .values('price')[:1]), 0)
+
+    Product.objects.update(
+        min_price=price_range(Min), max_price=price_range(Max))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0076_artworkvariant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='max_price',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='min_price',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(populate_price_range, migrations.RunPython.noop),
+    ]
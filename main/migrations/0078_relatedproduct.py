@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-19 15:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0077_product_min_price_product_max_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField(default=0)),
+                ('source', models.CharField(choices=[('co-ownership', 'Co-ownership'), ('category', 'Category')], max_length=20)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_products', to='main.product')),
+                ('related_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'rank'], name='related_product_rank_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'related_product'), name='unique_related_product')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.4 on 2026-10-19 15:40
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_follow_counts(apps, schema_editor):
+    Artist = apps.get_model('main', 'Artist')
+    Following = apps.get_model('main', 'Following')
+
+    def follow_count(field):
+        return Coalesce(Subquery(
+            Following.objects.filter(**{field: OuterRef('pk')})
+            .values(field).annotate(count=Count('id'))
+            .values('count')[:1]), 0)
+
+    Artist.objects.update(followers_count=follow_count('following'),
+                          following_count=follow_count('follower'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0078_relatedproduct'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artist',
+            name='followers_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='following_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_follow_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-19 15:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0079_artist_follow_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FollowSuggestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('mutual_count', models.PositiveIntegerField(default=0)),
+                ('score', models.FloatField(default=0)),
+                ('artist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='follow_suggestions', to='main.artist')),
+                ('suggested_artist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.artist')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['artist', 'rank'], name='follow_suggestion_rank_idx')],
+                'constraints': [models.UniqueConstraint(fields=('artist', 'suggested_artist'), name='unique_follow_suggestion')],
+            },
+        ),
+    ]
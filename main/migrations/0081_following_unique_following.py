@@ -0,0 +1,44 @@
+# Generated by Django 5.1.4 on 2026-10-19 15:43
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def delete_duplicate_followings(apps, schema_editor):
+    '''keep the oldest Following of each (follower, following) pair, then
+    recompute the denormalized follow counts of the artists'''
+    Artist = apps.get_model('main', 'Artist')
+    Following = apps.get_model('main', 'Following')
+
+    duplicates = Following.objects.values('follower', 'following').annotate(
+        first_id=Min('id'), count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        Following.objects.filter(
+            follower=duplicate['follower'], following=duplicate['following']
+            ).exclude(id=duplicate['first_id']).delete()
+
+    def follow_count(field):
+        return Coalesce(Subquery(
+            Following.objects.filter(**{field: OuterRef('pk')})
+            .values(field).annotate(count=Count('id'))
+            .values('count')[:1]), 0)
+
+    Artist.objects.update(followers_count=follow_count('following'),
+                          following_count=follow_count('follower'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0080_followsuggestion'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_followings,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='following',
+            constraint=models.UniqueConstraint(fields=('follower', 'following'), name='unique_following'),
+        ),
+    ]
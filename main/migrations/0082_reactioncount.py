@@ -0,0 +1,41 @@
+# Generated by Django 5.1.4 on 2026-10-19 15:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_reaction_counts(apps, schema_editor):
+    Reaction = apps.get_model('main', 'Reaction')
+    ReactionCount = apps.get_model('main', 'ReactionCount')
+
+    counts = Reaction.objects.values(
+        'content_type_id', 'object_id', 'reaction_type_id').annotate(
+            count=Count('id')).order_by()
+    ReactionCount.objects.bulk_create(
+        [ReactionCount(**row) for row in counts.iterator()], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('main', '0081_following_unique_following'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReactionCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+                ('reaction_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.reactiontype')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('content_type', 'object_id', 'reaction_type'), name='unique_reaction_count')],
+            },
+        ),
+        migrations.RunPython(populate_reaction_counts, migrations.RunPython.noop),
+    ]
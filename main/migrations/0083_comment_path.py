@@ -0,0 +1,66 @@
+# Generated by Django 5.1.4 on 2026-10-19 15:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_comment_paths(apps, schema_editor):
+    Comment = apps.get_model('main', 'Comment')
+
+    parent_ids = dict(Comment.objects.values_list('id', 'parent_comment_id'))
+    paths = {}
+
+    def path_of(comment_id):
+        # iterative, so that deep threads don't hit the recursion limit
+        chain = []
+        while comment_id is not None and comment_id not in paths:
+            chain.append(comment_id)
+            comment_id = parent_ids[comment_id]
+        for chain_id in reversed(chain):
+            parent_id = parent_ids[chain_id]
+            parent_path, parent_depth, parent_root = paths.get(
+                parent_id, ('', -1, None))
+            paths[chain_id] = (
+                f"{parent_path}/{chain_id:010d}", parent_depth + 1,
+                (parent_root or parent_id) if parent_id else None)
+
+    comments = []
+    for comment in Comment.objects.only('id').iterator():
+        path_of(comment.id)
+        comment.path, comment.depth, comment.root_id = paths[comment.id]
+        comments.append(comment)
+    Comment.objects.bulk_update(comments, ['path', 'depth', 'root'],
+                                batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('main', '0082_reactioncount'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, default='', max_length=1100),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='root',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thread_comments', to='main.comment'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['root', 'path'], name='comment_thread_idx'),
+        ),
+        migrations.RunPython(populate_comment_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-19 15:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0084_comment_post_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='excerpt',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='html_etag',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.4 on 2026-10-19 16:42
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def populate_license_flags(apps, schema_editor):
+    Product = apps.get_model('main', 'Product')
+    ProductXLicense = apps.get_model('main', 'ProductXLicense')
+
+    def offers_license(free):
+        return Exists(ProductXLicense.objects.filter(
+            product=OuterRef('pk'), license__free=free))
+
+    Product.objects.update(has_free_license=offers_license(True),
+                           has_paid_license=offers_license(False))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0086_article_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='has_free_license',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='has_paid_license',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(populate_license_flags, migrations.RunPython.noop),
+    ]
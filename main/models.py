@@ -34,7 +34,10 @@ ProductLibraryXXProductXLicense: secondary through table for ProductLibrary and
 '''
 
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import (Value, Min, Max, Count, OuterRef, Subquery,
+                              Exists)
+from django.db.models.functions import Concat, Substr, Coalesce
 from django.utils import timezone
 import time
 import random
@@ -96,6 +99,76 @@ class Reaction(models.Model):
     def __str__(self):
         return f"Reaction{self.id}: {self.reaction_type.name} | Object: {self.content_object} | User:{self.user.username}"
 
+    @classmethod
+    def react(cls, user, reaction_type, content_type, object_id):
+        '''idempotent: adds the reaction unless it already exists (a single
+        INSERT backed by the unique_reaction constraint, so concurrent
+        duplicate reactions can't slip in). Returns True if it was added'''
+        try:
+            with transaction.atomic():
+                cls.objects.create(user=user, reaction_type=reaction_type,
+                                   content_type=content_type,
+                                   object_id=object_id)
+        except IntegrityError:
+            return False
+        return True
+
+    @classmethod
+    def unreact(cls, user, reaction_type, content_type, object_id):
+        '''idempotent: removes the reaction if it exists. The row is locked
+        first so that concurrent removals delete it (and send post_delete)
+        only once. Returns True if it was removed'''
+        with transaction.atomic():
+            reaction = cls.objects.select_for_update().filter(
+                user=user, reaction_type=reaction_type,
+                content_type=content_type, object_id=object_id).first()
+            if reaction is None:
+                return False
+            reaction.delete()
+        return True
+
+
+class ReactionCount(models.Model):
+    '''denormalized number of reactions of each type on an object (artwork,
+    post, etc), kept up to date by the Reaction signals (see increment), so
+    that reaction summaries don't need to count the Reaction rows'''
+    reaction_type = models.ForeignKey(ReactionType, on_delete=models.CASCADE)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['content_type', 'object_id', 'reaction_type'],
+                name='unique_reaction_count')
+        ]
+
+    def __str__(self):
+        return f"ReactionCount{self.id}: {self.reaction_type_id} | \
+            {self.content_type_id}:{self.object_id} = {self.count}"
+
+    @classmethod
+    def increment(cls, content_type_id, object_id, reaction_type_id, amount=1):
+        '''atomically add amount (can be negative) to the counter, creating
+        it if it doesn't exist yet'''
+        counter = cls.objects.filter(content_type_id=content_type_id,
+                                     object_id=object_id,
+                                     reaction_type_id=reaction_type_id)
+        # decrements never create counters (e.g while the object or the
+        # reaction type are being deleted)
+        if counter.update(count=models.F('count') + amount) or amount < 0:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(content_type_id=content_type_id,
+                                   object_id=object_id,
+                                   reaction_type_id=reaction_type_id,
+                                   count=amount)
+        except IntegrityError:
+            # created concurrently
+            counter.update(count=models.F('count') + amount)
+
 
 class Comment(models.Model):
     '''A post in this context could be an artwork upload, a review, a challenge
@@ -117,11 +190,61 @@ class Comment(models.Model):
                     on_delete=models.CASCADE, related_name='child_comments')    
     date_posted = models.DateTimeField(null=False, default=timezone.now)
 
+    # materialized path of the comment thread, maintained by save(): the ids
+    # of the ancestors and of this comment, zero-padded so that ordering a
+    # thread by path lists every comment right after its parent (pre-order)
+    # e.g /0000000012/0000000015. root is None for top-level comments.
+    path = models.CharField(max_length=1100, blank=True, default='')
+    depth = models.PositiveSmallIntegerField(default=0)
+    # the deepest reply the path can hold (11 characters per level)
+    MAX_DEPTH = 1100 // 11 - 1
+    root = models.ForeignKey('self', null=True, blank=True,
+                    on_delete=models.CASCADE, related_name='thread_comments')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post_type', 'post_id'], name='comment_post_idx'),
+            models.Index(fields=['root', 'path'], name='comment_thread_idx')
+        ]
+
     def __str__(self):
         parent_id = str(self.parent_comment.id) if self.parent_comment else ""
         parent_string = f"<parent: {parent_id}>" if parent_id else ""
         return f"Comment{self.id}{parent_string}: [{self.content}] by <{self.user.username}> on {self.post_object}"
 
+    @staticmethod
+    def path_segment(comment_id):
+        return f"/{comment_id:010d}"
+
+    def save(self, *args, **kwargs):
+        '''saves the comment, then (re)computes its materialized path from
+        its parent, rewriting the paths of its replies if it was moved'''
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            parent = self.parent_comment
+            path = (parent.path if parent else '') + self.path_segment(self.id)
+            if path == self.path:
+                return
+
+            old_path, old_depth = self.path, self.depth
+            self.path = path
+            self.depth = parent.depth + 1 if parent else 0
+            self.root_id = (parent.root_id or parent.id) if parent else None
+            Comment.objects.filter(id=self.id).update(
+                path=self.path, depth=self.depth, root_id=self.root_id)
+
+            if old_path:
+                # replace the old path prefix of the replies in one UPDATE
+                Comment.objects.filter(
+                    path__startswith=f"{old_path}/").update(
+                        path=Concat(
+                            Value(self.path),
+                            Substr('path', len(old_path) + 1),
+                            output_field=models.CharField()),
+                        depth=models.F('depth') + (self.depth - old_depth),
+                        root_id=self.root_id or self.id)
+
 
 class ViewLog(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -155,9 +278,30 @@ class Artist(models.Model):
     location = models.CharField(max_length=50, blank=True, null=True)
     website = models.CharField(max_length=50, blank=True, null=True)
 
+    # denormalized Following counts, kept up to date by the Following signals
+    # (see update_follow_counts)
+    followers_count = models.IntegerField(default=0)
+    following_count = models.IntegerField(default=0)
+
     def __str__(self):
         return f"Artist{self.id} | {self.user.username}"
 
+    @classmethod
+    def update_follow_counts(cls, artist_ids=None):
+        '''recompute the followers_count and following_count columns from the
+        Following rows, for the given artists (all artists if not given)'''
+        def follow_count(field):
+            return Coalesce(Subquery(
+                Following.objects.filter(**{field: OuterRef('pk')})
+                .values(field).annotate(count=Count('id'))
+                .values('count')[:1]), 0)
+
+        artists = cls.objects.all()
+        if artist_ids is not None:
+            artists = artists.filter(id__in=artist_ids)
+        return artists.update(followers_count=follow_count('following'),
+                              following_count=follow_count('follower'))
+
 
 class ArtCategory(models.Model):
     name = models.CharField(max_length=50)
@@ -369,8 +513,75 @@ class Following(models.Model):
     following = models.ForeignKey(
         Artist, on_delete=models.CASCADE, related_name='followers')
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['follower', 'following'],
+                name='unique_following')
+        ]
+
     def __str__(self):
         return f"Following{self.id}: {self.follower} -> {self.following}"
+
+    @classmethod
+    def follow(cls, follower, following):
+        '''idempotent: creates the Following unless it already exists (a
+        single INSERT backed by the unique_following constraint, so concurrent
+        double-clicks can't create duplicates). Returns True if it was
+        created'''
+        try:
+            with transaction.atomic():
+                cls.objects.create(follower=follower, following=following)
+        except IntegrityError:
+            return False
+        return True
+
+    @classmethod
+    def unfollow(cls, follower, following):
+        '''idempotent: deletes the Following if it exists. The row is locked
+        first so that concurrent unfollows delete it (and send post_delete,
+        which maintains the follow counts) only once. Returns True if it was
+        deleted'''
+        with transaction.atomic():
+            following_instance = cls.objects.select_for_update().filter(
+                follower=follower, following=following).first()
+            if following_instance is None:
+                return False
+            following_instance.delete()
+        return True
+
+
+class FollowSuggestion(models.Model):
+    '''precomputed "who to follow" suggestions: the top friends-of-friends of
+    each artist, ranked from 1 (best). Rebuilt by the
+    compute_follow_suggestions management command.
+
+    - mutual_count: number of artists followed by the artist who follow the
+    suggested artist (0 for popular-artist fallbacks)
+    - score: mutual_count plus the activity bonus of the suggested artist'''
+
+    artist = models.ForeignKey(Artist, on_delete=models.CASCADE,
+                               related_name='follow_suggestions')
+    suggested_artist = models.ForeignKey(Artist, on_delete=models.CASCADE,
+                                         related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    mutual_count = models.PositiveIntegerField(default=0)
+    score = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['artist', 'suggested_artist'],
+                name='unique_follow_suggestion')
+        ]
+        indexes = [
+            models.Index(fields=['artist', 'rank'],
+                         name='follow_suggestion_rank_idx')
+        ]
+
+    def __str__(self):
+        return f"FollowSuggestion{self.id} | \
+            {self.artist_id} -> {self.suggested_artist_id} (rank {self.rank})"
     
 
 class Genre(models.Model):
@@ -383,10 +594,8 @@ class Genre(models.Model):
     def get_default_pk(cls):
         '''for Review model (and any other model referencing Genre via foreign
         key) to get a default pk with which to point to Genre'''
-        genre, created = cls.objects.get_or_create(
-            name='Unclassified'
-        )
-        return genre.pk
+        from .reference_data import reference_data
+        return reference_data.get_or_create('genres', 'Unclassified').pk
 
     def __str__(self):
         return f"Genre{self.id} | {self.name}"
@@ -451,6 +660,13 @@ class Article(models.Model):
     thumbnail_image = models.ForeignKey(Image, null=True,
                                         on_delete=models.SET_NULL)
 
+    # extracted from the html when it is saved (see main/article_html.py)
+    html_etag = models.CharField(max_length=64, blank=True, default='')
+    excerpt = models.TextField(blank=True, default='')
+    word_count = models.PositiveIntegerField(default=0)
+    reading_time = models.PositiveIntegerField(default=0) # minutes
+    image_count = models.PositiveIntegerField(default=0)
+
     def __str__(self):
         return f"Article{self.id} ({self.title})"
     
@@ -523,19 +739,46 @@ class ProductCategory(models.Model):
         - jsonify: if True, return output as a json string of the dictionary
         tree (json.dumps)
         '''
-        tree =  {
-            "id": self.id,
-            "name": self.name,
-            "path": self.parent_tree(url=True),
-            "children": [
-                child.to_dict() for child in ProductCategory.objects.filter(
-                    parent=self).all()]
-        }
+        nodes, roots = ProductCategory.build_forest()
+        tree = nodes[self.id]
         if jsonify:
             return json.dumps(tree)
         else:
             return tree
-        
+
+
+    @classmethod
+    def build_forest(cls):
+        '''loads every product category in ONE query and assembles the trees
+        in memory, using the stored path column instead of walking the parents
+        of each node.
+
+        returns a tuple of (nodes, roots):
+        - nodes: dictionary of {category id: tree node}
+        - roots: list of the root tree nodes, ordered by id
+        '''
+        categories = list(cls.objects.order_by('id').values(
+            'id', 'name', 'path', 'parent_id'))
+
+        nodes = {
+            category['id']: {
+                "id": category['id'],
+                "name": category['name'],
+                "path": category['path'],
+                "children": []
+            } for category in categories}
+
+        roots = []
+        for category in categories:
+            node = nodes[category['id']]
+            parent_node = nodes.get(category['parent_id'])
+            if parent_node is None:
+                roots.append(node)
+            else:
+                parent_node['children'].append(node)
+
+        return nodes, roots
+
 
     @classmethod
     def trees(cls, jsonify=False):
@@ -543,8 +786,7 @@ class ProductCategory(models.Model):
 
         - jsonify: if True, return output as a json string
         '''
-        root_categories = ProductCategory.objects.filter(parent=None).all()
-        trees = [root.to_dict() for root in root_categories]
+        nodes, trees = cls.build_forest()
 
         if jsonify:
             return json.dumps(trees)
@@ -557,16 +799,47 @@ class ProductCategory(models.Model):
         Return False if it fails (is cyclic: meaning it is set as a descendant
         of its descendant)
 
+        The ancestors are walked in memory from a single (id, parent_id)
+        query, rather than fetching self.parent once per level.
+
         - initiator: this category instance e.g ctgr1.cyclic_test(ctgr1)
         '''
         
-        if self.parent == None or self.id == None:
+        if self.parent_id == None or self.id == None:
             return True
-        elif self.parent.id == initiator.id:
-            return False
-        else:
-            return self.parent.cyclic_test(initiator=initiator)      
-        
+
+        parent_ids = dict(
+            ProductCategory.objects.values_list('id', 'parent_id'))
+        visited_ids = set()
+        ancestor_id = self.parent_id
+        while ancestor_id is not None and ancestor_id not in visited_ids:
+            if ancestor_id == initiator.id:
+                return False
+            visited_ids.add(ancestor_id)
+            ancestor_id = parent_ids.get(ancestor_id)
+        return True
+
+
+    def rewrite_subtree(self, old_path):
+        '''rewrite the path and root of every descendant of this instance
+        after it has been renamed or moved (re-parented), using a single
+        set-based UPDATE which replaces the old path prefix with the new one.
+
+        - old_path: the path of this instance before the rename/move
+        '''
+        root_id = self.root_id or self.id
+        prefix_length = len(old_path)
+
+        # the ending '/' ensures that only descendants match, and not
+        # categories with a similar spelling (e.g /tutor vs /tutorials)
+        return ProductCategory.objects.filter(
+            path__startswith=f"{old_path}/").update(
+                path=Concat(
+                    Value(self.path),
+                    Substr('path', prefix_length + 1),
+                    output_field=models.CharField()),
+                root_id=root_id)
+
 
     def __str__(self):
         return f"ProductCategory{self.id} | {self.parent_tree(url=False)}"
@@ -593,9 +866,28 @@ class ProductCategory(models.Model):
     def save(self, *args, **kwargs):
         # call clean() which we have overridden
         self.clean(*args, **kwargs)
-        self.path = self.parent_tree(url=True)
-        self.root = self.get_root()
-        super(ProductCategory, self).save(*args, **kwargs)
+
+        # build the path and root from the parent's stored columns (which are
+        # kept up to date by rewrite_subtree) instead of recursing up parents
+        if self.parent:
+            parent_path = self.parent.path or self.parent.parent_tree(url=True)
+            self.path = f"{parent_path}/{slugify(self.name)}"
+            self.root_id = self.parent.root_id or self.parent.id
+        else:
+            self.path = self.parent_tree(url=True)
+            self.root = self.get_root()
+
+        old_path = None
+        if self.id:
+            old_path = ProductCategory.objects.filter(id=self.id).values_list(
+                'path', flat=True).first()
+
+        # the instance and all its descendants are updated together or not
+        # at all, so that subcategory filtering never sees a half-moved tree
+        with transaction.atomic():
+            super(ProductCategory, self).save(*args, **kwargs)
+            if old_path and old_path != self.path:
+                self.rewrite_subtree(old_path)
     
     class Meta:
         verbose_name_plural = "Product Categories"
@@ -622,6 +914,16 @@ class Product(models.Model):
     licenses = models.ManyToManyField(License, through='ProductXLicense')
     listed = models.BooleanField(default=True)
 
+    # denormalized price range of this product's licenses, so that products
+    # can be filtered and sorted by price in SQL. Kept up to date by the
+    # ProductXLicense signals (see update_price_range)
+    min_price = models.PositiveIntegerField(default=0, db_index=True)
+    max_price = models.PositiveIntegerField(default=0, db_index=True)
+    # whether any of this product's licenses is free / paid, for the license
+    # facet. Kept up to date along with the price range
+    has_free_license = models.BooleanField(default=False)
+    has_paid_license = models.BooleanField(default=False)
+
     '''generic related fields for reverse quering (many to many behaviour)
     note that in the case of <comments>, which is of the Comment model (where
     a custom content_type/object_id field name has been used, we now specify)
@@ -638,12 +940,35 @@ class Product(models.Model):
     
     @property
     def price(self):
-        productXLicense_cheapest = ProductXLicense.objects.filter(
-            product__id=self.id).order_by('price').first()
-        if not productXLicense_cheapest:
-            return 0
-        
-        return productXLicense_cheapest.price
+        '''the price of the CHEAPEST license for this product'''
+        return self.min_price
+
+    @classmethod
+    def update_price_range(cls, product_id):
+        '''recompute the min_price and max_price columns (0 if it has no
+        licenses) and the has_free_license/has_paid_license flags of a
+        product from its ProductXLicense rows'''
+        price_range = ProductXLicense.objects.filter(
+            product_id=product_id).aggregate(
+                min_price=Min('price'), max_price=Max('price'),
+                free_count=Count('id', filter=models.Q(license__free=True)),
+                paid_count=Count('id', filter=models.Q(license__free=False)))
+        cls.objects.filter(id=product_id).update(
+            min_price=price_range['min_price'] or 0,
+            max_price=price_range['max_price'] or 0,
+            has_free_license=price_range['free_count'] > 0,
+            has_paid_license=price_range['paid_count'] > 0)
+
+    @classmethod
+    def update_license_flags(cls, products_query):
+        '''recompute the has_free_license/has_paid_license flags of the
+        given products with one UPDATE (e.g after a license became free)'''
+        def offers_license(free):
+            return Exists(ProductXLicense.objects.filter(
+                product=OuterRef('pk'), license__free=free))
+
+        products_query.update(has_free_license=offers_license(True),
+                              has_paid_license=offers_license(False))
     
 
 class ProductItem(models.Model):
@@ -770,6 +1095,46 @@ class ProductLibraryXXProductXLicense(models.Model):
             {self.product_library.id} XX {self.productxlicense}"
 
 
+class RelatedProduct(models.Model):
+    '''precomputed "customers also got" recommendations: the top related
+    products of each product, ranked from 1 (most related). Rebuilt by the
+    compute_related_products management command.
+
+    - score: co-ownership similarity of the two products (0 for category
+    fallbacks)
+    - source: how the recommendation was found (co-ownership or category)'''
+
+    CO_OWNERSHIP = 'co-ownership'
+    CATEGORY = 'category'
+    SOURCE_CHOICES = [
+        (CO_OWNERSHIP, 'Co-ownership'),
+        (CATEGORY, 'Category'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE,
+                                related_name='related_products')
+    related_product = models.ForeignKey(Product, on_delete=models.CASCADE,
+                                        related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField(default=0)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product', 'related_product'],
+                name='unique_related_product')
+        ]
+        indexes = [
+            models.Index(fields=['product', 'rank'],
+                         name='related_product_rank_idx')
+        ]
+
+    def __str__(self):
+        return f"RelatedProduct{self.id} | \
+            {self.product_id} -> {self.related_product_id} (rank {self.rank})"
+
+
 class Contest(models.Model):
     '''for the Challenge section'''
     title = models.CharField(max_length=100)
@@ -0,0 +1,151 @@
+'''Process-wide registry of small, almost static lookup tables (file types,
+file groups, reaction types, licenses, art categories, genres and content
+types), so that hot paths don't re-query them on every request.
+
+Each table is loaded on first use and kept in process memory. Changes to
+the tables bump a version key in the cache (see signals.py), which every
+process checks at most once every VERSION_CHECK_INTERVAL seconds to drop its
+stale copies. Loaded tables are also reloaded once they are MAX_AGE seconds
+old, for processes which don't see the version key change (see the comment
+on CACHES in settings.py).
+
+Usage:
+    from main.reference_data import reference_data
+    file_group = reference_data.get('file_groups', 'articles')'''
+
+import threading
+import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+
+from .models import FileType, FileGroup, ReactionType, License, ArtCategory, Genre
+
+
+class ReferenceData:
+
+    # table name: (model, lookup field)
+    TABLES = {
+        'file_types': (FileType, 'name'),
+        'file_groups': (FileGroup, 'name'),
+        'reaction_types': (ReactionType, 'name'),
+        'licenses': (License, 'id'),
+        'art_categories': (ArtCategory, 'id'),
+        'genres': (Genre, 'name'),
+        'content_types': (ContentType, 'model'),
+    }
+
+    VERSION_KEY = 'reference_data_version'
+    VERSION_CHECK_INTERVAL = 1 # seconds
+    MAX_AGE = 60 # seconds
+    # a lookup miss reloads the table at most this often, so that unknown
+    # keys (e.g from urls) can't make every request query the table
+    MISS_RELOAD_INTERVAL = 1 # seconds
+
+    def __init__(self):
+        self._tables = {} # table name: (instances, load time)
+        self._version = None
+        self._version_checked_at = 0
+        self._lock = threading.Lock()
+
+    def check_version(self):
+        '''drop the loaded tables if another process changed them'''
+        now = time.monotonic()
+        if now - self._version_checked_at < self.VERSION_CHECK_INTERVAL:
+            return
+        self._version_checked_at = now
+
+        version = cache.get(self.VERSION_KEY)
+        if version != self._version:
+            with self._lock:
+                self._tables = {}
+                self._version = version
+
+    def load(self, table):
+        '''returns {lookup value: instance} for the table, from the database'''
+        model, field = self.TABLES[table]
+        instances = {}
+        for instance in model.objects.order_by('id'):
+            if model is ContentType:
+                # model names can be shared by several apps (e.g 'image'):
+                # this app's models take precedence
+                if instance.app_label != 'main' and instance.model in instances:
+                    continue
+            instances[getattr(instance, field)] = instance
+        return instances
+
+    def reload(self, table):
+        '''returns (instances, load time) of the table, freshly loaded'''
+        loaded = (self.load(table), time.monotonic())
+        with self._lock:
+            self._tables[table] = loaded
+        return loaded
+
+    def loaded(self, table):
+        '''returns (instances, load time) of the table, loading it if it
+        isn't loaded yet (or too old)'''
+        self.check_version()
+        loaded = self._tables.get(table)
+        if loaded is None or time.monotonic() - loaded[1] > self.MAX_AGE:
+            loaded = self.reload(table)
+        return loaded
+
+    def all(self, table):
+        '''returns {lookup value: instance} for the table'''
+        return self.loaded(table)[0]
+
+    def normalize_key(self, table, key):
+        '''lookup values of id tables are ints, but may be passed as strings
+        (e.g from request data). Returns None for invalid ids.'''
+        model, field = self.TABLES[table]
+        if field != 'id':
+            return key
+        try:
+            return int(key)
+        except (TypeError, ValueError):
+            return None
+
+    def get(self, table, key):
+        '''returns the instance of the table with the lookup value key.
+        Raises the model's DoesNotExist if there is none (like
+        Model.objects.get).'''
+        model, field = self.TABLES[table]
+        lookup_key = self.normalize_key(table, key)
+        instance = None
+        if lookup_key is not None:
+            instances, loaded_at = self.loaded(table)
+            instance = instances.get(lookup_key)
+            if instance is None and \
+                    time.monotonic() - loaded_at >= self.MISS_RELOAD_INTERVAL:
+                # may have been created since the table was loaded
+                instance = self.reload(table)[0].get(lookup_key)
+
+        if instance is None:
+            raise model.DoesNotExist(
+                f"{model.__name__} matching {field}={key!r} does not exist.")
+        return instance
+
+    def get_or_create(self, table, key):
+        '''returns the instance of the table with the lookup value key,
+        creating it if needed'''
+        try:
+            return self.get(table, key)
+        except self.TABLES[table][0].DoesNotExist:
+            model, field = self.TABLES[table]
+            instance, created = model.objects.get_or_create(**{field: key})
+            # make it visible to the next get() without waiting for a reload
+            with self._lock:
+                if table in self._tables:
+                    self._tables[table][0][key] = instance
+            return instance
+
+    def invalidate(self):
+        '''drop the loaded tables in every process'''
+        cache.set(self.VERSION_KEY, time.time_ns(), None)
+        with self._lock:
+            self._tables = {}
+            self._version = None
+            self._version_checked_at = 0
+
+
+reference_data = ReferenceData()
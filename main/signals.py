@@ -14,11 +14,27 @@ from django.dispatch import receiver
 
 # models
 from .models import (User, Artist, Artwork, File, Image, Review, Article,
-ProductCategory, ProductXImage, ProductItem)
+ProductCategory, ProductXImage, ProductItem, Product, ProductXLicense,
+ProductItemXLicense, ProductRating, Comment, Seller, License,
+ProductLibrary, ProductLibraryXXProductXLicense, Following, Reaction,
+ReactionCount, FileType, FileGroup, ReactionType, ArtCategory, Genre, Contest)
 from django.contrib.contenttypes.models import ContentType
 
 # other imports
 from django.core.cache import cache
+from .caching import (invalidate_product_detail, invalidate_all_product_details,
+invalidate_entitlements, invalidate_following_ids, invalidate_moderation_counts,
+invalidate_contest_ids)
+from .reference_data import reference_data
+from .article_html import delete_sidecars
+from django.db import transaction
+from django.db.models import F
+from concurrent.futures import ThreadPoolExecutor
+
+
+# removes the files of deleted images outside of the request/response cycle
+file_cleanup_executor = ThreadPoolExecutor(
+    max_workers=2, thread_name_prefix='file-cleanup')
 
 
 
@@ -78,8 +94,13 @@ def file_listener(sender, **kwargs):
 def image_listener(sender, **kwargs):
     model_instance = kwargs.get('instance')
     
-    # delete the resource it points to
-    model_instance.resource.delete()
+    # delete the resource it points to: in the background, once the deletion
+    # is committed, so that (bulk) deletes of images don't wait on storage
+    resource = model_instance.resource
+    if resource:
+        storage, name = resource.storage, resource.name
+        transaction.on_commit(
+            lambda: file_cleanup_executor.submit(storage.delete, name))
 
     # print(f'\n\n\nEXECUTED SIGNAL:  image and attached resource deleted\n\n\n')
 
@@ -113,7 +134,8 @@ def review_listener(sender, **kwargs):
 def article_listener(sender, **kwargs):
     model_instance = kwargs.get('instance')
     
-    # delete attached html file instance
+    # delete attached html file instance (and its precompressed copies)
+    delete_sidecars(model_instance.html_file.resource)
     model_instance.html_file.delete()
 
     # delete attached article images (based on the src_id mapping)
@@ -135,19 +157,40 @@ def product_category_listener(sender, **kwargs):
         model_instance.root = model_instance.get_root()
         model_instance.save()
 
-    # get the product categories in json tree structure (which is 
-    # computationally expensive) and store in cache
-    cache.set('product_category_trees', ProductCategory.trees(jsonify=True))
+    # get the product categories in json tree structure and store in cache.
+    # Wait for the transaction to commit, so that descendants rewritten by a
+    # rename/move (ProductCategory.rewrite_subtree) are included
+    transaction.on_commit(lambda: cache.set(
+        'product_category_trees', ProductCategory.trees(jsonify=True)))
 
     # print(f'\n\n\nEXECUTED SIGNAL:  product_category_trees in cache updated \n\n\n')
 
 
+@receiver(pre_delete, sender=ProductCategory, dispatch_uid='productcategory-uid3')
+def product_category_pre_delete_listener(sender, **kwargs):
+    model_instance = kwargs.get('instance')
+
+    # the children become roots (parent is SET_NULL): remember them so that
+    # their subtrees can be rewritten once the category is deleted
+    model_instance.orphan_ids = list(
+        model_instance.children.values_list('id', flat=True))
+
+
 @receiver(post_delete, sender=ProductCategory, dispatch_uid='productcategory-uid2')
 def product_category_listener2(sender, **kwargs):
+    model_instance = kwargs.get('instance')
 
-    # get the product categories in json tree structure (which is 
-    # computationally expensive) and store in cache
-    cache.set('product_category_trees', ProductCategory.trees(jsonify=True))
+    # rewrite the path and root of each orphaned child and its descendants
+    # (save() rebuilds them without the deleted ancestor). A child whose new
+    # root path is already taken makes save() raise, and the deletion is
+    # rolled back
+    for orphan in ProductCategory.objects.filter(
+            id__in=getattr(model_instance, 'orphan_ids', [])):
+        orphan.save()
+
+    # get the product categories in json tree structure and store in cache
+    transaction.on_commit(lambda: cache.set(
+        'product_category_trees', ProductCategory.trees(jsonify=True)))
 
     # print(f'\n\n\nEXECUTED SIGNAL:  product_category_trees in cache updated \n\n\n')
 
@@ -163,6 +206,28 @@ def productximage_listener(sender, **kwargs):
     # print(f'\n\n\nEXECUTED SIGNAL: product image deleted\n\n\n')
 
 
+# -------ProductXLicense-------
+@receiver(post_save, sender=ProductXLicense, dispatch_uid='productxlicense-uid')
+@receiver(post_delete, sender=ProductXLicense, dispatch_uid='productxlicense-uid2')
+def productxlicense_listener(sender, **kwargs):
+    model_instance = kwargs.get('instance')
+
+    # keep the denormalized price range and license flags of the product up
+    # to date
+    Product.update_price_range(model_instance.product_id)
+
+
+@receiver(post_save, sender=License, dispatch_uid='license-flags-uid')
+def license_flags_listener(sender, **kwargs):
+    model_instance = kwargs.get('instance')
+
+    # the license may have become free or paid (deleting a license deletes
+    # its ProductXLicense rows, which update the flags themselves)
+    if not kwargs.get('created'):
+        Product.update_license_flags(
+            Product.objects.filter(licenses=model_instance))
+
+
 # -------ProductItem-------
 @receiver(post_delete, sender=ProductItem, dispatch_uid='productitem-uid')
 def product_item_listener(sender, **kwargs):
@@ -179,4 +244,180 @@ def user_signed_up_listener(request, user, **kwargs):
     # activate user since google auth is automatic proof that email is valid
     user.is_active = True
     user.save()
-    
\ No newline at end of file
+    
+
+
+# -------ProductDetail cache-------
+# bump the cached ProductDetail version of the product(s) whenever any row the
+# serialized product depends on is saved or deleted
+@receiver(post_save, sender=Product, dispatch_uid='productdetail-cache-uid')
+@receiver(post_delete, sender=Product, dispatch_uid='productdetail-cache-uid2')
+def product_detail_cache_product_listener(sender, **kwargs):
+    model_instance = kwargs.get('instance')
+    invalidate_product_detail(model_instance.id)
+
+
+@receiver(post_save, sender=ProductItem, dispatch_uid='productdetail-cache-uid3')
+@receiver(post_delete, sender=ProductItem, dispatch_uid='productdetail-cache-uid4')
+@receiver(post_save, sender=ProductXLicense, dispatch_uid='productdetail-cache-uid5')
+@receiver(post_delete, sender=ProductXLicense, dispatch_uid='productdetail-cache-uid6')
+@receiver(post_save, sender=ProductXImage, dispatch_uid='productdetail-cache-uid7')
+@receiver(post_delete, sender=ProductXImage, dispatch_uid='productdetail-cache-uid8')
+@receiver(post_save, sender=ProductRating, dispatch_uid='productdetail-cache-uid9')
+@receiver(post_delete, sender=ProductRating, dispatch_uid='productdetail-cache-uid10')
+def product_detail_cache_product_row_listener(sender, **kwargs):
+    model_instance = kwargs.get('instance')
+    invalidate_product_detail(model_instance.product_id)
+
+
+@receiver(post_save, sender=ProductItemXLicense, dispatch_uid='productdetail-cache-uid11')
+@receiver(post_delete, sender=ProductItemXLicense, dispatch_uid='productdetail-cache-uid12')
+def product_detail_cache_item_license_listener(sender, **kwargs):
+    model_instance = kwargs.get('instance')
+    product_id = ProductItem.objects.filter(
+        id=model_instance.product_item_id).values_list(
+            'product_id', flat=True).first()
+    if product_id:
+        invalidate_product_detail(product_id)
+
+
+@receiver(post_save, sender=Comment, dispatch_uid='productdetail-cache-uid13')
+@receiver(post_delete, sender=Comment, dispatch_uid='productdetail-cache-uid14')
+def product_detail_cache_comment_listener(sender, **kwargs):
+    model_instance = kwargs.get('instance')
+
+    # only comments on products (they are counted as product reviews)
+    if model_instance.post_type_id == \
+            ContentType.objects.get_for_model(Product).id:
+        invalidate_product_detail(model_instance.post_id)
+
+
+@receiver(post_save, sender=Seller, dispatch_uid='productdetail-cache-uid15')
+@receiver(post_save, sender=User, dispatch_uid='productdetail-cache-uid16')
+def product_detail_cache_seller_listener(sender, **kwargs):
+    model_instance = kwargs.get('instance')
+    seller_filter = {'seller': model_instance} if sender == Seller \
+        else {'seller__user': model_instance}
+    invalidate_product_detail(*Product.objects.filter(
+        **seller_filter).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=License, dispatch_uid='productdetail-cache-uid17')
+@receiver(post_delete, sender=License, dispatch_uid='productdetail-cache-uid18')
+@receiver(post_save, sender=ProductCategory, dispatch_uid='productdetail-cache-uid19')
+@receiver(post_delete, sender=ProductCategory, dispatch_uid='productdetail-cache-uid20')
+def product_detail_cache_reference_data_listener(sender, **kwargs):
+    # licenses and categories are shared by many products
+    invalidate_all_product_details()
+
+
+# -------Entitlements cache-------
+@receiver(post_save, sender=ProductLibraryXXProductXLicense, dispatch_uid='entitlements-cache-uid')
+@receiver(post_delete, sender=ProductLibraryXXProductXLicense, dispatch_uid='entitlements-cache-uid2')
+def entitlements_cache_library_listener(sender, **kwargs):
+    model_instance = kwargs.get('instance')
+    user_id = ProductLibrary.objects.filter(
+        id=model_instance.product_library_id).values_list(
+            'user_id', flat=True).first()
+    if user_id:
+        invalidate_entitlements(user_id)
+
+
+@receiver(post_save, sender=ProductXLicense, dispatch_uid='entitlements-cache-uid3')
+def entitlements_cache_productxlicense_listener(sender, **kwargs):
+    # the product or license of an owned ProductXLicense could be edited.
+    # (deletions cascade to the library entries, handled above)
+    model_instance = kwargs.get('instance')
+    if not kwargs.get('created'):
+        invalidate_entitlements(*ProductLibraryXXProductXLicense.objects.filter(
+            productxlicense=model_instance).values_list(
+                'product_library__user_id', flat=True))
+
+
+# -------Followings cache-------
+@receiver(post_save, sender=Following, dispatch_uid='following-ids-cache-uid')
+@receiver(post_delete, sender=Following, dispatch_uid='following-ids-cache-uid2')
+def following_ids_cache_listener(sender, **kwargs):
+    model_instance = kwargs.get('instance')
+    invalidate_following_ids(model_instance.follower_id)
+
+
+# -------Following counts-------
+# keep the denormalized Artist.followers_count/following_count columns up to
+# date. Updated with F() expressions so that concurrent follows don't lose
+# counts. Deletions cascaded from a deleted artist also send post_delete.
+@receiver(post_save, sender=Following, dispatch_uid='following-counts-uid')
+def following_counts_create_listener(sender, **kwargs):
+    if kwargs.get('created'):
+        model_instance = kwargs.get('instance')
+        Artist.objects.filter(id=model_instance.follower_id).update(
+            following_count=F('following_count') + 1)
+        Artist.objects.filter(id=model_instance.following_id).update(
+            followers_count=F('followers_count') + 1)
+
+
+@receiver(post_delete, sender=Following, dispatch_uid='following-counts-uid2')
+def following_counts_delete_listener(sender, **kwargs):
+    model_instance = kwargs.get('instance')
+    Artist.objects.filter(id=model_instance.follower_id).update(
+        following_count=F('following_count') - 1)
+    Artist.objects.filter(id=model_instance.following_id).update(
+        followers_count=F('followers_count') - 1)
+
+
+# -------Reaction counts-------
+# keep the denormalized ReactionCount counters up to date
+@receiver(post_save, sender=Reaction, dispatch_uid='reaction-counts-uid')
+def reaction_counts_create_listener(sender, **kwargs):
+    if kwargs.get('created'):
+        model_instance = kwargs.get('instance')
+        ReactionCount.increment(model_instance.content_type_id,
+                                model_instance.object_id,
+                                model_instance.reaction_type_id)
+
+
+@receiver(post_delete, sender=Reaction, dispatch_uid='reaction-counts-uid2')
+def reaction_counts_delete_listener(sender, **kwargs):
+    model_instance = kwargs.get('instance')
+    ReactionCount.increment(model_instance.content_type_id,
+                            model_instance.object_id,
+                            model_instance.reaction_type_id, -1)
+
+
+# -------Reference data-------
+# drop the reference data registry of every process when a lookup table
+# changes
+@receiver(post_save, sender=FileType, dispatch_uid='reference-data-uid')
+@receiver(post_delete, sender=FileType, dispatch_uid='reference-data-uid2')
+@receiver(post_save, sender=FileGroup, dispatch_uid='reference-data-uid3')
+@receiver(post_delete, sender=FileGroup, dispatch_uid='reference-data-uid4')
+@receiver(post_save, sender=ReactionType, dispatch_uid='reference-data-uid5')
+@receiver(post_delete, sender=ReactionType, dispatch_uid='reference-data-uid6')
+@receiver(post_save, sender=License, dispatch_uid='reference-data-uid7')
+@receiver(post_delete, sender=License, dispatch_uid='reference-data-uid8')
+@receiver(post_save, sender=ArtCategory, dispatch_uid='reference-data-uid9')
+@receiver(post_delete, sender=ArtCategory, dispatch_uid='reference-data-uid10')
+@receiver(post_save, sender=Genre, dispatch_uid='reference-data-uid11')
+@receiver(post_delete, sender=Genre, dispatch_uid='reference-data-uid12')
+@receiver(post_save, sender=ContentType, dispatch_uid='reference-data-uid13')
+@receiver(post_delete, sender=ContentType, dispatch_uid='reference-data-uid14')
+def reference_data_listener(sender, **kwargs):
+    reference_data.invalidate()
+
+
+# -------Moderation counters-------
+@receiver(post_save, sender=Review, dispatch_uid='moderation-counts-uid')
+@receiver(post_delete, sender=Review, dispatch_uid='moderation-counts-uid2')
+@receiver(post_save, sender=Article, dispatch_uid='moderation-counts-uid3')
+@receiver(post_delete, sender=Article, dispatch_uid='moderation-counts-uid4')
+@receiver(post_save, sender=Product, dispatch_uid='moderation-counts-uid5')
+@receiver(post_delete, sender=Product, dispatch_uid='moderation-counts-uid6')
+def moderation_counts_listener(sender, **kwargs):
+    invalidate_moderation_counts(sender)
+
+
+# -------Contest ids-------
+@receiver(post_save, sender=Contest, dispatch_uid='contest-ids-uid')
+@receiver(post_delete, sender=Contest, dispatch_uid='contest-ids-uid2')
+def contest_ids_listener(sender, **kwargs):
+    invalidate_contest_ids()
@@ -1,3 +1,1670 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from array import array
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import shortuuid
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_drf_filepond.models import TemporaryUpload
+from PIL import Image as PILImage
+from rest_framework.test import APIClient
+
+from main.api.facets import ProductFacets
+from main.api.serializers import ReviewSerializer
+from main.api.views import (FollowingStatusBatch, ProductSubmission,
+                            ProductSubmissionError, RandomContest,
+                            ReactSummaryList)
+from main.article_html import ArticleHTMLRewriter, sidecar_name
+from main.caching import (CONTEST_IDS_CACHE_KEY, entitlements_cache_key,
+                          get_contest_ids, get_following_ids,
+                          get_moderation_counts, owns_license,
+                          product_detail_cache_key)
+from main.follow_graph import FollowGraph
+from main.management.commands.benchmark_category_trees import legacy_trees
+from main.models import (ArtCategory, Article, Artist, Comment, Contest, File,
+                         FileGroup, FileType, FollowSuggestion, Following,
+                         Image, License, Product, ProductCategory, ProductItem,
+                         ProductItemXLicense, ProductLibrary,
+                         ProductLibraryXXProductXLicense, ProductRating,
+                         ProductXLicense, Reaction, ReactionCount,
+                         ReactionType, RelatedProduct, Review, Seller)
+from main.reference_data import ReferenceData
+from user.models import User
+
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='test-media-')
+
+
+def tearDownModule():
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+def create_user(username, **kwargs):
+    return User.objects.create(
+        email=f'{username}@example.com', username=username, is_active=True,
+        **kwargs)
+
+
+def create_category(name, parent=None):
+    # (ProductCategory.save doesn't accept the arguments of create())
+    category = ProductCategory(name=name, parent=parent)
+    category.save()
+    return category
+
+
+def create_seller(alias):
+    return Seller.objects.create(
+        user=create_user(alias), alias=alias, brand_name=alias.title())
+
+
+def create_product(seller, category, license_prices, **kwargs):
+    '''creates a product offering each license of license_prices
+    ({license: price}) through the signal-maintained ProductXLicense rows'''
+    product = Product.objects.create(
+        seller=seller, category=category, title=kwargs.pop('title', 'pack'),
+        description='', **kwargs)
+    for license, price in license_prices.items():
+        # (ProductXLicense.save doesn't accept the arguments of create())
+        ProductXLicense(product=product, license=license, price=price).save()
+    product.refresh_from_db()
+    return product
+
+
+def png_data():
+    png = io.BytesIO()
+    PILImage.new('RGB', (4, 4)).save(png, 'PNG')
+    return png.getvalue()
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    DJANGO_DRF_FILEPOND_UPLOAD_TMP=os.path.join(MEDIA_ROOT, 'filepond-tmp'),
+    DJANGO_DRF_FILEPOND_FILE_STORE_PATH=os.path.join(MEDIA_ROOT, 'filepond'))
+class ProductSubmissionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('seller')
+        cls.seller = Seller.objects.create(
+            user=cls.user, alias='seller', brand_name='Seller')
+        # (ProductCategory.save doesn't accept the arguments of create())
+        cls.category = ProductCategory(name='Brushes')
+        cls.category.save()
+        cls.licenses = [License.objects.create(name='standard'),
+                        License.objects.create(name='extended')]
+        FileGroup.objects.get_or_create(name='products')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def temp_upload(self, name):
+        upload = TemporaryUpload(
+            upload_id=shortuuid.uuid()[:22], file_id=shortuuid.uuid()[:22],
+            upload_name=name, upload_type='F', uploaded_by=self.user)
+        upload.file.save(upload.file_id, ContentFile(b'data'), save=False)
+        upload.save()
+        return upload
+
+    def submission_data(self, prices):
+        return {
+            'title': 'brush pack',
+            'category': self.category.id,
+            'sample_images': [
+                {'file': {'serverId': self.temp_upload('a.png').upload_id}}],
+            'product_licenses': [
+                {'id': license.id, 'price': price}
+                for license, price in zip(self.licenses, prices)],
+            'product_files': [{
+                'file': {'serverId': self.temp_upload('a.zip').upload_id,
+                         'fileType': 'application/zip'},
+                'licenses': [{'id': self.licenses[0].id}]}],
+        }
+
+    def post(self, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/resources/products/',
+                                    json.dumps(data),
+                                    content_type='application/json')
+
+    def test_parse_price(self):
+        self.assertEqual(ProductSubmission.parse_price(None), 0)
+        self.assertEqual(ProductSubmission.parse_price(''), 0)
+        self.assertEqual(ProductSubmission.parse_price('250'), 250)
+        self.assertEqual(ProductSubmission.parse_price(250.0), 250)
+        for price in ['abc', '1.5', 1.5, -3, '-3', True, [1]]:
+            with self.assertRaises(ProductSubmissionError, msg=price):
+                ProductSubmission.parse_price(price)
+
+    def test_string_prices_are_compared_as_numbers(self):
+        response = self.post(self.submission_data(['1000', '200']))
+        self.assertEqual(response.status_code, 200, response.data)
+
+        product = Product.objects.get(id=response.data['product_id'])
+        self.assertEqual((product.min_price, product.max_price), (200, 1000))
+        self.assertEqual(
+            (product.has_free_license, product.has_paid_license),
+            (False, True))
+        self.assertEqual(
+            sorted(product.productxlicense_set.values_list('price', flat=True)),
+            [200, 1000])
+
+    def test_mixed_and_missing_prices(self):
+        response = self.post(self.submission_data([None, '300']))
+        self.assertEqual(response.status_code, 200, response.data)
+
+        product = Product.objects.get(id=response.data['product_id'])
+        self.assertEqual((product.min_price, product.max_price), (0, 300))
+
+    def test_invalid_prices_are_rejected(self):
+        for price in ['abc', -5]:
+            response = self.post(self.submission_data([price, 10]))
+            self.assertEqual(response.status_code, 400, price)
+        self.assertFalse(Product.objects.exists())
+
+    def test_only_the_editable_product_fields_are_taken(self):
+        other_seller = Seller.objects.create(
+            user=create_user('other'), alias='other', brand_name='Other')
+        other_product = Product.objects.create(
+            seller=other_seller, title='other pack', category=self.category,
+            description='other')
+
+        data = self.submission_data([10, 20])
+        data.update(id=other_product.id, seller=other_seller.id,
+                    listed=False, min_price=5, licenses=[1],
+                    description='new brushes', is_mature=True)
+        response = self.post(data)
+        self.assertEqual(response.status_code, 200, response.data)
+
+        product = Product.objects.get(id=response.data['product_id'])
+        self.assertNotEqual(product.id, other_product.id)
+        self.assertEqual(
+            (product.seller, product.listed, product.min_price,
+             product.description, product.is_mature),
+            (self.seller, True, 10, 'new brushes', True))
+        other_product.refresh_from_db()
+        self.assertEqual((other_product.seller, other_product.title),
+                         (other_seller, 'other pack'))
+        self.assertFalse(other_product.productxlicense_set.exists())
+
+    def test_invalid_categories_are_rejected(self):
+        for category in ['abc', 999999, [1]]:
+            data = self.submission_data([10])
+            data['category'] = category
+            response = self.post(data)
+            self.assertEqual(response.status_code, 400, category)
+        self.assertFalse(Product.objects.exists())
+
+    def test_uploads_are_moved_on_commit(self):
+        data = self.submission_data([10, 20])
+        upload_ids = [data['sample_images'][0]['file']['serverId'],
+                      data['product_files'][0]['file']['serverId']]
+        response = self.post(data)
+        self.assertEqual(response.status_code, 200, response.data)
+
+        self.assertFalse(
+            TemporaryUpload.objects.filter(upload_id__in=upload_ids).exists())
+        product = Product.objects.get(id=response.data['product_id'])
+        for product_item in product.items.all():
+            with product_item.file.resource.open('rb') as stored_file:
+                self.assertEqual(stored_file.read(), b'data')
+
+    def test_failed_submission_leaves_uploads_untouched(self):
+        data = self.submission_data([10, 20])
+        upload_ids = [data['sample_images'][0]['file']['serverId'],
+                      data['product_files'][0]['file']['serverId']]
+        files_before = sorted(
+            os.path.join(root, name) for root, dirs, names in
+            os.walk(MEDIA_ROOT) for name in names)
+
+        submission = ProductSubmission(data, seller=self.seller)
+        submission.validate()
+        with mock.patch.object(ProductItem.objects, 'bulk_create',
+                               side_effect=IntegrityError):
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(IntegrityError):
+                    submission.save()
+
+        self.assertFalse(Product.objects.exists())
+        uploads = TemporaryUpload.objects.filter(upload_id__in=upload_ids)
+        self.assertEqual(uploads.count(), 2)
+        for upload in uploads:
+            self.assertTrue(os.path.isfile(upload.get_file_path()))
+        files_after = sorted(
+            os.path.join(root, name) for root, dirs, names in
+            os.walk(MEDIA_ROOT) for name in names)
+        self.assertEqual(files_after, files_before)
+
+
+class ReferenceDataTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.license = License.objects.create(name='standard')
+
+    def setUp(self):
+        self.reference_data = ReferenceData()
+
+    def test_id_lookups_accept_strings(self):
+        self.assertEqual(
+            self.reference_data.get('licenses', str(self.license.id)),
+            self.license)
+        for key in ['abc', None, '']:
+            with self.assertRaises(License.DoesNotExist):
+                self.reference_data.get('licenses', key)
+
+    def test_misses_reload_the_table_at_most_once_per_interval(self):
+        self.reference_data.all('licenses')
+        with self.assertNumQueries(0):
+            for _ in range(5):
+                with self.assertRaises(License.DoesNotExist):
+                    self.reference_data.get('licenses', 999999)
+
+        # a miss after the interval reloads, and finds new rows
+        new_license = License.objects.create(name='extended')
+        instances, loaded_at = self.reference_data._tables['licenses']
+        self.reference_data._tables['licenses'] = (
+            instances, loaded_at - self.reference_data.MISS_RELOAD_INTERVAL)
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.reference_data.get('licenses', new_license.id),
+                new_license)
+
+
+class EntitlementsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seller_user = create_user('seller')
+        seller = Seller.objects.create(
+            user=seller_user, alias='seller', brand_name='Seller')
+        category = ProductCategory(name='Brushes')
+        category.save()
+        cls.product = Product.objects.create(
+            seller=seller, title='brush pack', category=category,
+            description='brushes')
+        cls.license = License.objects.create(name='standard')
+        cls.productxlicense = ProductXLicense(
+            product=cls.product, license=cls.license, price=100)
+        cls.productxlicense.save()
+        cls.buyer = create_user('buyer')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_stale_cached_denial_is_confirmed_against_the_database(self):
+        self.assertFalse(
+            owns_license(self.buyer.id, self.product.id, self.license.id))
+
+        library = ProductLibrary.objects.create(user=self.buyer)
+        ProductLibraryXXProductXLicense.objects.create(
+            product_library=library, productxlicense=self.productxlicense)
+        # as seen by a process which missed the invalidation
+        cache.set(entitlements_cache_key(self.buyer.id), {})
+
+        self.assertTrue(
+            owns_license(self.buyer.id, self.product.id, self.license.id))
+        # the stale entry was dropped: reloaded once, then cached
+        with self.assertNumQueries(1):
+            self.assertTrue(owns_license(
+                self.buyer.id, self.product.id, self.license.id))
+        with self.assertNumQueries(0):
+            self.assertTrue(owns_license(
+                self.buyer.id, self.product.id, self.license.id))
+
+
+class ReviewModerationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin', is_staff=True, is_superuser=True)
+        author = create_user('author')
+        category = ArtCategory.objects.create(name='painting')
+        content_type = ContentType.objects.get_for_model(User)
+        cls.reviews = [
+            Review.objects.create(
+                user=author, title=f'review {i}', content='content',
+                category=category, caption_media_type=content_type,
+                caption_media_id=author.id)
+            for i in range(3)]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_moderation_counts_are_staff_only(self):
+        client = APIClient()
+        response = client.get('/api/moderation/counts/')
+        self.assertIn(response.status_code, (401, 403))
+
+        client.force_authenticate(create_user('member'))
+        self.assertEqual(
+            client.get('/api/moderation/counts/').status_code, 403)
+
+        client.force_authenticate(self.admin)
+        response = client.get('/api/moderation/counts/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['pending_reviews'], 3)
+
+    def test_bulk_approve_and_reject(self):
+        self.client.force_login(self.admin)
+        self.assertEqual(get_moderation_counts('pending_reviews'),
+                         {'pending_reviews': 3})
+        listing = self.client.get('/admin/reviews/')
+        self.assertContains(listing, 'data-bulk-action-checkbox')
+        self.assertContains(listing, 'bulk/main/review/approve/')
+
+        ids = '&'.join(f'id={review.id}' for review in self.reviews[:2])
+        url = f'/admin/bulk/main/review/approve/?{ids}'
+        self.assertContains(self.client.get(url), 'review 1')
+        self.client.post(url)
+        self.assertEqual(
+            list(Review.objects.filter(approved=True).order_by('id')),
+            self.reviews[:2])
+        # update() sends no signals, the action invalidates the counter
+        self.assertEqual(get_moderation_counts('pending_reviews'),
+                         {'pending_reviews': 1})
+
+        self.client.post(
+            f'/admin/bulk/main/review/reject/?id={self.reviews[0].id}')
+        self.assertEqual(
+            list(Review.objects.filter(approved=True)), self.reviews[1:2])
+
+
+class CommentTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('commenter')
+        cls.post = Review.objects.create(
+            user=cls.user, title='review', content='content',
+            category=ArtCategory.objects.create(name='painting'),
+            caption_media_type=ContentType.objects.get_for_model(User),
+            caption_media_id=cls.user.id, approved=True)
+        cls.post_type = ContentType.objects.get_for_model(Review)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def comment(self, parent_comment=None):
+        comment = Comment(user=self.user, post_type=self.post_type,
+                          post_id=self.post.id, content='comment',
+                          parent_comment=parent_comment)
+        comment.save()
+        return comment
+
+    def test_path_and_depth_follow_the_parent(self):
+        root = self.comment()
+        reply = self.comment(parent_comment=root)
+        nested_reply = self.comment(parent_comment=reply)
+        other_root = self.comment()
+
+        self.assertEqual((root.path, root.depth, root.root_id),
+                         (Comment.path_segment(root.id), 0, None))
+        self.assertEqual((reply.path, reply.depth, reply.root_id),
+                         (root.path + Comment.path_segment(reply.id), 1,
+                          root.id))
+        self.assertEqual(
+            (nested_reply.path, nested_reply.depth, nested_reply.root_id),
+            (reply.path + Comment.path_segment(nested_reply.id), 2, root.id))
+
+        # moving a reply to another thread rewrites its own replies too
+        reply.parent_comment = other_root
+        reply.save()
+        nested_reply.refresh_from_db()
+        self.assertEqual((reply.depth, reply.root_id), (1, other_root.id))
+        self.assertEqual(
+            (nested_reply.path, nested_reply.depth, nested_reply.root_id),
+            (other_root.path + Comment.path_segment(reply.id)
+             + Comment.path_segment(nested_reply.id), 2, other_root.id))
+
+    def test_replies_are_nested_at_most_max_depth_levels(self):
+        deepest = self.comment()
+        # (a path at the deepest level, without saving every level)
+        Comment.objects.filter(id=deepest.id).update(depth=Comment.MAX_DEPTH)
+        url = f'/api/comments/review/{self.post.id}/?content=hi'
+
+        response = self.client.post(f'{url}&parent_comment={deepest.id}')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Comment.objects.count(), 1)
+
+        Comment.objects.filter(id=deepest.id).update(
+            depth=Comment.MAX_DEPTH - 1,
+            path=Comment.path_segment(deepest.id) * Comment.MAX_DEPTH)
+        response = self.client.post(f'{url}&parent_comment={deepest.id}')
+        self.assertEqual(response.status_code, 201)
+        reply = Comment.objects.get(id=response.data['id'])
+        self.assertEqual(reply.depth, Comment.MAX_DEPTH)
+        self.assertEqual(len(reply.path),
+                         Comment._meta.get_field('path').max_length)
+
+    def test_threads_of_an_unknown_model_are_rejected(self):
+        response = self.client.get(
+            f'/api/comments/nonexistent/{self.post.id}/threads/')
+        self.assertEqual(response.status_code, 400)
+
+        root = self.comment()
+        reply = self.comment(parent_comment=root)
+        response = self.client.get(
+            f'/api/comments/review/{self.post.id}/threads/')
+        self.assertEqual(response.status_code, 200)
+        [thread] = response.data['results']
+        self.assertEqual(thread['id'], root.id)
+        self.assertEqual([reply_data['id'] for reply_data in thread['replies']],
+                         [reply.id])
+
+    def test_comments_of_an_unknown_model_are_rejected(self):
+        response = self.client.get(f'/api/comments/nonexistent/{self.post.id}/')
+        self.assertEqual(response.status_code, 400)
+
+        comment = self.comment()
+        response = self.client.get(f'/api/comments/review/{self.post.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([comment_data['id'] for comment_data
+                          in response.data['results']], [comment.id])
+
+    def test_reply_to_a_non_numeric_parent_comment_is_rejected(self):
+        url = f'/api/comments/review/{self.post.id}/'
+        response = self.client.post(f'{url}?parent_comment=abc&content=hi')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(f'{url}?parent_comment=999999&content=hi')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Comment.objects.exists())
+
+        root = self.comment()
+        response = self.client.post(
+            f'{url}?parent_comment={root.id}&content=hi')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['parent_comment'], root.id)
+
+
+class ArticleHTMLRewriterTests(TestCase):
+
+    def rewrite(self, html, src_map=None):
+        out = io.StringIO()
+        rewriter = ArticleHTMLRewriter(out, src_map or {}).rewrite(html)
+        return out.getvalue(), rewriter
+
+    def test_html_is_written_back_as_written(self):
+        html = ('<DIV Class="x"><P>Tom &amp; Jerry&#39;s <B>art</B >'
+                '</P></DIV>\n<script>if (a</b) x()</script></p >tail')
+        self.assertEqual(self.rewrite(html)[0], html)
+
+    def test_blob_srcs_are_replaced(self):
+        html = ('<p><IMG src="blob:http://localhost/1" alt="a">'
+                '<img src="/media/2.png"/></p>')
+        out, rewriter = self.rewrite(
+            html, {'blob:http://localhost/1': '/media/1.png'})
+        self.assertEqual(out, '<p><img src="/media/1.png" alt="a">'
+                              '<img src="/media/2.png"/></p>')
+        self.assertEqual(rewriter.image_srcs, ['/media/1.png', '/media/2.png'])
+
+    def test_metadata(self):
+        html = ('<h1>Title</h1><p>Tom &amp; Jerry<b>s</b> art</p>'
+                '<script>var ignored = 1</script><img src="/media/1.png">')
+        self.assertEqual(self.rewrite(html)[1].metadata(), {
+            'excerpt': 'Title Tom & Jerrys art', 'word_count': 5,
+            'reading_time': 1, 'image_count': 1})
+
+        self.assertEqual(self.rewrite('')[1].metadata(), {
+            'excerpt': '', 'word_count': 0, 'reading_time': 0,
+            'image_count': 0})
+
+        # rounded up, at WORDS_PER_MINUTE
+        metadata = self.rewrite('<p>word</p>' * 201)[1].metadata()
+        self.assertEqual(metadata['word_count'], 201)
+        self.assertEqual(metadata['reading_time'], 2)
+        self.assertEqual(metadata['excerpt'],
+                         ' '.join(['word'] * 60) + '…')
+
+
+class ProductCategoryTests(TestCase):
+
+    def create_forest(self):
+        tutorials = create_category('Tutorials')
+        three_d = create_category('3D', parent=tutorials)
+        create_category('Rocks', parent=three_d)
+        create_category('Trees', parent=three_d)
+        create_category('Books & Comics', parent=tutorials)
+        assets = create_category('Assets')
+        create_category('Brushes', parent=assets)
+        return tutorials, three_d
+
+    def test_trees_match_the_legacy_trees(self):
+        tutorials, three_d = self.create_forest()
+        with self.assertNumQueries(1):
+            trees = ProductCategory.trees()
+        self.assertEqual(trees, legacy_trees())
+        self.assertEqual(
+            [child['path'] for child in trees[0]['children']],
+            ['/tutorials/3d', '/tutorials/books-comics'])
+        self.assertEqual(json.loads(ProductCategory.trees(jsonify=True)),
+                         trees)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(three_d.to_dict(), trees[0]['children'][0])
+
+    def test_category_list_serves_the_cached_trees(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_forest()
+        with self.assertNumQueries(0):
+            response = APIClient().get('/api/resources/categories/')
+        self.assertEqual(json.loads(response.data['product_categories']),
+                         legacy_trees())
+
+    def assertPaths(self, *expected):
+        for category, path, root in expected:
+            category.refresh_from_db()
+            self.assertEqual((category.path, category.root_id),
+                             (path, root.id))
+
+    def test_moving_and_renaming_rewrite_the_subtree(self):
+        tutorials = create_category('Tutorials')
+        three_d = create_category('3D', parent=tutorials)
+        rocks = create_category('Rocks', parent=three_d)
+        assets = create_category('Assets')
+        # shares the /tutorials prefix without being a descendant
+        tutorials_plus = create_category('Tutorials plus')
+        self.assertPaths((rocks, '/tutorials/3d/rocks', tutorials))
+
+        three_d.parent = assets
+        three_d.save()
+        self.assertPaths((three_d, '/assets/3d', assets),
+                         (rocks, '/assets/3d/rocks', assets))
+
+        assets.name = 'Models'
+        assets.save()
+        tutorials.name = 'Tutorial'
+        tutorials.save()
+        self.assertPaths((three_d, '/models/3d', assets),
+                         (rocks, '/models/3d/rocks', assets),
+                         (tutorials_plus, '/tutorials-plus', tutorials_plus))
+
+    def test_deleting_a_category_rewrites_the_orphaned_subtrees(self):
+        tutorials = create_category('Tutorials')
+        three_d = create_category('3D', parent=tutorials)
+        rocks = create_category('Rocks', parent=three_d)
+        mossy = create_category('Mossy', parent=rocks)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            three_d.delete()
+        self.assertPaths((rocks, '/rocks', rocks),
+                         (mossy, '/rocks/mossy', rocks))
+        self.assertEqual(rocks.parent, None)
+        self.assertEqual(
+            [tree['path'] for tree in
+             json.loads(cache.get('product_category_trees'))],
+            ['/tutorials', '/rocks'])
+
+        # deleting a root
+        rocks.delete()
+        self.assertPaths((mossy, '/mossy', mossy))
+        self.assertFalse(ProductCategory.objects.filter(
+            path__startswith='/tutorials/').exists())
+
+    def test_a_category_cannot_descend_from_its_descendant(self):
+        tutorials = create_category('Tutorials')
+        three_d = create_category('3D', parent=tutorials)
+        rocks = create_category('Rocks', parent=three_d)
+
+        for descendant in (three_d, rocks):
+            tutorials.parent = descendant
+            self.assertFalse(tutorials.cyclic_test(tutorials))
+            with self.assertRaises(ValidationError):
+                tutorials.save()
+        tutorials.parent = tutorials
+        with self.assertRaises(ValidationError):
+            tutorials.save()
+
+        self.assertPaths((tutorials, '/tutorials', tutorials),
+                         (rocks, '/tutorials/3d/rocks', tutorials))
+
+
+class FollowingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # (the user post_save signal creates the artists)
+        cls.follower = create_user('follower')
+        cls.followed = create_user('followed')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.follower)
+
+    def assertCounts(self, following_count, followers_count):
+        self.assertEqual(
+            Artist.objects.get(user=self.follower).following_count,
+            following_count)
+        self.assertEqual(
+            Artist.objects.get(user=self.followed).followers_count,
+            followers_count)
+
+    def test_follow_and_unfollow_are_idempotent(self):
+        for expected_status in (201, 200):
+            response = self.client.post('/api/following/follow/followed/')
+            self.assertEqual(response.status_code, expected_status)
+            self.assertTrue(response.data['user_follows_other'])
+            self.assertEqual(response.data['followers'], 1)
+        self.assertEqual(Following.objects.count(), 1)
+        self.assertCounts(1, 1)
+
+        for _ in range(2):
+            response = self.client.post('/api/following/unfollow/followed/')
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.data['user_follows_other'])
+            self.assertEqual(response.data['followers'], 0)
+        self.assertFalse(Following.objects.exists())
+        self.assertCounts(0, 0)
+
+    def test_unknown_users_are_rejected(self):
+        response = self.client.post('/api/following/follow/nobody/')
+        self.assertEqual(response.status_code, 400)
+        self.assertCounts(0, 0)
+
+    def test_follow_and_unfollow_return_whether_they_changed_anything(self):
+        follower, followed = self.follower.artist, self.followed.artist
+        self.assertTrue(Following.follow(follower, followed))
+        self.assertFalse(Following.follow(follower, followed))
+        self.assertCounts(1, 1)
+        self.assertTrue(Following.unfollow(follower, followed))
+        self.assertFalse(Following.unfollow(follower, followed))
+        self.assertCounts(0, 0)
+
+    def test_counts_follow_saves_and_deletions(self):
+        following = Following.objects.create(
+            follower=self.follower.artist, following=self.followed.artist)
+        self.assertCounts(1, 1)
+        following.delete()
+        self.assertCounts(0, 0)
+
+        # cascaded deletions send post_delete too
+        Following.objects.create(
+            follower=self.follower.artist, following=self.followed.artist)
+        self.followed.delete()
+        self.assertEqual(
+            Artist.objects.get(user=self.follower).following_count, 0)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ArticleHTMLTests(TestCase):
+
+    HTML = '<h1>Title</h1><p>An article&nbsp;about art.</p>'
+
+    @classmethod
+    def setUpTestData(cls):
+        html_file = File(file_type=FileType.objects.create(name='web'),
+                         file_group=FileGroup.objects.create(name='articles'))
+        html_file.resource.save('article.html',
+                                ContentFile(cls.HTML.encode()), save=False)
+        html_file.save()
+        # saved without the sidecars, as before they existed
+        cls.article = Article.objects.create(
+            title='article', categories='art', approved=True,
+            html_file=html_file)
+        cls.url = f'/api/magazine/article/{cls.article.id}/html/'
+
+    def write_html(self, html):
+        with self.article.html_file.resource.open('w') as html_file:
+            html_file.write(html)
+
+    def get(self, **headers):
+        response = self.client.get(self.url, **headers)
+        content = b''.join(getattr(response, 'streaming_content', []))
+        return response, content
+
+    def test_articles_without_sidecars_are_served_without_writes(self):
+        response, content = self.get(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.HTML.encode())
+        self.assertNotIn('Content-Encoding', response.headers)
+        etag = hashlib.sha256(self.HTML.encode()).hexdigest()
+        self.assertEqual(response.headers['ETag'], f'W/"{etag}"')
+
+        response, content = self.get(HTTP_IF_NONE_MATCH=f'W/"{etag}"')
+        self.assertEqual(response.status_code, 304)
+
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.html_etag, '')
+        resource = self.article.html_file.resource
+        self.assertFalse(resource.storage.exists(
+            sidecar_name(resource.name, '.gz')))
+
+    def test_etag_and_sidecars(self):
+        call_command('backfill_article_html', stdout=io.StringIO())
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.word_count, 5)
+
+        response, content = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.HTML.encode())
+        self.assertNotIn('Content-Encoding', response.headers)
+        etag = response.headers['ETag']
+        self.assertEqual(etag, f'W/"{self.article.html_etag}"')
+
+        response, content = self.get(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(gzip.decompress(content), self.HTML.encode())
+
+        for if_none_match in (etag, etag.removeprefix('W/'),
+                              f'"other", {etag}', '*'):
+            response, content = self.get(HTTP_IF_NONE_MATCH=if_none_match)
+            self.assertEqual(response.status_code, 304, if_none_match)
+            self.assertEqual(response.headers['ETag'], etag)
+
+        response, content = self.get(HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_backfill_skips_refreshed_articles_unless_all(self):
+        call_command('backfill_article_html', stdout=io.StringIO())
+        self.addCleanup(self.write_html, self.HTML)
+        self.write_html('<p>edited</p><img src="/media/1.png">')
+
+        call_command('backfill_article_html', stdout=io.StringIO())
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.word_count, 5)
+
+        call_command('backfill_article_html', '--all', stdout=io.StringIO())
+        self.article.refresh_from_db()
+        self.assertEqual(
+            (self.article.excerpt, self.article.word_count,
+             self.article.reading_time, self.article.image_count),
+            ('edited', 1, 1, 1))
+
+
+class ProductFacetsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        brushes = create_category('Brushes')
+        digital = create_category('Digital', parent=brushes)
+        textures = create_category('Textures')
+        cls.categories = [brushes, digital, textures]
+        alpha, beta = create_seller('alpha'), create_seller('beta')
+        cls.free = License.objects.create(name='free', free=True)
+        cls.paid = License.objects.create(name='paid')
+
+        cls.products = [
+            create_product(alpha, digital, {cls.free: 0}),
+            create_product(alpha, brushes, {cls.paid: 1500}, is_mature=True),
+            create_product(beta, textures, {cls.free: 0, cls.paid: 25000}),
+            # not counted: unlisted
+            create_product(beta, digital, {cls.paid: 500}, listed=False),
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def facets(self, path='', facets='all'):
+        response = APIClient().get(
+            f'/api/resources/products/{path}?facets={facets}')
+        self.assertEqual(response.status_code, 200)
+        return response.data['facets']
+
+    def test_facet_counts(self):
+        brushes, digital, textures = self.categories
+        self.assertEqual(self.facets(), {
+            'category': [
+                {'id': brushes.id, 'path': '/brushes', 'count': 2},
+                {'id': digital.id, 'path': '/brushes/digital', 'count': 1},
+                {'id': textures.id, 'path': '/textures', 'count': 1}],
+            'license': {'free': 2, 'paid': 2},
+            'is_mature': {'true': 1, 'false': 2},
+            'seller': [{'alias': 'alpha', 'count': 2},
+                       {'alias': 'beta', 'count': 1}],
+            'price': [{'band': 'free', 'count': 2},
+                      {'band': '1-999', 'count': 0},
+                      {'band': '1000-4999', 'count': 1},
+                      {'band': '5000-19999', 'count': 0},
+                      {'band': '20000+', 'count': 0}],
+        })
+
+    def test_facets_follow_the_filters(self):
+        self.assertEqual(self.facets('brushes/', 'license,seller,unknown'), {
+            'license': {'free': 1, 'paid': 1},
+            'seller': [{'alias': 'alpha', 'count': 2}]})
+
+    def test_scalar_facets_take_one_query_and_are_cached(self):
+        products_query = Product.objects.filter(listed=True)
+        facets = ['license', 'is_mature', 'price']
+        with self.assertNumQueries(1):
+            counts = ProductFacets(products_query, facets).counts()
+        self.assertEqual(counts['license'], {'free': 2, 'paid': 2})
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                ProductFacets(products_query, facets).counts(), counts)
+
+    def test_license_flags_follow_the_licenses(self):
+        product = self.products[1]
+        self.assertEqual(
+            (product.has_free_license, product.has_paid_license),
+            (False, True))
+
+        ProductXLicense(product=product, license=self.free, price=0).save()
+        product.refresh_from_db()
+        self.assertEqual(
+            (product.has_free_license, product.has_paid_license),
+            (True, True))
+
+        product.productxlicense_set.filter(license=self.free).delete()
+        self.paid.free = True
+        self.paid.save()
+        product.refresh_from_db()
+        self.assertEqual(
+            (product.has_free_license, product.has_paid_license),
+            (True, False))
+
+
+class ProductPriceTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = create_seller('seller')
+        category = create_category('Brushes')
+        cls.standard = License.objects.create(name='standard')
+        cls.extended = License.objects.create(name='extended')
+        cls.cheap, cls.mid, cls.dear = [
+            create_product(seller, category, license_prices)
+            for license_prices in (
+                {cls.standard: 0},
+                {cls.standard: 500, cls.extended: 5000},
+                {cls.standard: 2000, cls.extended: 9000})]
+
+    def product_ids(self, query=''):
+        response = APIClient().get(f'/api/resources/products/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.data['results']]
+
+    def test_price_range_follows_the_licenses(self):
+        self.assertEqual((self.mid.min_price, self.mid.max_price),
+                         (500, 5000))
+
+        ProductXLicense.objects.get(
+            product=self.mid, license=self.extended).delete()
+        self.mid.refresh_from_db()
+        self.assertEqual((self.mid.min_price, self.mid.max_price),
+                         (500, 500))
+
+        xlicense = ProductXLicense.objects.get(
+            product=self.mid, license=self.standard)
+        xlicense.price = 300
+        xlicense.save()
+        self.mid.refresh_from_db()
+        self.assertEqual((self.mid.price, self.mid.max_price), (300, 300))
+
+        xlicense.delete()
+        self.mid.refresh_from_db()
+        self.assertEqual((self.mid.min_price, self.mid.max_price), (0, 0))
+
+    def test_price_filters_and_ordering(self):
+        cheap, mid, dear = self.cheap.id, self.mid.id, self.dear.id
+        self.assertEqual(self.product_ids(), [dear, mid, cheap])
+        self.assertEqual(self.product_ids('price_min=500'), [dear, mid])
+        self.assertEqual(self.product_ids('price_max=500'), [mid, cheap])
+        self.assertEqual(
+            self.product_ids('price_min=1&price_max=1999'), [mid])
+        # the cheapest license decides
+        self.assertEqual(self.product_ids('price_min=3000'), [])
+        # invalid values are ignored
+        self.assertEqual(self.product_ids('price_min=abc&price_max='),
+                         [dear, mid, cheap])
+
+        self.assertEqual(self.product_ids('ordering=price'),
+                         [cheap, mid, dear])
+        self.assertEqual(self.product_ids('ordering=-price'),
+                         [dear, mid, cheap])
+        response = APIClient().get('/api/resources/products/?ordering=price')
+        self.assertEqual([product['price'] for product
+                          in response.data['results']], [0, 500, 2000])
+
+
+class ProductDetailCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seller = create_seller('seller')
+        cls.category = create_category('Brushes')
+        cls.license = License.objects.create(name='standard')
+        cls.product = create_product(cls.seller, cls.category,
+                                     {cls.license: 100}, title='brush pack')
+        cls.url = f'/api/resources/product/{cls.product.id}/'
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def assertInvalidates(self, change):
+        self.get()
+        with self.assertNumQueries(0):
+            self.get()
+        version_key = product_detail_cache_key(self.product.id)
+        change()
+        self.assertNotEqual(product_detail_cache_key(self.product.id),
+                            version_key, change)
+        return self.get()
+
+    def test_cache_hits_run_no_query(self):
+        data = self.get()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(), data)
+        self.assertEqual(data['title'], 'brush pack')
+
+    def test_each_dependency_invalidates_the_cached_response(self):
+        product, seller = self.product, self.seller
+        def saved(instance, **fields):
+            for field, value in fields.items():
+                setattr(instance, field, value)
+            instance.save()
+
+        data = self.assertInvalidates(
+            lambda: saved(Product.objects.get(id=product.id), title='new'))
+        self.assertEqual(data['title'], 'new')
+
+        extended = License.objects.create(name='extended')
+        data = self.assertInvalidates(lambda: ProductXLicense(
+            product=product, license=extended, price=500).save())
+        self.assertEqual(len(data['license_data']), 2)
+        self.assertInvalidates(lambda: saved(extended, name='pro'))
+
+        data = self.assertInvalidates(lambda: ProductRating.objects.create(
+            product=product, stars=4))
+        self.assertEqual(data['stats']['rating_average'], 4)
+
+        data = self.assertInvalidates(lambda: Comment(
+            user=seller.user, post_type=ContentType.objects.get_for_model(
+                Product), post_id=product.id, content='great').save())
+        self.assertEqual(data['stats']['reviews_count'], 1)
+
+        data = self.assertInvalidates(
+            lambda: saved(seller, brand_name='Renamed'))
+        self.assertEqual(data['seller']['brand_name'], 'Renamed')
+        self.assertInvalidates(lambda: saved(seller.user, bio='new bio'))
+
+        self.assertInvalidates(
+            lambda: saved(ProductCategory.objects.get(id=self.category.id),
+                          name='Pencils'))
+
+    def test_item_changes_invalidate_the_cached_response(self):
+        item_file = File(file_type=FileType.objects.create(name='zip'),
+                         file_group=FileGroup.objects.create(name='products'))
+        item_file.resource.save('brushes.zip', ContentFile(b'data'),
+                                save=False)
+        item_file.save()
+        items = []
+        data = self.assertInvalidates(lambda: items.append(
+            ProductItem.objects.create(product=self.product, file=item_file)))
+        self.assertEqual(len(data['items']), 1)
+        self.assertInvalidates(lambda: ProductItemXLicense.objects.create(
+            product_item=items[0], license=self.license))
+
+    def test_other_products_stay_cached(self):
+        other_product = create_product(self.seller, self.category,
+                                       {self.license: 50})
+        self.get()
+        Product.objects.get(id=other_product.id).save()
+        with self.assertNumQueries(0):
+            self.get()
+
+
+class RelatedProductTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = create_seller('seller')
+        license = License.objects.create(name='standard')
+        root = create_category('Brushes')
+        ink, oil = create_category('Ink', root), create_category('Oil', root)
+        cls.p1, cls.p2, cls.p3, cls.unlisted = [
+            create_product(seller, ink, {license: 100}, title=title)
+            for title in ('p1', 'p2', 'p3', 'unlisted')]
+        Product.objects.filter(id=cls.unlisted.id).update(listed=False)
+        cls.p4 = create_product(seller, oil, {license: 100}, title='p4')
+
+        for username, products in (
+                ('u1', [cls.p1, cls.p2]),
+                ('u2', [cls.p1, cls.p2, cls.p3, cls.unlisted])):
+            library = ProductLibrary.objects.create(
+                user=create_user(username))
+            for product in products:
+                ProductLibraryXXProductXLicense.objects.create(
+                    product_library=library,
+                    productxlicense=product.productxlicense_set.get())
+
+        call_command('compute_related_products', top=3,
+                     stdout=io.StringIO())
+
+    def related(self, product):
+        return list(RelatedProduct.objects.filter(product=product).order_by(
+            'rank').values_list('related_product_id', 'source'))
+
+    def test_co_owned_products_rank_first_then_the_category(self):
+        self.assertEqual(self.related(self.p1), [
+            (self.p2.id, RelatedProduct.CO_OWNERSHIP),
+            (self.p3.id, RelatedProduct.CO_OWNERSHIP),
+            (self.p4.id, RelatedProduct.CATEGORY)])
+        # owned by both libraries of p1, against one of two for p3
+        scores = dict(RelatedProduct.objects.filter(
+            product=self.p1).values_list('related_product_id', 'score'))
+        self.assertAlmostEqual(scores[self.p2.id], 1)
+        self.assertAlmostEqual(scores[self.p3.id], 0.5 ** 0.5)
+
+    def test_cold_products_fall_back_to_the_root_category(self):
+        # most owned first, then newest
+        self.assertEqual(self.related(self.p4), [
+            (self.p2.id, RelatedProduct.CATEGORY),
+            (self.p1.id, RelatedProduct.CATEGORY),
+            (self.p3.id, RelatedProduct.CATEGORY)])
+
+    def test_unlisted_products_are_never_recommended(self):
+        self.assertFalse(RelatedProduct.objects.filter(
+            related_product=self.unlisted).exists())
+
+    def test_endpoint_serves_cards_in_rank_order(self):
+        url = f'/api/resources/product/{self.p1.id}/related/'
+        with self.assertNumQueries(2):
+            response = APIClient().get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([card['id'] for card in response.data],
+                         [self.p2.id, self.p3.id, self.p4.id])
+        self.assertEqual(response.data[0]['seller'], 'seller')
+        self.assertEqual(response.data[0]['category'], self.p2.category.path)
+        self.assertEqual(response.data[0]['price'], 100)
+
+        # unlisted since the last batch run
+        Product.objects.filter(id=self.p3.id).update(listed=False)
+        response = APIClient().get(url)
+        self.assertEqual([card['id'] for card in response.data],
+                         [self.p2.id, self.p4.id])
+
+
+class ProductLibraryListTests(TestCase):
+
+    url = '/api/resources/product/library/list/'
+
+    @classmethod
+    def setUpTestData(cls):
+        seller = create_seller('seller')
+        category = create_category('Brushes')
+        cls.license = License.objects.create(name='standard')
+        cls.products = [
+            create_product(seller, category, {cls.license: price},
+                           title=f'pack {price}')
+            for price in (100, 200, 300, 400)]
+        cls.buyer = create_user('buyer')
+        library = ProductLibrary.objects.create(user=cls.buyer)
+        for product in cls.products:
+            ProductLibraryXXProductXLicense.objects.create(
+                product_library=library,
+                productxlicense=product.productxlicense_set.get())
+            ProductRating.objects.create(product=product, user=cls.buyer,
+                                         stars=5)
+            Comment(user=cls.buyer, content='great',
+                    post_type=ContentType.objects.get_for_model(Product),
+                    post_id=product.id).save()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_pages_through_the_library_newest_first(self):
+        page = self.get(self.url, page_size=3)
+        self.assertEqual(
+            [entry['product']['id'] for entry in page['results']],
+            [product.id for product in reversed(self.products)][:3])
+        self.assertIsNone(page['previous'])
+
+        page = self.get(page['next'])
+        self.assertEqual(
+            [entry['product']['id'] for entry in page['results']],
+            [self.products[0].id])
+        self.assertIsNone(page['next'])
+
+    def test_full_entries_keep_the_product_representation(self):
+        entry = self.get(self.url)['results'][0]
+        self.assertEqual(entry['owned_license']['id'], self.license.id)
+        self.assertEqual(entry['product']['title'], 'pack 400')
+        self.assertEqual(entry['product']['license_data'][0]['price'], 400)
+        self.assertEqual(entry['product']['seller']['alias'], 'seller')
+        self.assertEqual(entry['product']['stats'], {
+            'ratings_count': 1, 'rating_average': 5, 'reviews_count': 1})
+
+    def test_card_view(self):
+        entry = self.get(self.url, view='card')['results'][0]
+        self.assertEqual(entry['product'], {
+            'id': self.products[-1].id, 'title': 'pack 400',
+            'seller': 'seller', 'category': '/brushes', 'is_mature': False,
+            'price': 400, 'thumbnail_images': [], 'listed': True})
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        for view in ('card', 'full'):
+            with CaptureQueriesContext(connection) as small_page:
+                self.get(self.url, page_size=1, view=view)
+            with CaptureQueriesContext(connection) as full_page:
+                self.get(self.url, page_size=4, view=view)
+            self.assertEqual(len(full_page), len(small_page), view)
+
+
+class FollowingStatusBatchTests(TestCase):
+
+    url = '/api/following/status/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        for username in ('followed', 'follower', 'mutual', 'stranger'):
+            create_user(username)
+        for follower, following in (('user', 'followed'),
+                                    ('follower', 'user'),
+                                    ('user', 'mutual'), ('mutual', 'user')):
+            Following.objects.create(
+                follower=Artist.objects.get(user__username=follower),
+                following=Artist.objects.get(user__username=following))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, usernames):
+        response = self.client.get(self.url, {'usernames': usernames})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_matches_the_single_user_status(self):
+        usernames = ['followed', 'follower', 'mutual', 'stranger']
+        statuses = self.get(','.join(usernames))
+        self.assertEqual(sorted(statuses), usernames)
+        for username in usernames:
+            self.assertEqual(statuses[username], self.client.get(
+                f'/api/following/status/{username}/').data, username)
+        self.assertEqual(statuses['mutual'], {
+            'user_follows_other': True, 'other_follows_user': True})
+
+    def test_unknown_and_blank_usernames_are_left_out(self):
+        self.assertEqual(list(self.get(' followed,, nobody ')), ['followed'])
+        self.assertEqual(self.get(''), {})
+
+    def test_too_many_usernames_are_rejected(self):
+        usernames = ','.join(f'user{index}' for index in range(
+            FollowingStatusBatch.MAX_USERNAMES + 1))
+        response = self.client.get(self.url, {'usernames': usernames})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cached_followings_follow_changes(self):
+        artist = self.user.artist
+        self.assertFalse(
+            self.get('stranger')['stranger']['user_follows_other'])
+        with self.assertNumQueries(0):
+            get_following_ids(artist.id)
+
+        self.client.post('/api/following/follow/stranger/')
+        self.assertTrue(
+            self.get('stranger')['stranger']['user_follows_other'])
+
+        stranger = User.objects.get(username='stranger')
+        stranger_artist_id = stranger.artist.id
+        self.assertIn(stranger_artist_id, get_following_ids(artist.id))
+        # deleted along with the followed user
+        stranger.delete()
+        self.assertNotIn(stranger_artist_id, get_following_ids(artist.id))
+
+
+class FollowGraphTests(TestCase):
+
+    def test_rows_are_sorted_without_duplicates_or_self_follows(self):
+        graph = FollowGraph([30, 10, 20], [
+            (10, 30), (10, 20), (10, 30), (20, 20), (20, 99), (30, 10)])
+        self.assertEqual(list(graph.artist_ids), [10, 20, 30])
+        self.assertEqual([list(graph.following(i)) for i in range(3)],
+                         [[1, 2], [], [0]])
+        self.assertEqual(graph.edge_count, 3)
+        self.assertEqual(list(graph.follower_counts()), [1, 1, 1])
+
+    def test_suggestions_rank_friends_of_friends(self):
+        # 0 follows 1 and 2; 1 follows 3 and 4; 2 follows 3 and 0
+        graph = FollowGraph(range(5), [
+            (0, 1), (0, 2), (1, 3), (1, 4), (2, 3), (2, 0)])
+        self.assertEqual(graph.suggestions(0, top=5),
+                         [(3, 2, 2), (4, 1, 1)])
+        self.assertEqual(graph.suggestions(0, top=1), [(3, 2, 2)])
+        # the activity bonus can outrank a mutual follow
+        self.assertEqual(
+            graph.suggestions(0, top=5, activity=[0, 0, 0, 0, 1.5]),
+            [(4, 1, 2.5), (3, 2, 2)])
+        # only the first follow of each friend is counted (0 for 2)
+        self.assertEqual(graph.suggestions(0, top=5, max_fanout=1),
+                         [(3, 1, 1)])
+
+
+class FollowSuggestionTests(TestCase):
+
+    url = '/api/followings/suggestions/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        for username in ('a', 'b', 'c', 'd', 'loner'):
+            create_user(username)
+        cls.artists = {artist.user.username: artist for artist in
+                       Artist.objects.select_related('user')}
+        for follower, following in (('user', 'a'), ('user', 'b'),
+                                    ('a', 'c'), ('a', 'd'), ('b', 'c')):
+            Following.objects.create(follower=cls.artists[follower],
+                                     following=cls.artists[following])
+        call_command('compute_follow_suggestions', top=3,
+                     stdout=io.StringIO())
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def suggestions(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return [(suggestion['artist']['id'], suggestion['mutual_count'])
+                for suggestion in response.data]
+
+    def test_friends_of_friends_first_then_popular_artists(self):
+        artists = self.artists
+        self.assertEqual(self.suggestions(), [
+            (artists['c'].id, 2), (artists['d'].id, 1),
+            (artists['loner'].id, 0)])
+        # nobody to go through: the most followed artists
+        self.assertEqual(list(FollowSuggestion.objects.filter(
+            artist=artists['loner']).order_by('rank').values_list(
+                'suggested_artist_id', flat=True)),
+            [artists['c'].id, artists['a'].id, artists['b'].id])
+
+    def test_artists_followed_since_are_left_out(self):
+        self.client.post('/api/following/follow/c/')
+        self.assertEqual([artist_id for artist_id, _ in self.suggestions()],
+                         [self.artists['d'].id, self.artists['loner'].id])
+
+
+class ReactionSummaryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_product(create_seller('seller'),
+                                     create_category('Brushes'), {})
+        cls.url = f'/api/react/list/product/{cls.product.id}/'
+        cls.like = ReactionType.objects.create(name='like')
+        cls.love = ReactionType.objects.create(name='love')
+        cls.fan, cls.superfan = create_user('fan'), create_user('superfan')
+        for user, reaction_type in ((cls.fan, cls.like),
+                                    (cls.superfan, cls.like),
+                                    (cls.superfan, cls.love)):
+            cls.react(user, reaction_type)
+
+    @classmethod
+    def react(cls, user, reaction_type):
+        return Reaction.objects.create(
+            user=user, reaction_type=reaction_type, object_id=cls.product.id,
+            content_type=ContentType.objects.get_for_model(Product))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def summary(self, user=None):
+        self.client.force_authenticate(user)
+        response = self.client.get(self.url, {'summary': 'true'})
+        self.assertEqual(response.status_code, 200)
+        return (response.data['counts'], response.data['total'],
+                sorted(response.data['user_reactions']))
+
+    def test_counters_and_reaction_counts_agree(self):
+        summaries = [self.summary(user)
+                     for user in (None, self.fan, self.superfan)]
+        self.assertEqual(summaries, [
+            ({'like': 2, 'love': 1}, 3, []),
+            ({'like': 2, 'love': 1}, 3, ['like']),
+            ({'like': 2, 'love': 1}, 3, ['like', 'love'])])
+
+        # objects without counters are counted with one GROUP BY
+        ReactionCount.objects.all().delete()
+        self.assertEqual([self.summary(user)
+                          for user in (None, self.fan, self.superfan)],
+                         summaries)
+
+    def test_counters_follow_reactions(self):
+        reaction = self.react(self.fan, self.love)
+        self.assertEqual(self.summary(self.fan),
+                         ({'like': 2, 'love': 2}, 4, ['like', 'love']))
+        reaction.delete()
+        Reaction.objects.filter(reaction_type=self.love).delete()
+        self.assertEqual(self.summary(self.fan), ({'like': 2}, 2, ['like']))
+
+        # cascaded deletions send post_delete too
+        self.fan.delete()
+        self.assertEqual(self.summary(self.superfan),
+                         ({'like': 1}, 1, ['like']))
+
+    def test_list_mode_lists_who_reacted(self):
+        self.client.force_authenticate(self.fan)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(response.data['user_reactions'], ['like'])
+
+
+class ReactionSummaryBatchTests(TestCase):
+
+    url = '/api/react/summary/product/'
+
+    @classmethod
+    def setUpTestData(cls):
+        seller, category = create_seller('seller'), create_category('Brushes')
+        cls.products = [create_product(seller, category, {})
+                        for _ in range(3)]
+        like = ReactionType.objects.create(name='like')
+        love = ReactionType.objects.create(name='love')
+        cls.fan, other_fan = create_user('fan'), create_user('other_fan')
+        for product, user, reaction_type in (
+                (cls.products[0], cls.fan, like),
+                (cls.products[0], other_fan, like),
+                (cls.products[0], other_fan, love),
+                (cls.products[1], other_fan, love)):
+            Reaction.objects.create(
+                user=user, reaction_type=reaction_type, object_id=product.id,
+                content_type=ContentType.objects.get_for_model(Product))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.fan)
+
+    def get(self, ids):
+        return self.client.get(self.url, {'ids': ids})
+
+    def test_matches_the_summary_of_each_instance(self):
+        ids = [product.id for product in self.products]
+        self.get('')  # (loads the content types)
+        with self.assertNumQueries(2):  # counts, own reactions
+            response = self.get(','.join(map(str, ids)))
+        self.assertEqual(response.status_code, 200)
+        summaries = response.data['reactions']
+        self.assertEqual(list(summaries), ids)
+
+        for product_id in ids:
+            summary = self.client.get(
+                f'/api/react/list/product/{product_id}/',
+                {'summary': 'true'}).data
+            self.assertEqual(summaries[product_id], {
+                'counts': summary['counts'],
+                'user_reactions': summary['user_reactions']})
+        self.assertEqual(summaries[ids[2]],
+                         {'counts': {}, 'user_reactions': []})
+
+    def test_anonymous_users_have_no_reactions(self):
+        self.client.force_authenticate(None)
+        summary = self.get(str(self.products[0].id)).data['reactions']
+        self.assertEqual(summary[self.products[0].id], {
+            'counts': {'like': 2, 'love': 1}, 'user_reactions': []})
+
+    def test_invalid_requests_are_rejected(self):
+        self.assertEqual(self.get('1,two').status_code, 400)
+        too_many_ids = ','.join(
+            map(str, range(ReactSummaryList.MAX_IDS + 1)))
+        self.assertEqual(self.get(too_many_ids).status_code, 400)
+        response = self.client.get('/api/react/summary/nothing/',
+                                   {'ids': '1'})
+        self.assertEqual(response.status_code, 400)
+
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ReviewMediaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.category = ArtCategory.objects.create(name='painting')
+        cls.file_group = FileGroup.objects.create(name='reviews')
+        cls.video_type = FileType.objects.create(name='video')
+        for _ in range(2):
+            cls.create_reviews()
+
+    @classmethod
+    def create_reviews(cls):
+        '''creates three approved reviews with image and file media'''
+        image, other_image = cls.create_image(), cls.create_image()
+        video = File(file_type=cls.video_type, file_group=cls.file_group)
+        video.resource.save('clip.mp4', ContentFile(b'data'), save=False)
+        video.save()
+        for caption_media, body_media in ((image, video), (video, None),
+                                          (image, other_image)):
+            Review.objects.create(
+                user=cls.author, title='review', content='content',
+                category=cls.category, approved=True,
+                caption_media_object=caption_media,
+                body_media_object=body_media)
+
+    @classmethod
+    def create_image(cls):
+        image = Image(file_group=cls.file_group)
+        image.resource.save('caption.png', ContentFile(png_data()))
+        return image
+
+    def setUp(self):
+        cache.clear()
+
+    def test_batched_media_serialize_like_single_reviews(self):
+        reviews = Review.objects.order_by('id')
+        batched = ReviewSerializer(reviews, many=True).data
+        self.assertEqual(batched, [ReviewSerializer(review).data
+                                   for review in reviews])
+        self.assertEqual(
+            [(review['caption_media_type'], review['body_media_type'])
+             for review in batched[:3]],
+            [('image', 'video'), ('video', None), ('image', 'image')])
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        Review.objects.filter(id__gt=Review.objects.order_by(
+            'id')[2].id).update(approved=False)
+        with CaptureQueriesContext(connection) as small_page:
+            response = APIClient().get('/api/reviews/')
+        self.assertEqual(response.data['count'], 3)
+
+        Review.objects.update(approved=True)
+        with CaptureQueriesContext(connection) as full_page:
+            response = APIClient().get('/api/reviews/')
+        self.assertEqual(response.data['count'], 6)
+        self.assertEqual(len(full_page), len(small_page))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ArticleImageTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        html_file = File(file_type=FileType.objects.create(name='web'),
+                         file_group=FileGroup.objects.create(name='articles'))
+        html_file.resource.save('article.html', ContentFile(b'<p>draft</p>'),
+                                save=False)
+        html_file.save()
+        cls.article = Article.objects.create(
+            title='article', categories='art', html_file=html_file)
+        cls.url = f'/api/magazine/article/{cls.article.id}/'
+
+    def setUp(self):
+        cache.clear()
+
+    def put(self, html, *blob_srcs):
+        data = {'title': 'article', 'categories': 'art', 'html': html}
+        data.update((src, SimpleUploadedFile('image.png', png_data()))
+                    for src in blob_srcs)
+        return APIClient().put(self.url, data, format='multipart')
+
+    def put_ok(self, html, *blob_srcs):
+        response = self.put(html, *blob_srcs)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.article.refresh_from_db()
+        return response.data
+
+    def test_images_are_reconciled_with_the_html(self):
+        self.put_ok('<img src="blob:a"><p>text</p><img src="blob:b">',
+                    'blob:a', 'blob:b')
+        html_images = self.article.html_images
+        self.assertEqual(len(html_images), 2)
+        (a_url, a_id), (b_url, b_id) = sorted(
+            html_images.items(), key=lambda item: item[1])
+        self.assertEqual(self.article.thumbnail_image_id, a_id)
+        with self.article.html_file.resource.open('r') as html_file:
+            self.assertEqual(
+                html_file.read(),
+                f'<img src="{a_url}"><p>text</p><img src="{b_url}">')
+
+        # a dropped, c added in front of b
+        with self.captureOnCommitCallbacks(execute=True):
+            self.put_ok(f'<img src="blob:c"><img src="{b_url}">', 'blob:c')
+        c_url, = set(self.article.html_images) - {b_url}
+        self.assertEqual(self.article.html_images[b_url], b_id)
+        self.assertFalse(Image.objects.filter(id=a_id).exists())
+        self.assertEqual(self.article.thumbnail_image_id,
+                         self.article.html_images[c_url])
+
+        data = self.put_ok('<p>no images</p>')
+        self.assertEqual(self.article.html_images, {})
+        self.assertIsNone(self.article.thumbnail_image)
+        self.assertIsNone(data['thumbnail_url'])
+        self.assertFalse(Image.objects.exists())
+
+    def test_html_metadata_is_stored_read_only(self):
+        html = '<p>Four words of text</p><img src="blob:a">'
+        response = self.put(html, 'blob:a')
+        self.assertEqual(response.status_code, 200)
+        metadata = {'excerpt': 'Four words of text', 'word_count': 4,
+                    'reading_time': 1, 'image_count': 1}
+        self.assertEqual({field: response.data[field] for field in metadata},
+                         metadata)
+
+        data = {'title': 'article', 'categories': 'art',
+                'html': '<p>Three words here</p>', 'word_count': 1000,
+                'excerpt': 'forged'}
+        response = APIClient().put(self.url, data, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.article.refresh_from_db()
+        self.assertEqual(
+            (self.article.excerpt, self.article.word_count,
+             self.article.image_count), ('Three words here', 3, 0))
+
+    def test_unreferenced_uploads_are_not_kept(self):
+        self.put_ok('<img src="blob:a">', 'blob:a', 'blob:unused')
+        self.assertEqual(list(self.article.html_images.values()),
+                         list(Image.objects.values_list('id', flat=True)))
+
+    def test_missing_images_leave_the_article_unchanged(self):
+        self.put_ok('<img src="blob:a">', 'blob:a')
+        html_images = self.article.html_images
+
+        response = self.put('<img src="blob:b"><img src="blob:c">', 'blob:b')
+        self.assertEqual(response.status_code, 400)
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.html_images, html_images)
+        self.assertEqual(Image.objects.count(), 1)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RandomContestTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.thumbnail_image = Image(
+            file_group=FileGroup.objects.create(name='contests'))
+        cls.thumbnail_image.resource.save('banner.png',
+                                          ContentFile(png_data()))
+        cls.live = cls.create_contest('live', ends_in=timedelta(days=3))
+        cls.finished = cls.create_contest('finished',
+                                          ends_in=-timedelta(days=3))
+
+    @classmethod
+    def create_contest(cls, title, ends_in):
+        now = timezone.now()
+        return Contest.objects.create(
+            title=title, reward=100, details='', start_date=now - timedelta(
+                days=10), end_date=now + ends_in,
+            thumbnail_image=cls.thumbnail_image)
+
+    def setUp(self):
+        cache.clear()
+
+    def pick(self, exclude_id=0, random_value=0.5):
+        with mock.patch('random.random', return_value=random_value):
+            response = APIClient().get(
+                f'/api/contest/random/exclude/{exclude_id}/')
+        return response.data['title'] if response.status_code == 200 \
+            else response.status_code
+
+    def test_live_contests_are_picked_with_the_live_weight(self):
+        self.assertEqual(RandomContest.live_weight, 0.8)
+        self.assertEqual(self.pick(random_value=0.79), 'live')
+        self.assertEqual(self.pick(random_value=0.8), 'finished')
+
+        # without a choice, the weight doesn't matter
+        self.assertEqual(self.pick(self.live.id, 0.1), 'finished')
+        self.assertEqual(self.pick(self.finished.id, 0.9), 'live')
+
+    def test_the_excluded_contest_is_never_picked(self):
+        other_live = self.create_contest('other live', timedelta(days=1))
+        for _ in range(20):
+            self.assertEqual(self.pick(self.live.id, 0.1), 'other live')
+        other_live.delete()
+
+        self.finished.delete()
+        self.assertEqual(self.pick(self.live.id), 404)
+        self.live.delete()
+        self.assertEqual(self.pick(), 404)
+
+    def test_picks_load_only_the_picked_contest(self):
+        self.pick()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.pick(random_value=0.1), 'live')
+
+    def test_stale_ids_are_refreshed_once(self):
+        # as seen by a process which missed the deletion of a live contest
+        deleted_id = self.create_contest('deleted', timedelta(days=1)).id
+        stale_ids = get_contest_ids()
+        Contest.objects.filter(id=deleted_id).delete()
+        cache.set(CONTEST_IDS_CACHE_KEY, (array('q', [deleted_id]),
+                                          stale_ids[1]))
+
+        self.assertEqual(self.pick(self.live.id, 0.1), 'finished')
+        # refreshed
+        self.assertEqual(get_contest_ids(), (array('q', [self.live.id]),
+                                             stale_ids[1]))
+
+    def test_ids_expire_when_the_next_live_contest_ends(self):
+        self.create_contest('soon', timedelta(seconds=90))
+        with mock.patch('main.caching.cache.set') as cache_set:
+            get_contest_ids()
+        timeout = cache_set.call_args.args[2]
+        self.assertTrue(0 < timeout <= 90, timeout)
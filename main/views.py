@@ -1,8 +1,13 @@
 from django.shortcuts import render
+from django.utils.functional import cached_property
 from .models import Review
+from .caching import invalidate_moderation_counts
 
 # for wagtail models LCRUD operations
 from wagtail.admin.viewsets.model import ModelViewSet
+from wagtail.admin.views.bulk_action import BulkAction
+from wagtail.admin.views.generic import IndexView
+from wagtail.admin.ui.tables import BulkActionsCheckboxColumn
 
 from wagtail.admin.filters import WagtailFilterSet
 
@@ -35,6 +40,72 @@ class ReviewFilter(WagtailFilterSet):
 
 # Create your views here.
 
+class ReviewModerationBulkAction(BulkAction):
+    '''approves (or rejects, i.e unapproves) the reviews ticked in the
+    ReviewViewSet listing, with a single UPDATE. Offered in the listing's
+    bulk actions footer; registered in wagtail_hooks.py.'''
+
+    models = [Review]
+    template_name = "main/reviews/confirm_bulk_moderation.html"
+
+    # set by subclasses
+    approved = None
+
+    def check_perm(self, review):
+        return review_viewset.permission_policy.user_has_permission(
+            self.request.user, 'change')
+
+    def get_context_data(self, **kwargs):
+        return {**super().get_context_data(**kwargs),
+                "model_opts": Review._meta,
+                "header_icon": review_viewset.icon,
+                "action_verb": self.action_type}
+
+    @classmethod
+    def execute_action(cls, objects, **kwargs):
+        # (update() doesn't send the Review signals)
+        updated = Review.objects.filter(
+            id__in=[review.id for review in objects]).exclude(
+            approved=cls.approved).update(approved=cls.approved)
+        invalidate_moderation_counts(Review)
+        return updated, 0
+
+    def get_success_message(self, num_parent_objects, num_child_objects):
+        action = 'approved' if self.approved else 'rejected'
+        return f"{num_parent_objects} review(s) {action}."
+
+
+class ApproveReviewsBulkAction(ReviewModerationBulkAction):
+    display_name = "Approve"
+    action_type = "approve"
+    aria_label = "Approve selected reviews"
+    approved = True
+
+
+class RejectReviewsBulkAction(ReviewModerationBulkAction):
+    display_name = "Reject"
+    action_type = "reject"
+    aria_label = "Reject selected reviews"
+    approved = False
+
+
+class ReviewIndexView(IndexView):
+    '''the review listing, with a checkbox per review for the bulk
+    approve/reject actions'''
+
+    @cached_property
+    def columns(self):
+        return [
+            BulkActionsCheckboxColumn("bulk_actions", obj_type="review"),
+            *super().columns,
+        ]
+
+    def _get_title_column(self, *args, **kwargs):
+        return super()._get_title_column(
+            *args, **kwargs,
+            get_title_id=lambda review: f"review_{review.pk}_title")
+
+
 # views for wagtail models LCRUD operations
 class ReviewViewSet(ModelViewSet):
     model = Review
@@ -52,5 +123,9 @@ class ReviewViewSet(ModelViewSet):
     # practice, but for now this is the most viable solution)
     filterset_class = ReviewFilter
 
+    # the listing with the bulk approve/reject actions
+    index_view_class = ReviewIndexView
+    index_template_name = "main/reviews/index.html"
+
 
 review_viewset = ReviewViewSet("reviews")  # defines /admin/reviews/ as the base URL
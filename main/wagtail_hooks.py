@@ -1,9 +1,15 @@
 # wagtail_hooks.py
 
 from wagtail import hooks
-from .views import review_viewset
+from .views import (review_viewset, ApproveReviewsBulkAction,
+                    RejectReviewsBulkAction)
 
 
 @hooks.register("register_admin_viewset")
 def register_viewset():
     return review_viewset
+
+
+# bulk actions of the review listing (ReviewViewSet)
+hooks.register("register_bulk_action", ApproveReviewsBulkAction)
+hooks.register("register_bulk_action", RejectReviewsBulkAction)